@@ -1,4 +1,5 @@
 """Main APP module"""
+import logging
 import os
 from flask import Flask, make_response, jsonify, redirect
 from flask_sqlalchemy import SQLAlchemy
@@ -10,15 +11,27 @@ from flask_cors import CORS
 
 # local import
 from instance.config import app_config
+from app.encoding import json_encoder
 
 
-# initialize sql-alchemy
-db = SQLAlchemy()
+# initialize sql-alchemy. Committed objects keep their state, writes
+# fetch what the database generates with RETURNING instead
+db = SQLAlchemy(session_options={'expire_on_commit': False})
 
 # Get the instance config to use
 config_name = os.environ.get("APP_CONFIG", "production")
 APP = Flask(__name__, instance_relative_config=True)
 APP.config.from_object(app_config[config_name])
+APP.json_encoder = json_encoder(APP.config.get('JSON_ENCODER'))
+
+# APP.logger is the 'app' logger, so the modules' loggers write through
+# its handlers. Outside debug mode Flask's handler only writes errors,
+# this one writes the rest down to LOG_LEVEL
+LOG_HANDLER = logging.StreamHandler()
+LOG_HANDLER.setFormatter(logging.Formatter('[%(asctime)s] %(levelname)s in %(module)s: %(message)s'))
+LOG_HANDLER.addFilter(lambda record: not APP.debug and record.levelno < logging.ERROR)
+APP.logger.addHandler(LOG_HANDLER)
+APP.logger.setLevel(APP.config.get('LOG_LEVEL'))
 
 # overide 404 error handler
 
@@ -49,9 +62,13 @@ from app.restplus import API
 from app.endpoints.auth import auth_ns
 from app.endpoints.categories import categories_ns
 from app.endpoints.recipes import recipes_ns
+from app.endpoints.search import search_ns
+from app.endpoints.library import library_ns
 
 API.add_namespace(auth_ns)
 API.add_namespace(categories_ns)
 API.add_namespace(recipes_ns)
+API.add_namespace(search_ns)
+API.add_namespace(library_ns)
 API.init_app(APP)
 CORS(APP)
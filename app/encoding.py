@@ -0,0 +1,175 @@
+"""
+Response JSON encoding, optionally through a C-backed JSON library
+
+Every response body, payload fragment and export line is encoded by
+flask.json, which uses the application's json_encoder. json_encoder
+returns an encoder class handing the whole document to orjson or
+ujson, as selected by the JSON_ENCODER setting, and the stdlib encoder
+when neither is wanted or installed.
+"""
+import importlib
+import logging
+import uuid
+from datetime import date, datetime
+
+from flask import current_app, make_response
+from flask.json import JSONEncoder, dumps as flask_dumps
+
+# Linting exceptions
+
+# pylint: disable=C0103
+# pylint: disable=W0212
+
+logger = logging.getLogger(__name__)
+
+# The libraries JSON_ENCODER = 'fast' tries, fastest first
+FAST_ENCODERS = ('orjson', 'ujson')
+
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+def http_date(value):
+    """
+    Formats a date or datetime as werkzeug's http_date does, straight
+    from its fields rather than through a time tuple
+    """
+    if not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    return '%s, %02d %s %d %02d:%02d:%02d GMT' % (
+        WEEKDAYS[value.weekday()], value.day, MONTHS[value.month - 1], value.year,
+        value.hour, value.minute, value.second
+    )
+
+
+def _default(value):
+    """
+    Encodes the values JSON has no type for the way Flask's encoder
+    does, datetimes as HTTP dates in particular
+    """
+    if isinstance(value, date):
+        return http_date(value)
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if hasattr(value, '__html__'):
+        return str(value.__html__())
+    raise TypeError('{!r} is not JSON serializable'.format(value))
+
+
+def _orjson_dumps(orjson):
+    """
+    Returns the dumps function of orjson, which always writes UTF-8
+    and can only indent by two spaces
+    """
+    def dumps(value, sort_keys=False, indent=None, ensure_ascii=True):
+        """Encodes value to a JSON string"""
+        # Datetimes go through _default so they stay HTTP dates
+        option = orjson.OPT_PASSTHROUGH_DATETIME
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(value, default=_default, option=option).decode('utf-8')
+    return dumps
+
+
+def _ujson_dumps(ujson):
+    """
+    Returns the dumps function of ujson
+    """
+    def dumps(value, sort_keys=False, indent=None, ensure_ascii=True):
+        """Encodes value to a JSON string"""
+        return ujson.dumps(
+            value, default=_default, sort_keys=sort_keys, indent=indent or 0,
+            ensure_ascii=ensure_ascii, escape_forward_slashes=False
+        )
+    return dumps
+
+
+ENCODER_DUMPS = {
+    'orjson': _orjson_dumps,
+    'ujson': _ujson_dumps,
+}
+
+
+def load_dumps(name):
+    """
+    Returns the dumps function of the named library, or of the first
+    installed fast library for 'fast', and None for the stdlib encoder
+    or when the library is not installed
+
+    :param str name: 'stdlib', 'fast' or one of ENCODER_DUMPS
+    """
+    if name in (None, 'stdlib'):
+        return None
+    if name not in ('fast',) + tuple(ENCODER_DUMPS):
+        raise ValueError('Unknown JSON_ENCODER {!r}.'.format(name))
+    for library in FAST_ENCODERS if name == 'fast' else (name,):
+        try:
+            module = importlib.import_module(library)
+        except ImportError:
+            continue
+        return ENCODER_DUMPS[library](module)
+    logger.warning('JSON_ENCODER is %r but it is not installed, using the stdlib encoder.', name)
+    return None
+
+
+class DateJSONEncoder(JSONEncoder):
+    """Flask's JSON encoder, formatting datetimes with http_date"""
+
+    def default(self, o):
+        return _default(o)
+
+
+def json_encoder(name):
+    """
+    Returns the encoder class for app.json_encoder selected by name,
+    see load_dumps
+
+    Flask passes its JSON settings to the class, so the fast encoders
+    keep sorting keys and indenting as configured.
+    """
+    dumps = load_dumps(name)
+    if dumps is None:
+        return DateJSONEncoder
+
+    class FastJSONEncoder(DateJSONEncoder):
+        """Encodes whole documents with a C-backed library"""
+
+        library_dumps = staticmethod(dumps)
+
+        def encode(self, o):
+            return dumps(
+                o, sort_keys=self.sort_keys, indent=self.indent,
+                ensure_ascii=self.ensure_ascii
+            )
+
+    return FastJSONEncoder
+
+
+def compact_dumps(value):
+    """
+    Encodes value without whitespace with the app's json_encoder,
+    calling the fast encoders directly instead of through the per call
+    setup of flask.json.dumps
+    """
+    app = current_app._get_current_object()
+    library_dumps = getattr(app.json_encoder, 'library_dumps', None)
+    if library_dumps is None:
+        return flask_dumps(value, separators=(',', ':'))
+    return library_dumps(
+        value, sort_keys=app.config['JSON_SORT_KEYS'], ensure_ascii=app.config['JSON_AS_ASCII']
+    )
+
+
+def output_json(data, code, headers=None):
+    """
+    The RESTPlus JSON representation, encoding through the app's
+    json_encoder rather than the stdlib json module
+    """
+    settings = dict(current_app.config.get('RESTPLUS_JSON', {}))
+    if current_app.debug:
+        settings.setdefault('indent', 4)
+    response = make_response(flask_dumps(data, **settings) + "\n", code)
+    response.headers.extend(headers or {})
+    return response
@@ -1,12 +1,17 @@
 """The API routes"""
-from datetime import datetime, timedelta
-from werkzeug.security import check_password_hash, generate_password_hash
+import logging
+from datetime import datetime
 from flask import jsonify, request, make_response
 from flask_restplus import Resource
 from flask_jwt import jwt
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 
 from app import APP
-from app.helpers import decode_access_token
+from app.hashing import hash_password, needs_rehash, verify_password, HashingPoolSaturated
+from app.helpers import (
+    resolve_identity, revoke_user_tokens, service_busy, sweep_blacklist, violates_unique,
+    TOKEN_CACHE, USER_GENERATIONS
+)
 from app.helpers.validators import UserSchema
 from app.restplus import API
 from app.models import db, User, BlacklistToken
@@ -15,11 +20,12 @@ from app.serializers import add_user, login_user, password_reset
 # Linting exceptions
 
 # pylint: disable=C0103
-# pylint: disable=W0702
 # pylint: disable=W0703
 # pylint: disable=E1101
 # pylint: disable=R0201
 
+logger = logging.getLogger(__name__)
+
 auth_ns = API.namespace('auth', description="Authentication/Authorization operations.")
 
 @auth_ns.route('/register')
@@ -45,23 +51,23 @@ class RegisterHandler(Resource):
             )
             return make_response(jsonify(response_obj), 422)
 
-        # Check if user exists
-        email = data['email'].lower()
-        user = User.query.filter_by(email=email).first()
-        if not user:
-            try:
-                new_user = User(
-                    email=data['email'], username=data['username'], password=data['password']
-                )
-                db.session.add(new_user)
-                db.session.commit()
-                return make_response(jsonify({'message': 'Registered successfully!'}), 201)
-            except:
-                response = {"message": "Username already taken, please choose another."}
-                return make_response(jsonify(response), 401)
-        else:
-            response = jsonify({'message': 'User already exists. Please Log in instead.'})
-            return make_response(response, 400)
+        # The unique indexes on lower(email) and username reject duplicates
+        try:
+            new_user = User(
+                email=data['email'], username=data['username'], password=data['password']
+            )
+            db.session.add(new_user)
+            db.session.commit()
+            return make_response(jsonify({'message': 'Registered successfully!'}), 201)
+        except HashingPoolSaturated:
+            return service_busy()
+        except IntegrityError as e:
+            db.session.rollback()
+            if violates_unique(e, 'email'):
+                response = jsonify({'message': 'User already exists. Please Log in instead.'})
+                return make_response(response, 400)
+            response = {"message": "Username already taken, please choose another."}
+            return make_response(jsonify(response), 401)
 
 @auth_ns.route('/login')
 class LoginHandler(Resource):
@@ -81,11 +87,22 @@ class LoginHandler(Resource):
             user = User.query.filter_by(email=login_info['email']).first()
             if not user:
                 return make_response(jsonify({"message": 'User does not exist!'}), 404)
-            if check_password_hash(user.password, login_info['password']):
+            if verify_password(user.password, login_info['password']):
+                if needs_rehash(user.password):
+                    # upgrade the hash to the configured cost, or leave it
+                    # for a later login if the pool is busy or it cannot be saved
+                    try:
+                        user.password = hash_password(login_info['password'])
+                        db.session.commit()
+                    except HashingPoolSaturated:
+                        pass
+                    except SQLAlchemyError:
+                        db.session.rollback()
                 payload = {
-                    'exp':  datetime.utcnow() + timedelta(weeks=3),
+                    'exp':  datetime.utcnow() + APP.config['TOKEN_LIFETIME'],
                     'iat': datetime.utcnow(),
-                    'sub': user.public_id
+                    'sub': user.public_id,
+                    'gen': user.token_generation
                 }
                 token = jwt.encode(
                     payload,
@@ -98,6 +115,8 @@ class LoginHandler(Resource):
                                 "username": user.username
                                })
             return make_response(jsonify({"message": "Incorrect credentials."}), 401)
+        except HashingPoolSaturated:
+            return service_busy()
         except Exception as e:
             print(e)
             return make_response(jsonify({"message": "An error occurred. Please try again."}), 501)
@@ -114,25 +133,39 @@ class LogoutHandler(Resource):
         """
         access_token = request.headers.get('Authorization')
         if access_token:
-            result = decode_access_token(access_token)
+            result = resolve_identity()
             if not isinstance(result, str):
-                # mark the token as blacklisted
-                blacklisted_token = BlacklistToken(access_token)
+                by_generation = APP.config.get('TOKEN_REVOCATION') == 'generation'
                 try:
-                    # insert the token
-                    db.session.add(blacklisted_token)
-                    db.session.commit()
-                    response_obj = dict(
-                        status="success",
-                        message="Logged out successfully."
-                    )
-                    return make_response(jsonify(response_obj), 200)
+                    if by_generation:
+                        # move the user to a new token generation
+                        revoke_user_tokens(result.id)
+                    else:
+                        # mark the token as blacklisted
+                        blacklisted_token = BlacklistToken(access_token)
+                        # insert the token
+                        db.session.add(blacklisted_token)
+                        db.session.commit()
+                    TOKEN_CACHE.pop(access_token)
                 except Exception as e:
                     resp_obj = {
                         'status': 'fail',
-                        'message': e
+                        'message': str(e)
                     }
                     return make_response(jsonify(resp_obj), 200)
+                if not by_generation:
+                    # the logout has committed, a failed sweep is left
+                    # to the next one
+                    try:
+                        sweep_blacklist()
+                    except SQLAlchemyError as e:
+                        db.session.rollback()
+                        logger.warning("Could not sweep the blacklist: %s", e)
+                response_obj = dict(
+                    status="success",
+                    message="Logged out successfully."
+                )
+                return make_response(jsonify(response_obj), 200)
             else:
                 resp_obj = dict(
                     status="fail",
@@ -164,15 +197,21 @@ class PasswordResetResource(Resource):
 
         if user:
 
-            if check_password_hash(user.password, data['current_password']):
-                user.password = generate_password_hash(data['new_password'])
-                db.session.commit()
-                resp_obj = dict(
-                    status="Success!",
-                    message="Password reset successfully!"
-                )
-                resp_obj = jsonify(resp_obj)
-                return make_response(resp_obj, 200)
+            try:
+                if verify_password(user.password, data['current_password']):
+                    user.password = hash_password(data['new_password'])
+                    # a password reset revokes every token issued so far
+                    user.token_generation = User.token_generation + 1
+                    db.session.commit()
+                    USER_GENERATIONS.pop(user.id)
+                    resp_obj = dict(
+                        status="Success!",
+                        message="Password reset successfully!"
+                    )
+                    resp_obj = jsonify(resp_obj)
+                    return make_response(resp_obj, 200)
+            except HashingPoolSaturated:
+                return service_busy()
             resp_obj = dict(
                 status="Fail!",
                 message="Wrong current password. Try again."
@@ -1,15 +1,21 @@
 """The categories endpoints"""
 from flask import request, jsonify, make_response
 from flask_restplus import Resource
+from sqlalchemy.exc import IntegrityError
 from webargs.flaskparser import parser
 
+from app import queries
 from app.helpers import (
-    authorization_required, _pagination, _clean_name, is_unauthorized,
-    make_payload
+    authorization_required, cached_response, _paginate, _clean_name, is_unauthorized,
+    field_columns, fragment_list_response, listing_version, make_etag, make_payload,
+    not_modified, payload_fragment, select_rows, violates_unique, with_etag,
+    write_generation
 )
 from app.helpers.validators import CategorySchema
-from app.models import db, Category
-from app.parsers import SEARCH_PAGE_ARGS, make_args_parser
+from app.models import db, Category, delete_returning, update_returning
+from app.parsers import (
+    CATEGORY_FIELDS_ARGS, SEARCH_PAGE_ARGS, make_args_parser, make_fields_parser
+)
 from app.restplus import API
 from app.serializers import category
 
@@ -30,6 +36,7 @@ categories_ns = API.namespace(
 )
 
 args_parser = make_args_parser(categories_ns)
+fields_parser = make_fields_parser(categories_ns)
 
 @categories_ns.route('')
 class CategoryHandler(Resource):
@@ -56,81 +63,84 @@ class CategoryHandler(Resource):
 
         category_name = _clean_name(request_payload['name'])
 
-        # check if category exists
-        existing_category = current_user.categories.filter_by(
-            name=request_payload['name']
-        ).first()
-        if not existing_category:
-            name = request_payload['name']
-            owner = current_user.id
-            description = request_payload['description']
-
-            # Add new category
-            try:
-                new_category = Category(name, owner, description)
-                db.session.add(new_category)
-                db.session.commit()
-                response_payload = {
-                    "categories": make_payload(category=new_category)
-                }
-                response_payload = jsonify(response_payload)
-                return make_response(response_payload, 201)
-            except Exception as e:
-                response_payload = dict(
-                    message=str(e)
-                )
-                response_payload = jsonify(response_payload)
-                return make_response(response_payload, 501)
-        response_payload = dict(
-            message="The category already exists!"
-        )
-        response_payload = jsonify(response_payload)
-        return make_response(response_payload, 400)
+        name = request_payload['name']
+        owner = current_user.id
+        description = request_payload['description']
+
+        # Add new category, relying on the (user_id, name) index to reject duplicates
+        try:
+            new_category = Category(name, owner, description)
+            db.session.add(new_category)
+            db.session.commit()
+            response_payload = {
+                "categories": make_payload(category=new_category)
+            }
+            response_payload = jsonify(response_payload)
+            return make_response(response_payload, 201)
+        except IntegrityError as e:
+            db.session.rollback()
+            if not violates_unique(e, 'ix_categories_user_id_name'):
+                raise
+            response_payload = dict(
+                message="The category already exists!"
+            )
+            response_payload = jsonify(response_payload)
+            return make_response(response_payload, 400)
+        except Exception as e:
+            response_payload = dict(
+                message=str(e)
+            )
+            response_payload = jsonify(response_payload)
+            return make_response(response_payload, 501)
 
     @categories_ns.expect(args_parser)
     @authorization_required
+    @cached_response
     def get(current_user, self):
         """Returns a list of user's recipe categories"""
 
         if not current_user:
             return is_unauthorized()
 
-        if not current_user.categories.order_by(Category.id).all():
-            return make_response( \
-        jsonify({'message': 'No categories exist. Please create some.'}))
         # parse args if provided
-        args = parser.parse(SEARCH_PAGE_ARGS, request)
-        if 'q' in args: # pragma: no cover
-            try:
-                all_categories = current_user.categories.order_by(Category.id).filter(
-                    Category.name.ilike("%" + args['q'] + "%")
-                ).paginate(page=args['page'], per_page=args['per_page'], error_out=False)
-            except KeyError:
-                all_categories = current_user.categories.filter(
-                    Category.name.ilike("%" + args['q'] + "%")
-                ).paginate(page=1, per_page=5)
-        else:
-            all_categories = current_user.categories.order_by(Category.id).paginate(per_page=5)
-        base_url = request.base_url
-        if 'q' in args: # pragma: no cover
-            pagination_details = _pagination(all_categories, base_url, q=args['q'])            
-        else:
-            pagination_details = _pagination(all_categories, base_url)
+        args = parser.parse(dict(SEARCH_PAGE_ARGS, **CATEGORY_FIELDS_ARGS), request)
+        fields = args.get('fields')
+        user_categories = current_user.categories
+        if 'q' in args:
+            user_categories = user_categories.filter(
+                Category.name.ilike("%" + args['q'] + "%")
+            )
+        latest, total = listing_version(user_categories, Category)
+        etag = make_etag(
+            'categories', current_user.id, latest, total, write_generation(current_user.id), args
+        )
+        cached = not_modified(etag, weak=True)
+        if cached:
+            return cached
+        try:
+            all_categories, pagination_details = _paginate(
+                select_rows(user_categories, Category, fields, args.get('sort')),
+                Category, args, request.base_url, total=total
+            )
+        except ValueError:
+            return make_response(jsonify({'message': 'Invalid cursor.'}), 400)
         categories = []
-        for each_category in all_categories.items:
-            this_category = make_payload(category=each_category)
+        for each_category in all_categories:
+            this_category = payload_fragment(category=each_category, fields=fields)
             categories.append(this_category)
         if categories:
-            response_payload = {
-                "categories": categories,
-                "page_details": pagination_details
-            }
-            return make_response(jsonify(response_payload), 200)
+            response = fragment_list_response(
+                'categories', categories, page_details=pagination_details
+            )
+            return with_etag(response, etag, weak=True)
+        if not db.session.query(current_user.categories.exists()).scalar():
+            return make_response( \
+        jsonify({'message': 'No categories exist. Please create some.'}))
         response_payload = {
             "message": "Category does not exist."
         }
         return make_response(jsonify(response_payload), 400)
-        
+
 
 @categories_ns.route('/<int:id>')
 class SingleCategoryResource(Resource):
@@ -140,6 +150,7 @@ class SingleCategoryResource(Resource):
     """
 
     @authorization_required
+    @categories_ns.expect(fields_parser)
     def get(current_user, self, id):
         """
         Returns the specified category
@@ -149,15 +160,24 @@ class SingleCategoryResource(Resource):
 
         if not current_user:
             return is_unauthorized()
+        fields = parser.parse(CATEGORY_FIELDS_ARGS, request).get('fields')
         # retrieve specified category
-        specified_category = current_user.categories.filter_by(id=id).first()
+        specified_category = queries.user_category(
+            current_user.id, id, field_columns(Category, fields)
+        )
 
         if specified_category:
+            etag = make_etag(
+                'category', specified_category.id, specified_category.updated_on, fields
+            )
+            cached = not_modified(etag)
+            if cached:
+                return cached
             response_payload = {
-                "categories": [make_payload(category=specified_category)]
+                "categories": [make_payload(category=specified_category, fields=fields)]
             }
             response_payload = jsonify(response_payload)
-            return make_response(response_payload, 200)
+            return with_etag(make_response(response_payload, 200), etag)
         response_payload = dict(
             message="Sorry, category does not exist!"
         )
@@ -176,48 +196,40 @@ class SingleCategoryResource(Resource):
         if not current_user:
             return is_unauthorized()
 
-        # retrieve specified category
-        specified_category = current_user.categories.filter_by(id=id).first()
-
-        if specified_category:
-            # Get request data
-            request_payload = request.get_json()
-            # format new name
-            new_category_name = request_payload['name']
-            # Ensure the category name does not match that any of the user's
-            # existing category apart from the one they are editing
-            existing_category = current_user.categories.filter(
-                Category.name == new_category_name,
-                Category.id != specified_category.id
-            ).first()
-
-            # return appropriate response
-            if not existing_category:
-                if new_category_name != specified_category.name:
-                    old_category_name = specified_category.name
-                    specified_category.name = new_category_name
-                    specified_category.description = request_payload['description']
-                    db.session.commit()
-                    response_payload = dict(
-                        message="Category '{}' was successfully updated to '{}'.".format(
-                            old_category_name, specified_category.name
-                        )
-                    )
-                else:
-                    specified_category.description = request_payload['description']
-                    db.session.commit()
-                    response_payload = dict(
-                        message="Category '{}' was successfully updated.".format(
-                            specified_category.name
-                        )
-                    )
-                response_payload = jsonify(response_payload)
-                return make_response(response_payload, 200)
+        # Get request data
+        request_payload = request.get_json()
+        # Update the category in one statement scoped to its owner, relying
+        # on the (user_id, name) index to reject names already in use
+        try:
+            updated_category = update_returning(
+                Category, (Category.id == id, Category.user_id == current_user.id),
+                dict(name=request_payload['name'], description=request_payload['description'])
+            )
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
             response_payload = dict(
                 message="Category already exists, please use a different name."
             )
             return make_response(jsonify(response_payload), 401)
 
+        # return appropriate response
+        if updated_category:
+            if updated_category.old_name != updated_category.name:
+                response_payload = dict(
+                    message="Category '{}' was successfully updated to '{}'.".format(
+                        updated_category.old_name, updated_category.name
+                    )
+                )
+            else:
+                response_payload = dict(
+                    message="Category '{}' was successfully updated.".format(
+                        updated_category.name
+                    )
+                )
+            response_payload = jsonify(response_payload)
+            return make_response(response_payload, 200)
+
         response_payload = dict(
             message="Sorry, category does not exist!"
         )
@@ -235,16 +247,18 @@ class SingleCategoryResource(Resource):
         if not current_user:
             return is_unauthorized()
 
-        # retrieve specified category
-        specified_category = current_user.categories.filter_by(id=id).first()
+        # delete the specified category, its recipes go with it in the database
+        deleted_category = delete_returning(
+            Category, (Category.id == id, Category.user_id == current_user.id), Category.name
+        )
 
-        if specified_category:
-            category_name = specified_category.name
-            db.session.delete(specified_category)
+        if deleted_category:
             db.session.commit()
 
             response_payload = {
-                "message": "Category '{}' was deleted successfully.".format(category_name)
+                "message": "Category '{}' was deleted successfully.".format(
+                    deleted_category.name
+                )
             }
             response_payload = jsonify(response_payload)
             return make_response(response_payload, 200)
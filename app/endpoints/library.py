@@ -0,0 +1,183 @@
+"""The library endpoints, which move a user's whole library in and out"""
+import csv
+import zlib
+
+from flask import request, jsonify, make_response, stream_with_context
+from flask_restplus import Resource
+
+from app import APP
+from app.encoding import compact_dumps
+from app.models import Category, Recipe
+from app.restplus import API
+from app.helpers import authorization_required, is_unauthorized, make_payload, select_rows
+from app.helpers.importer import LibraryImport, read_records
+from app.helpers.instrumentation import allow_repeated_queries
+
+# Linting exceptions
+
+# pylint: disable=C0103
+# pylint: disable=E0213
+# pylint: disable=E1101
+# pylint: disable=W0613
+
+library_ns = API.namespace(
+    'library', description='The endpoints for exporting and importing a user\'s whole library',
+    path='/library'
+)
+
+# The import format of each accepted content type
+IMPORT_CONTENT_TYPES = {
+    'application/x-ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+    'text/csv': 'csv',
+}
+
+# Bytes of NDJSON gathered before a chunk is sent or compressed
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+
+def _export_lines(user_id):
+    """
+    Yields a line of NDJSON for each of a user's categories, then for
+    each of their recipes.
+
+    Rows are read as plain tuples through a server-side cursor,
+    EXPORT_YIELD_PER at a time, so memory use does not grow with the
+    size of the library.
+    """
+    yield_per = APP.config.get('EXPORT_YIELD_PER', 1000)
+    categories = select_rows(
+        Category.query.filter_by(user_id=user_id), Category
+    ).order_by(Category.id)
+    for each_category in categories.yield_per(yield_per):
+        yield _export_line('category', make_payload(category=each_category))
+    recipes = select_rows(
+        Recipe.query.filter_by(user_id=user_id), Recipe
+    ).order_by(Recipe.category_id, Recipe.id)
+    for each_recipe in recipes.yield_per(yield_per):
+        yield _export_line('recipe', make_payload(recipe=each_recipe))
+
+
+def _export_line(item_type, payload):
+    """
+    Returns the NDJSON line of an exported category or recipe
+    """
+    payload['type'] = item_type
+    return compact_dumps(payload) + '\n'
+
+
+def _chunked(lines):
+    """
+    Joins lines into chunks of about EXPORT_CHUNK_SIZE bytes
+    """
+    chunk, size = [], 0
+    for line in lines:
+        chunk.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_SIZE:
+            yield ''.join(chunk).encode('utf-8')
+            chunk, size = [], 0
+    if chunk:
+        yield ''.join(chunk).encode('utf-8')
+
+
+def _gzipped(chunks):
+    """
+    Compresses a stream of chunks into a single gzip member
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+@library_ns.route('/export')
+class LibraryExportHandler(Resource):
+    """
+    This class defines the endpoint for downloading all of a user's
+    categories and recipes in one response
+    """
+
+    @authorization_required
+    def get(current_user, self):
+        """
+        Streams the user's categories and recipes as NDJSON
+
+        Each line is a category or recipe payload with a ``type`` of
+        ``category`` or ``recipe``, categories first. The stream is
+        gzip encoded on the fly when the client accepts it.
+        """
+
+        if not current_user:
+            return is_unauthorized()
+
+        body = _chunked(_export_lines(current_user.id))
+        headers = {
+            'Content-Disposition': 'attachment; filename=yummy-library.ndjson',
+            'Vary': 'Accept-Encoding'
+        }
+        if request.accept_encodings['gzip']:
+            body = _gzipped(body)
+            headers['Content-Encoding'] = 'gzip'
+        return APP.response_class(
+            stream_with_context(body), mimetype='application/x-ndjson', headers=headers
+        )
+
+
+@library_ns.route('/import')
+class LibraryImportHandler(Resource):
+    """
+    This class defines the endpoint for loading a library dump into a
+    user's account
+    """
+
+    @authorization_required
+    def post(current_user, self):
+        """
+        Imports categories and recipes from an NDJSON or CSV body
+
+        The body is either the NDJSON of an export, sent as
+        application/x-ndjson, or text/csv with type, name, description,
+        ingredients and category columns, optionally gzip encoded. It is
+        read as a stream and saved IMPORT_CHUNK_SIZE items at a time.
+        Existing categories are reused and recipes whose name is already
+        taken in their category are skipped.
+
+        :return dict categories: The number of categories created and already existing\n
+        :return dict recipes: The number of recipes created and skipped\n
+        :return list errors: The line and problem of the first invalid items
+        """
+
+        if not current_user:
+            return is_unauthorized()
+
+        import_format = IMPORT_CONTENT_TYPES.get(request.mimetype)
+        if not import_format:
+            response_payload = dict(
+                message='Send the library as application/x-ndjson or text/csv.'
+            )
+            return make_response(jsonify(response_payload), 415)
+        records = read_records(
+            request.stream, import_format,
+            compressed=request.headers.get('Content-Encoding') == 'gzip'
+        )
+        library_import = LibraryImport(current_user.id, APP.config.get('IMPORT_CHUNK_SIZE', 1000))
+        try:
+            with allow_repeated_queries():
+                report = library_import.run(records)
+        except (OSError, EOFError, UnicodeDecodeError, csv.Error):
+            response_payload = dict(
+                message='The library could not be read past line {}, the items up to it '
+                        'were imported.'.format(library_import.lines_read),
+                **library_import.report()
+            )
+            return make_response(jsonify(response_payload), 400)
+        response_payload = dict(
+            message='Imported {} categories and {} recipes.'.format(
+                report['categories']['created'], report['recipes']['created']
+            ),
+            **report
+        )
+        return make_response(jsonify(response_payload), 200)
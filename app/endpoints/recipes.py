@@ -1,17 +1,25 @@
 """The recipes endpoints"""
 from flask import request, jsonify, make_response
 from flask_restplus import Resource
+from sqlalchemy.exc import IntegrityError
 from webargs.flaskparser import parser
 
-from app.models import db, Recipe
-from app.serializers import recipe
+from app import queries
+from app.models import db, Recipe, delete_returning, relink_ingredients, update_returning
+from app.serializers import recipe, recipe_batch, recipe_update_batch
 from app.restplus import API
 from app.helpers import (
-    authorization_required, _clean_name, _pagination, is_unauthorized,
-    make_payload
+    authorization_required, cached_response, _clean_name, _paginate, is_unauthorized,
+    field_columns, fragment_list_response, listing_version, make_etag, make_payload,
+    not_modified, payload_fragment, select_rows, violates_unique, with_etag,
+    write_generation
 )
+from app.helpers.instrumentation import allow_repeated_queries
 from app.helpers.validators import RecipeSchema
-from app.parsers import SEARCH_PAGE_ARGS, make_args_parser
+from app.parsers import (
+    RECIPE_FIELDS_ARGS, RECIPE_IDS_ARGS, SEARCH_PAGE_ARGS, make_args_parser,
+    make_fields_parser, make_ids_parser
+)
 
 # Linting exceptions
 
@@ -26,6 +34,8 @@ recipes_ns = API.namespace(
 )
 
 args_parser = make_args_parser(recipes_ns)
+fields_parser = make_fields_parser(recipes_ns)
+ids_parser = make_ids_parser(recipes_ns)
 def _does_not_exist():
     """Returns recipe does not exist message"""
     response_payload = dict(
@@ -34,6 +44,66 @@ def _does_not_exist():
     response_payload = jsonify(response_payload)
     return make_response(response_payload, 404)
 
+def _missing_recipe_or_category(current_user, category_id):
+    """
+    Returns the response for a write that matched no recipe, telling
+    apart a missing recipe from a missing category
+    """
+    if queries.user_category(current_user.id, category_id, ('id',)):
+        return _does_not_exist()
+    response_payload = dict(
+        message='Category does not exist!'
+    )
+    response_payload = jsonify(response_payload)
+    return make_response(response_payload, 404)
+
+def _invalid_category():
+    """Returns invalid category message"""
+    response_payload = dict(
+        message='Invalid category!'
+    )
+    response_payload = jsonify(response_payload)
+    return make_response(response_payload, 400)
+
+def _load_batch_item(item, recipe_schema):
+    """
+    Validates a batch item the way a single recipe is validated
+
+    :returns tuple: The loaded recipe details and None, or None and the item's failed result
+    """
+    item = dict(item)
+    if isinstance(item.get('name'), str):
+        item['name'] = _clean_name(item['name'])
+    request_payload, errors = recipe_schema.load(item)
+    if errors:
+        return None, dict(
+            status=422,
+            message="You provided some invalid details.",
+            errors=errors
+        )
+    return request_payload, None
+
+def _batch_response(results, success_status):
+    """
+    Returns the per item results of a batch, with a 207 status unless
+    every item succeeded
+    """
+    if all(result['status'] == success_status for result in results):
+        status = success_status
+    else:
+        status = 207
+    response_payload = dict(
+        results=results
+    )
+    return make_response(jsonify(response_payload), status)
+
+def _batch_conflict():
+    """Returns the response for a batch that raced a concurrent write"""
+    response_payload = dict(
+        message='Some recipes were changed while the batch was saved, please retry.'
+    )
+    return make_response(jsonify(response_payload), 409)
+
 @recipes_ns.route('')
 class GeneralRecipesHandler(Resource):
     """
@@ -67,7 +137,7 @@ class GeneralRecipesHandler(Resource):
                 errors=errors
             )
             return make_response(jsonify(response_payload), 422)
-        category = current_user.categories.filter_by(id=category_id).first()
+        category = queries.user_category(current_user.id, category_id)
         if category:
             new_recipe = Recipe(
                 name=request_payload['name'],
@@ -76,10 +146,8 @@ class GeneralRecipesHandler(Resource):
                 ingredients=request_payload['ingredients'],
                 description=request_payload['description']
             )
-            existing_recipe = category.recipes.filter_by(
-                name=request_payload['name']
-            ).first()
-            if not existing_recipe:
+            # The (category_id, name) index rejects duplicates
+            try:
                 db.session.add(new_recipe)
                 db.session.commit()
                 response_payload = {
@@ -87,6 +155,10 @@ class GeneralRecipesHandler(Resource):
                 }
                 response_payload = jsonify(response_payload)
                 return make_response(response_payload, 201)
+            except IntegrityError as e:
+                db.session.rollback()
+                if not violates_unique(e, 'ix_recipes_category_id_name'):
+                    raise
             response_payload = dict(
                 message='Recipe already exists!'
             )
@@ -99,6 +171,7 @@ class GeneralRecipesHandler(Resource):
         return make_response(response_payload, 400)
 
     @authorization_required
+    @cached_response
     @recipes_ns.expect(args_parser)
     def get(current_user, self, category_id):
         """
@@ -112,47 +185,43 @@ class GeneralRecipesHandler(Resource):
         if not current_user:
             return is_unauthorized()
 
-        category = current_user.categories.filter_by(id=category_id).first()
+        category = queries.user_category(current_user.id, category_id)
         if category:
-            recipes = category.recipes.all()
-
-            if not recipes:
-                response_payload = dict(
-                    message='No recipes added to this category yet!'
-                )
-                response_payload = jsonify(response_payload)
-                return make_response(response_payload, 404)
-
             # search and/or paginate
-            args = parser.parse(SEARCH_PAGE_ARGS, request)
-            if 'q' in args:
-                try:
-                    recipes = current_user.recipes.filter(
-                        Recipe.name.ilike("%" + args['q'] + "%"),
-                        Recipe.category_id == category.id
-                    ).paginate(page=args['page'], per_page=args['per_page'], error_out=False)
-                except KeyError:
-                    recipes = current_user.recipes.filter(
-                        Recipe.name.ilike("%" + args['q'] + "%"),
-                        Recipe.category_id == category.id
-                    ).paginate(page=1, per_page=5)
-            else:
-                recipes = category.recipes.paginate(per_page=2)
-            base_url = request.base_url
+            args = parser.parse(dict(SEARCH_PAGE_ARGS, **RECIPE_FIELDS_ARGS), request)
+            fields = args.get('fields')
+            recipes = category.recipes
             if 'q' in args:
-                pagination_details = _pagination(recipes, base_url, q=args['q'])
-            else:
-                pagination_details = _pagination(recipes, base_url)
+                recipes = recipes.filter(Recipe.name.ilike("%" + args['q'] + "%"))
+            latest, total = listing_version(recipes, Recipe)
+            etag = make_etag(
+                'recipes', category.id, latest, total, write_generation(current_user.id), args
+            )
+            cached = not_modified(etag, weak=True)
+            if cached:
+                return cached
+            try:
+                recipes, pagination_details = _paginate(
+                    select_rows(recipes, Recipe, fields, args.get('sort')),
+                    Recipe, args, request.base_url, total=total
+                )
+            except ValueError:
+                return make_response(jsonify({'message': 'Invalid cursor.'}), 400)
             user_recipes = []
-            for current_recipe in recipes.items:
-                this_recipe = make_payload(recipe=current_recipe)
+            for current_recipe in recipes:
+                this_recipe = payload_fragment(recipe=current_recipe, fields=fields)
                 user_recipes.append(this_recipe)
             if user_recipes:
-                response_payload = {
-                    "recipes": user_recipes,
-                    "page_details": pagination_details
-                }
-                return make_response(jsonify(response_payload), 200)
+                response = fragment_list_response(
+                    'recipes', user_recipes, page_details=pagination_details
+                )
+                return with_etag(response, etag, weak=True)
+            if not db.session.query(category.recipes.exists()).scalar():
+                response_payload = dict(
+                    message='No recipes added to this category yet!'
+                )
+                response_payload = jsonify(response_payload)
+                return make_response(response_payload, 404)
             response_payload = {
                 "message": "Recipe does not exist."
             }
@@ -171,6 +240,7 @@ class SingleRecipeHandler(Resource):
     """
 
     @authorization_required
+    @recipes_ns.expect(fields_parser)
     def get(current_user, self, category_id, recipe_id):
         """
         This returns a specific recipe from the specified category
@@ -183,20 +253,27 @@ class SingleRecipeHandler(Resource):
         if not current_user:
             return is_unauthorized()
 
-        category = current_user.categories.filter_by(id=category_id).first()
+        fields = parser.parse(RECIPE_FIELDS_ARGS, request).get('fields')
+        category = queries.user_category(current_user.id, category_id)
         if category:
-            selected_recipe = category.recipes.filter_by(id=recipe_id).first()
+            selected_recipe = queries.category_recipe(
+                category.id, recipe_id, field_columns(Recipe, fields)
+            )
 
             # When the recipe requested does not exist
             if not selected_recipe:
                 return _does_not_exist()
 
+            etag = make_etag('recipe', selected_recipe.id, selected_recipe.updated_on, fields)
+            cached = not_modified(etag)
+            if cached:
+                return cached
             # Return the recipe
             response_payload = {
-                "recipes": [make_payload(recipe=selected_recipe)]
+                "recipes": [make_payload(recipe=selected_recipe, fields=fields)]
             }
             response_payload = jsonify(response_payload)
-            return make_response(response_payload, 200)
+            return with_etag(make_response(response_payload, 200), etag)
         # When an invalid category id is provided
         response_payload = dict(
             message='Category does not exist!'
@@ -217,58 +294,53 @@ class SingleRecipeHandler(Resource):
         if not current_user:
             return is_unauthorized()
 
-        category = current_user.categories.filter_by(id=category_id).first()
-        if category:
-            selected_recipe = category.recipes.filter_by(id=recipe_id).first()
-
-            # When the recipe requested does not exist
-            if not selected_recipe:
-                return _does_not_exist()
-            # Get request data
-            request_payload = request.get_json()
-            new_recipe_name = _clean_name(request_payload['name'])
-            # Check if name provided is of an existing recipe
-            existing_recipe = current_user.recipes.filter(
-                Recipe.name == new_recipe_name,
-                Recipe.id != selected_recipe.id
-            ).first()
-            if not existing_recipe:
-                if new_recipe_name != selected_recipe.name:
-                    old_recipe_name = selected_recipe.name
-                    # Update recipe
-                    selected_recipe.name = new_recipe_name
-                    selected_recipe.ingredients = request_payload['ingredients']
-                    selected_recipe.description = request_payload['description']
-
-                    db.session.commit()
-
-                    # Return appropriate message saying the recipe was updated
-                    response_payload = {
-                        "message": "Recipe '{}' was successfully updated to '{}'.".format(
-                            old_recipe_name, new_recipe_name
-                        )
-                    }
-                else:
-                    selected_recipe.ingredients = request_payload['ingredients']
-                    selected_recipe.description = request_payload['description']
-
-                    db.session.commit()
+        # Get request data
+        request_payload = request.get_json()
+        new_recipe_name = _clean_name(request_payload['name'])
+        # Update the recipe in one statement scoped to its category and
+        # owner, relying on the (category_id, name) index to reject names
+        # already in use
+        try:
+            updated_recipe = update_returning(
+                Recipe, (
+                    Recipe.id == recipe_id, Recipe.category_id == category_id,
+                    Recipe.user_id == current_user.id
+                ), dict(
+                    name=new_recipe_name,
+                    ingredients=request_payload['ingredients'],
+                    description=request_payload['description']
+                ), previous=('name', 'ingredients')
+            )
+            if updated_recipe and updated_recipe.ingredients != updated_recipe.old_ingredients:
+                relink_ingredients(updated_recipe.id, updated_recipe.ingredients)
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            response_payload = dict(
+                message='Recipe already exists!'
+            )
+            return make_response(jsonify(response_payload), 400)
 
-                    # Return appropriate message saying the recipe was updated
-                    response_payload = {
-                        "message": "Recipe '{}' was successfully updated.".format(
-                            selected_recipe.name
-                        ),
-                        "recipe": make_payload(recipe=selected_recipe)
-                    }
-                response_payload = jsonify(response_payload)
-                return make_response(response_payload, 200)
-        # When an invalid category id is provided
-        response_payload = dict(
-            message='Category does not exist!'
-        )
+        # When the recipe or category requested does not exist
+        if not updated_recipe:
+            return _missing_recipe_or_category(current_user, category_id)
+        if updated_recipe.old_name != updated_recipe.name:
+            # Return appropriate message saying the recipe was updated
+            response_payload = {
+                "message": "Recipe '{}' was successfully updated to '{}'.".format(
+                    updated_recipe.old_name, updated_recipe.name
+                )
+            }
+        else:
+            # Return appropriate message saying the recipe was updated
+            response_payload = {
+                "message": "Recipe '{}' was successfully updated.".format(
+                    updated_recipe.name
+                ),
+                "recipe": make_payload(recipe=updated_recipe)
+            }
         response_payload = jsonify(response_payload)
-        return make_response(response_payload, 404)
+        return make_response(response_payload, 200)
 
     @authorization_required
     def delete(current_user, self, category_id, recipe_id):
@@ -282,25 +354,187 @@ class SingleRecipeHandler(Resource):
         if not current_user:
             return is_unauthorized()
 
-        category = current_user.categories.filter_by(id=category_id).first()
-        if category:
-            selected_recipe = category.recipes.filter_by(id=recipe_id).first()
-            # When the recipe requested does not exist
-            if not selected_recipe:
-                return _does_not_exist()
-            name = selected_recipe.name
-            # Delete the selected recipe
-            db.session.delete(selected_recipe)
-            db.session.commit()
-            # Render response
-            response_payload = {
-                "message": "Recipe " + name + " was deleted successfully!"
-            }
-            response_payload = jsonify(response_payload)
-            return make_response(response_payload, 200)
-        # When an invalid category id is provided
-        response_payload = dict(
-            message='Category does not exist!'
+        # Delete the selected recipe
+        deleted_recipe = delete_returning(
+            Recipe, (
+                Recipe.id == recipe_id, Recipe.category_id == category_id,
+                Recipe.user_id == current_user.id
+            ), Recipe.name
         )
+        # When the recipe or category requested does not exist
+        if not deleted_recipe:
+            return _missing_recipe_or_category(current_user, category_id)
+        db.session.commit()
+        # Render response
+        response_payload = {
+            "message": "Recipe " + deleted_recipe.name + " was deleted successfully!"
+        }
         response_payload = jsonify(response_payload)
-        return make_response(response_payload, 404)
+        return make_response(response_payload, 200)
+
+@recipes_ns.route('/batch')
+class RecipeBatchHandler(Resource):
+    """
+    This class defines the endpoints for creating, updating and deleting
+    many recipes of a category in a single request.
+
+    Every item is validated before anything is written, duplicate names
+    are looked up in one query and the writes share one transaction.
+    Each item gets its own status in ``results``, in request order, and
+    the response is a 207 unless all of them succeeded.
+    """
+
+    @authorization_required
+    @API.expect(recipe_batch)
+    def post(current_user, self, category_id):
+        """
+        Create many recipes in the specified category
+
+        :param int category_id: The id of the category to which recipes should be added\n
+        :return list results: The status and recipe or errors of each item
+        """
+
+        if not current_user:
+            return is_unauthorized()
+
+        category = queries.user_category(current_user.id, category_id)
+        if not category:
+            return _invalid_category()
+        items = request.get_json()['recipes']
+        recipe_schema = RecipeSchema()
+        results = [None] * len(items)
+        valid_items = []
+        for index, item in enumerate(items):
+            request_payload, results[index] = _load_batch_item(item, recipe_schema)
+            if request_payload:
+                valid_items.append((index, request_payload))
+        names = {request_payload['name'] for _, request_payload in valid_items}
+        taken = {
+            name for name, in db.session.query(Recipe.name).filter(
+                Recipe.category_id == category.id, Recipe.name.in_(names)
+            )
+        } if names else set()
+        new_recipes = []
+        for index, request_payload in valid_items:
+            if request_payload['name'] in taken:
+                results[index] = dict(status=400, message='Recipe already exists!')
+                continue
+            taken.add(request_payload['name'])
+            new_recipes.append((index, Recipe(
+                name=request_payload['name'],
+                category_id=category.id,
+                user_id=current_user.id,
+                ingredients=request_payload['ingredients'],
+                description=request_payload['description']
+            )))
+        if new_recipes:
+            try:
+                with allow_repeated_queries():
+                    db.session.add_all([new_recipe for _, new_recipe in new_recipes])
+                    db.session.commit()
+            except IntegrityError as e:
+                db.session.rollback()
+                if not violates_unique(e, 'ix_recipes_category_id_name'):
+                    raise
+                return _batch_conflict()
+            for index, new_recipe in new_recipes:
+                results[index] = dict(status=201, recipe=make_payload(recipe=new_recipe))
+        return _batch_response(results, 201)
+
+    @authorization_required
+    @API.expect(recipe_update_batch)
+    def put(current_user, self, category_id):
+        """
+        Update many recipes of the specified category
+
+        :param int category_id: The id of the category whose recipes to update\n
+        :return list results: The status and recipe or errors of each item
+        """
+
+        if not current_user:
+            return is_unauthorized()
+
+        category = queries.user_category(current_user.id, category_id)
+        if not category:
+            return _invalid_category()
+        items = request.get_json()['recipes']
+        recipe_schema = RecipeSchema()
+        results = [None] * len(items)
+        valid_items = []
+        for index, item in enumerate(items):
+            request_payload, results[index] = _load_batch_item(item, recipe_schema)
+            if request_payload:
+                valid_items.append((index, item['id'], request_payload))
+        ids = {recipe_id for _, recipe_id, _ in valid_items}
+        names = {request_payload['name'] for _, _, request_payload in valid_items}
+        selected_recipes = {
+            each_recipe.id: each_recipe
+            for each_recipe in category.recipes.filter(Recipe.id.in_(ids))
+        } if ids else {}
+        # A name stays taken by its current recipe until the batch is saved
+        taken = dict(
+            db.session.query(Recipe.name, Recipe.id).filter(
+                Recipe.category_id == category.id, Recipe.name.in_(names)
+            )
+        ) if names else {}
+        updated = []
+        for index, recipe_id, request_payload in valid_items:
+            selected_recipe = selected_recipes.get(recipe_id)
+            if not selected_recipe:
+                results[index] = dict(status=404, message='Recipe does not exist!')
+                continue
+            if recipe_id in updated:
+                results[index] = dict(status=400, message='Recipe is repeated in this batch!')
+                continue
+            if taken.setdefault(request_payload['name'], recipe_id) != recipe_id:
+                results[index] = dict(status=400, message='Recipe already exists!')
+                continue
+            selected_recipe.name = request_payload['name']
+            selected_recipe.ingredients = request_payload['ingredients']
+            selected_recipe.description = request_payload['description']
+            updated.append(recipe_id)
+            results[index] = dict(status=200, id=recipe_id)
+        if updated:
+            try:
+                with allow_repeated_queries():
+                    db.session.commit()
+            except IntegrityError:
+                db.session.rollback()
+                return _batch_conflict()
+            for result in results:
+                if result['status'] == 200:
+                    result['recipe'] = make_payload(recipe=selected_recipes[result.pop('id')])
+        return _batch_response(results, 200)
+
+    @authorization_required
+    @recipes_ns.expect(ids_parser)
+    def delete(current_user, self, category_id):
+        """
+        Delete many recipes of the specified category
+
+        :param int category_id: The id of the category whose recipes to delete\n
+        :return list results: The id and status of each item
+        """
+
+        if not current_user:
+            return is_unauthorized()
+
+        category = queries.user_category(current_user.id, category_id)
+        if not category:
+            return _invalid_category()
+        ids = parser.parse(RECIPE_IDS_ARGS, request)['ids']
+        found = {
+            recipe_id for recipe_id, in db.session.query(Recipe.id).filter(
+                Recipe.category_id == category.id, Recipe.id.in_(ids)
+            )
+        }
+        if found:
+            Recipe.query.filter(Recipe.id.in_(found)).delete(synchronize_session=False)
+            db.session.commit()
+        results = []
+        for recipe_id in ids:
+            if recipe_id in found:
+                results.append(dict(id=recipe_id, status=200, message='Recipe was deleted.'))
+            else:
+                results.append(dict(id=recipe_id, status=404, message='Recipe does not exist!'))
+        return _batch_response(results, 200)
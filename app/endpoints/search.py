@@ -0,0 +1,214 @@
+"""The search endpoints"""
+from flask import request, jsonify, make_response
+from flask_restplus import Resource
+from sqlalchemy import case, cast, func, literal, or_, select, tuple_
+from webargs.flaskparser import parser
+
+from app.models import db, Ingredient, Recipe, recipe_ingredients
+from app.ingredients import INGREDIENT_MATCHER
+from app.restplus import API
+from app.helpers import (
+    authorization_required, cached_response, _cursor_page, _decode_cursor, is_unauthorized,
+    make_payload
+)
+from app.parsers import (
+    FULL_TEXT_SEARCH_ARGS, PANTRY_ARGS, make_search_args_parser, make_pantry_args_parser
+)
+
+# Linting exceptions
+
+# pylint: disable=C0103
+# pylint: disable=E0213
+# pylint: disable=E1101
+# pylint: disable=W0613
+
+search_ns = API.namespace(
+    'search', description='The endpoints for searching across a user\'s library',
+    path='/search'
+)
+
+args_parser = make_search_args_parser(search_ns)
+pantry_args_parser = make_pantry_args_parser(search_ns)
+
+SEARCH_LANGUAGE = 'english'
+HEADLINE_OPTIONS = 'StartSel=<b>, StopSel=</b>, MaxFragments=2, MaxWords=20, MinWords=5'
+
+
+def _recipe_search(user_id, terms):
+    """
+    Returns the query matching a user's recipes against the search
+    terms along with its rank expression, best match first.
+
+    PostgreSQL matches against the GIN indexed search_vector and ranks
+    by cover density; other databases fall back to a substring match
+    ordered by recency.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        ts_query = func.plainto_tsquery(SEARCH_LANGUAGE, terms)
+        # real ranks do not survive the round trip through a cursor
+        rank = cast(func.ts_rank_cd(Recipe.search_vector, ts_query), db.Float)
+        snippet = func.ts_headline(
+            SEARCH_LANGUAGE, Recipe.ingredients + ' ' + Recipe.description,
+            ts_query, HEADLINE_OPTIONS
+        )
+        match = Recipe.search_vector.op('@@')(ts_query)
+    else:
+        pattern = "%" + terms + "%"
+        rank = literal(0.0, type_=db.Float)
+        snippet = Recipe.description
+        match = or_(
+            Recipe.name.ilike(pattern),
+            Recipe.ingredients.ilike(pattern),
+            Recipe.description.ilike(pattern)
+        )
+    query = db.session.query(Recipe, rank.label('rank'), snippet.label('snippet')).filter(
+        Recipe.user_id == user_id, match
+    ).order_by(rank.desc(), Recipe.id.desc())
+    return query, rank
+
+
+def _pantry_search(user_id, ingredient_ids):
+    """
+    Returns the query ranking a user's recipes by how many of the given
+    ingredients they use, then by how few others they need, along with
+    its sort key expressions.
+
+    Only recipes linked to at least one of the ingredients are
+    considered, and the counting is done by the database over the
+    indexed recipe_ingredients links.
+    """
+    links = recipe_ingredients.c
+    matched = func.sum(case([(links.ingredient_id.in_(ingredient_ids), 1)], else_=0))
+    total = func.count(links.ingredient_id)
+    candidates = select([links.recipe_id]).where(links.ingredient_id.in_(ingredient_ids))
+    query = db.session.query(
+        Recipe, matched.label('matched'), (total - matched).label('missing')
+    ).join(
+        recipe_ingredients, links.recipe_id == Recipe.id
+    ).filter(
+        Recipe.user_id == user_id, Recipe.id.in_(candidates)
+    ).group_by(Recipe.id).order_by(
+        matched.desc(), (matched - total).desc(), Recipe.id.desc()
+    )
+    return query, (matched, matched - total, Recipe.id)
+
+
+@search_ns.route('/recipes')
+class RecipeSearchHandler(Resource):
+    """
+    This class defines the endpoint for searching the name, ingredients
+    and description of every recipe a user owns
+    """
+
+    @authorization_required
+    @cached_response
+    @search_ns.expect(args_parser)
+    def get(current_user, self):
+        """
+        Searches the user's recipes across all their categories
+
+        :return list recipes: The matching recipes, best match first\n
+        :return dict page_details: The cursor to the next page of matches
+        """
+
+        if not current_user:
+            return is_unauthorized()
+
+        args = parser.parse(FULL_TEXT_SEARCH_ARGS, request)
+        per_page = args.get('per_page', 5)
+        query, rank = _recipe_search(current_user.id, args['q'].strip())
+        if 'cursor' in args:
+            try:
+                values = _decode_cursor(args['cursor'], (rank, Recipe.id))
+            except ValueError:
+                return make_response(jsonify({'message': 'Invalid cursor.'}), 400)
+            query = query.filter(tuple_(rank, Recipe.id) < tuple_(*values))
+        matches, pagination_details = _cursor_page(
+            query.limit(per_page + 1).all(),
+            lambda match: [match.rank, match.Recipe.id],
+            args, request.base_url
+        )
+        user_recipes = []
+        for match in matches:
+            this_recipe = make_payload(recipe=match.Recipe)
+            this_recipe.update(rank=match.rank, snippet=match.snippet)
+            user_recipes.append(this_recipe)
+        if user_recipes:
+            response_payload = {
+                "recipes": user_recipes,
+                "page_details": pagination_details
+            }
+            return make_response(jsonify(response_payload), 200)
+        response_payload = dict(
+            message='No recipes match your search.'
+        )
+        return make_response(jsonify(response_payload), 404)
+
+
+@search_ns.route('/pantry')
+class PantrySearchHandler(Resource):
+    """
+    This class defines the endpoint for finding the recipes a user can
+    cook with the ingredients they have
+    """
+
+    @authorization_required
+    @cached_response
+    @search_ns.expect(pantry_args_parser)
+    def get(current_user, self):
+        """
+        Ranks the user's recipes by overlap with a list of pantry items
+
+        :return list recipes: The recipes using the most pantry items first
+
+        :return list unmatched: The pantry items that are not known ingredients
+
+        :return dict page_details: The cursor to the next page of recipes
+        """
+
+        if not current_user:
+            return is_unauthorized()
+
+        args = parser.parse(PANTRY_ARGS, request)
+        per_page = args.get('per_page', 5)
+        names, unmatched = INGREDIENT_MATCHER.split(args['items'])
+        ingredient_ids = [
+            ingredient_id for ingredient_id, in db.session.query(Ingredient.id).filter(
+                Ingredient.name.in_(names)
+            )
+        ] if names else []
+        if not ingredient_ids:
+            response_payload = dict(
+                message='None of your pantry items are used in any recipe.',
+                unmatched=unmatched
+            )
+            return make_response(jsonify(response_payload), 404)
+        query, sort_key = _pantry_search(current_user.id, ingredient_ids)
+        if 'cursor' in args:
+            try:
+                values = _decode_cursor(args['cursor'], sort_key)
+            except ValueError:
+                return make_response(jsonify({'message': 'Invalid cursor.'}), 400)
+            query = query.having(tuple_(*sort_key) < tuple_(*values))
+        matches, pagination_details = _cursor_page(
+            query.limit(per_page + 1).all(),
+            lambda match: [match.matched, -match.missing, match.Recipe.id],
+            args, request.base_url
+        )
+        user_recipes = []
+        for match in matches:
+            this_recipe = make_payload(recipe=match.Recipe)
+            this_recipe.update(matched=match.matched, missing=match.missing)
+            user_recipes.append(this_recipe)
+        if user_recipes:
+            response_payload = {
+                "recipes": user_recipes,
+                "unmatched": unmatched,
+                "page_details": pagination_details
+            }
+            return make_response(jsonify(response_payload), 200)
+        response_payload = dict(
+            message='None of your pantry items are used in any recipe.',
+            unmatched=unmatched
+        )
+        return make_response(jsonify(response_payload), 404)
@@ -0,0 +1,123 @@
+"""Password hashing"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from app import APP
+
+# Linting exception
+# pylint: disable=C0103
+
+
+class HashingPoolSaturated(Exception):
+    """
+    Raised when the hashing pool cannot take on more work or the
+    work did not complete in time
+    """
+
+
+class HashingPool:
+    """
+    Runs password hashing on a bounded set of threads so that a burst
+    of logins cannot occupy every request thread.
+
+    At most ``workers`` hashes run at once and at most ``queue_depth``
+    more wait for a thread; any request beyond that is turned away
+    immediately instead of queueing behind them.
+    """
+
+    def __init__(self, workers=4, queue_depth=16, timeout=5):
+        """
+        :param int workers: The number of hashing threads
+        :param int queue_depth: The number of hashes allowed to wait for a thread
+        :param float timeout: Seconds a caller waits for its hash to complete
+        """
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._slots = threading.BoundedSemaphore(workers + queue_depth)
+
+    def run(self, func, *args, **kwargs):
+        """
+        Runs func on the pool and waits for its result
+
+        :raises HashingPoolSaturated: when the pool is full or the call times out
+        """
+        if not self._slots.acquire(blocking=False):
+            raise HashingPoolSaturated('The hashing pool is saturated.')
+        try:
+            future = self._executor.submit(func, *args, **kwargs)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            raise HashingPoolSaturated('Password hashing timed out.')
+
+
+HASHING_POOL = HashingPool(
+    workers=APP.config.get('HASHING_POOL_SIZE'),
+    queue_depth=APP.config.get('HASHING_QUEUE_DEPTH'),
+    timeout=APP.config.get('HASHING_TIMEOUT')
+)
+
+
+def password_hash_method():
+    """
+    Returns the werkzeug hash method string for the configured algorithm and cost
+    """
+    return 'pbkdf2:{}:{}'.format(
+        APP.config['PASSWORD_HASH_ALGORITHM'], APP.config['PASSWORD_HASH_ITERATIONS']
+    )
+
+
+def needs_rehash(password_hash):
+    """
+    Whether a stored hash was made with a different algorithm or cost
+    than the configured one
+    """
+    return password_hash.split('$', 1)[0] != password_hash_method()
+
+
+def hash_password(password):
+    """
+    Hashes a password on the hashing pool
+    """
+    return HASHING_POOL.run(generate_password_hash, password, method=password_hash_method())
+
+
+def verify_password(password_hash, password):
+    """
+    Checks a password against its hash on the hashing pool
+    """
+    return HASHING_POOL.run(check_password_hash, password_hash, password)
+
+
+def calibrate_iterations(target_seconds, algorithm='sha256', rounds=3):
+    """
+    Finds the pbkdf2 iteration count whose verify time on this machine
+    is closest to the target
+
+    :param float target_seconds: The desired time to verify a password
+    :param str algorithm: The pbkdf2 hash algorithm
+    :param int rounds: The number of timings to take the best of
+    :return int: The iteration count, rounded to the nearest thousand
+    """
+    def best_time(iterations):
+        """Returns the fastest of a few verify timings"""
+        method = 'pbkdf2:{}:{}'.format(algorithm, iterations)
+        password_hash = generate_password_hash('calibration', method=method)
+        timings = []
+        for _ in range(rounds):
+            started = time.perf_counter()
+            check_password_hash(password_hash, 'calibration')
+            timings.append(time.perf_counter() - started)
+        return min(timings)
+
+    iterations = 10000
+    # pbkdf2 cost grows linearly with the iteration count
+    iterations = int(iterations * target_seconds / best_time(iterations))
+    iterations = int(iterations * target_seconds / best_time(iterations))
+    return max(int(round(iterations, -3)), 1000)
@@ -1,35 +1,273 @@
 """
 This package contains the helper functions
 """
+import base64
+import hashlib
+import json
+import logging
+import os
 import re
+import time
+from datetime import datetime
 from functools import wraps
-from flask import jsonify, request, make_response
+from urllib.parse import urlencode
+from flask import jsonify, request, make_response, _request_ctx_stack
 from flask_jwt import jwt
+from flask_sqlalchemy import Pagination
+from sqlalchemy import event, func, inspect, tuple_
+from sqlalchemy.orm import make_transient_to_detached
 
-from app import APP
+from app import APP, queries
+from app.encoding import compact_dumps
 from app.models import db, User, BlacklistToken
+from app.helpers import instrumentation
+from app.helpers.bloom import BlacklistFilter
+from app.helpers.cache import LRUCache, LocalBackend, RedisBackend, ResponseCache
 
-# token decode function:
-def decode_access_token(access_token):
+logger = logging.getLogger(__name__)
+
+# Verified access tokens mapped to a snapshot of their owner's columns
+# and the token generation they were issued for
+TOKEN_CACHE = LRUCache(
+    maxsize=APP.config.get('TOKEN_CACHE_SIZE', 0), ttl=APP.config.get('TOKEN_CACHE_TTL')
+)
+
+# Current token generation of recently seen users
+USER_GENERATIONS = LRUCache(
+    maxsize=APP.config.get('TOKEN_CACHE_SIZE', 0), ttl=APP.config.get('TOKEN_CACHE_TTL')
+)
+
+# Bloom filter front for the token blacklist
+BLACKLIST_FILTER = BlacklistFilter(
+    capacity=APP.config.get('BLACKLIST_FILTER_CAPACITY'),
+    error_rate=APP.config.get('BLACKLIST_FILTER_ERROR_RATE'),
+    refresh_interval=APP.config.get('BLACKLIST_FILTER_REFRESH'),
+    overlap=APP.config.get('BLACKLIST_FILTER_OVERLAP')
+)
+APP.before_first_request(BLACKLIST_FILTER.rebuild)
+
+def _make_response_cache():
     """
-    Validates the user access token
+    Returns the response cache for the configured backend, or None
+    when response caching is off
+    """
+    backend = APP.config.get('RESPONSE_CACHE_BACKEND')
+    if backend == 'redis':
+        backend = RedisBackend.from_url(APP.config.get('RESPONSE_CACHE_REDIS_URL'))
+    elif backend == 'local':
+        if APP.config.get('WORKERS', 1) > 1:
+            logger.warning(
+                "The local response cache is kept per worker, so with %s workers a "
+                "user's writes are not seen by the other workers' caches for up to "
+                "%s seconds. Set RESPONSE_CACHE_BACKEND=redis to share it.",
+                APP.config['WORKERS'], APP.config.get('RESPONSE_CACHE_TTL')
+            )
+        backend = LocalBackend(maxsize=APP.config.get('RESPONSE_CACHE_SIZE'))
+    else:
+        return None
+    return ResponseCache(backend, ttl=APP.config.get('RESPONSE_CACHE_TTL'))
 
-    :param str access_token: The access token tp be decoded
-    :return: integer|string
+# Encoded JSON of single categories and recipes, by (kind, id, updated_on)
+FRAGMENT_CACHE = LRUCache(maxsize=APP.config.get('FRAGMENT_CACHE_SIZE', 0))
+
+# Rendered listing and search responses, per user and write generation
+RESPONSE_CACHE = _make_response_cache()
+# Writes under these paths invalidate the writer's cached responses
+CACHE_INVALIDATING_PATHS = ('/api/v1/category', '/api/v1/library')
+
+@APP.after_request
+def invalidate_cached_responses(response):
+    """
+    Bumps the write generation of a user after each of their writes
+    """
+    if RESPONSE_CACHE is not None and request.method in ('POST', 'PUT', 'PATCH', 'DELETE') \
+            and request.path.startswith(CACHE_INVALIDATING_PATHS):
+        user = getattr(_request_ctx_stack.top, 'current_user', None)
+        if user:
+            # read the id from the identity map, a rolled back write
+            # leaves the user expired
+            RESPONSE_CACHE.bump(inspect(user).identity[0])
+    return response
+
+# Per-request query counts and database time
+APP.before_request(lambda: instrumentation.start_request(APP))
+APP.after_request(lambda response: instrumentation.finish_request(APP, response))
+
+@event.listens_for(BlacklistToken, 'after_insert')
+def _add_to_blacklist_filter(mapper, connection, target): # pylint: disable=W0613
+    """
+    Keeps the blacklist filter in step with tokens blacklisted in this worker
+    """
+    BLACKLIST_FILTER.add(target.token_hash)
+
+# Time of the last cache stats log line
+_last_cache_stats = time.time()
+
+@APP.after_request
+def log_cache_stats(response):
+    """
+    Logs the counters of this worker's caches every CACHE_STATS_INTERVAL
+    seconds, so that they can be sized from real traffic
+    """
+    global _last_cache_stats # pylint: disable=W0603
+    interval = APP.config.get('CACHE_STATS_INTERVAL')
+    if interval and time.time() - _last_cache_stats >= interval:
+        _last_cache_stats = time.time()
+        logger.info(json.dumps(dict(
+            pid=os.getpid(),
+            token_cache=TOKEN_CACHE.stats(),
+            user_generations=USER_GENERATIONS.stats(),
+            blacklist_filter=BLACKLIST_FILTER.stats()
+        )))
+    return response
+
+# Time of the last scheduled blacklist sweep
+_last_blacklist_sweep = 0
+
+def sweep_blacklist():
+    """
+    Purges one batch of expired blacklisted tokens when a sweep is due.
+    Sweeps only run if BLACKLIST_SWEEP_INTERVAL is configured.
+
+    :return int: The number of rows deleted
+    """
+    global _last_blacklist_sweep # pylint: disable=W0603
+    interval = APP.config.get('BLACKLIST_SWEEP_INTERVAL')
+    if not interval or time.time() - _last_blacklist_sweep < interval:
+        return 0
+    _last_blacklist_sweep = time.time()
+    return BlacklistToken.purge_expired(
+        batch_size=APP.config.get('BLACKLIST_SWEEP_BATCH_SIZE'), max_batches=1
+    )
+
+def _identity_snapshot(user):
+    """
+    Returns the loaded column values of a user as a plain dictionary
+    """
+    return {attr.key: getattr(user, attr.key) for attr in inspect(User).column_attrs}
+
+def _identity_from_snapshot(snapshot):
+    """
+    Rebuilds a session bound user from a cached snapshot without
+    querying the database
+    """
+    user = User.__mapper__.class_manager.new_instance()
+    for key, value in snapshot.items():
+        setattr(user, key, value)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+def _revokes_by_generation():
+    """
+    Whether tokens are revoked through per-user token generations
+    instead of the blacklist
+    """
+    return APP.config.get('TOKEN_REVOCATION') == 'generation'
+
+def _is_revoked_generation(user_id, token_generation):
+    """
+    Checks a token's generation against the user's current one
+
+    :param int user_id: The id of the token owner
+    :param int token_generation: The generation the token was issued for
+    :return bool:
     """
+    current_generation = USER_GENERATIONS.get(user_id)
+    if current_generation is None:
+        current_generation = queries.user_token_generation(user_id)
+        USER_GENERATIONS.set(user_id, current_generation)
+    return token_generation != current_generation
+
+def revoke_user_tokens(user_id):
+    """
+    Logs a user out everywhere by moving them to a new token generation
+    """
+    User.query.filter_by(id=user_id).update(
+        {User.token_generation: User.token_generation + 1}, synchronize_session='evaluate'
+    )
+    db.session.commit()
+    USER_GENERATIONS.pop(user_id)
+
+# token owner lookup function:
+def load_token_user(access_token):
+    """
+    Validates the user access token and returns its owner
+
+    Verified tokens are cached until they expire so that repeat
+    requests with the same token need no database round trip.
+
+    :param str access_token: The access token to be decoded
+    :return: User|string
+    """
+    cached = TOKEN_CACHE.get(access_token)
+    if cached is not None:
+        snapshot, token_generation = cached
+        if _revokes_by_generation() and _is_revoked_generation(
+                snapshot['id'], token_generation):
+            TOKEN_CACHE.pop(access_token)
+            return 'Token blacklisted. Please log in again.'
+        return _identity_from_snapshot(snapshot)
     try:
         payload = jwt.decode(access_token, APP.config.get('SECRET_KEY'))
-        is_blacklisted_token = BlacklistToken.check_blacklisted(access_token)
-        if is_blacklisted_token:
-            return 'Token blacklisted. Please log in again.'
+        token_generation = payload.get('gen', 0)
+        if not _revokes_by_generation():
+            is_blacklisted_token = BLACKLIST_FILTER.check(access_token)
+            if is_blacklisted_token:
+                return 'Token blacklisted. Please log in again.'
         public_id = payload['sub']
-        user = User.query.filter_by(public_id=public_id).first()
-        return user.id
+        user = queries.user_by_public_id(public_id)
+        if not user:
+            return 'Invalid token. Please log in again.'
+        if _revokes_by_generation():
+            USER_GENERATIONS.set(user.id, user.token_generation)
+            if token_generation != user.token_generation:
+                return 'Token blacklisted. Please log in again.'
+        TOKEN_CACHE.set(
+            access_token, (_identity_snapshot(user), token_generation),
+            expires_at=payload['exp']
+        )
+        return user
     except jwt.ExpiredSignatureError:
         return 'Signature expired. Please log in again.'
     except jwt.InvalidTokenError:
         return 'Invalid token. Please log in again.'
 
+# token decode function:
+def decode_access_token(access_token):
+    """
+    Validates the user access token
+
+    :param str access_token: The access token tp be decoded
+    :return: integer|string
+    """
+    result = load_token_user(access_token)
+    if isinstance(result, str):
+        return result
+    return result.id
+
+# request identity resolution
+def resolve_identity():
+    """
+    Resolves the owner of the request's access token once per request.
+    The result is kept on the request context so that every later
+    access within the same request reuses it.
+
+    :return: User|string|None
+    """
+    ctx = _request_ctx_stack.top
+    if not hasattr(ctx, 'identity'):
+        token = request.headers.get('Authorization')
+        ctx.identity = load_token_user(token) if token else None
+        ctx.current_user = None if isinstance(ctx.identity, str) else ctx.identity
+    return ctx.identity
+
+def get_current_user():
+    """
+    Returns the user authenticated for the current request or None
+    """
+    resolve_identity()
+    return _request_ctx_stack.top.current_user
+
 # Route security decorator
 def authorization_required(func):
     """
@@ -43,24 +281,45 @@ def authorization_required(func):
         """
         Resource security decorator function
         """
-        token = None
-
-        if 'Authorization' in request.headers:
-            token = request.headers['Authorization']
-
-        if not token:
+        if not request.headers.get('Authorization'):
             response_payload = {
                 "message": "Please provide an access token!"
             }
             return make_response(jsonify(response_payload), 401)
 
-        result = decode_access_token(token)
+        current_user = get_current_user()
+        return func(current_user, *args, **kwargs)
+    return decorated
+
+def cached_response(func):
+    """
+    Serves the 200 responses of a GET handler from the response cache
+    until the user next writes
+    """
 
-        if not isinstance(result, str):
-            current_user = User.query.filter_by(id=result).first()
+    @wraps(func)
+    def decorated(current_user, *args, **kwargs):
+        """
+        Response cache decorator function
+        """
+        if RESPONSE_CACHE is None or not current_user:
             return func(current_user, *args, **kwargs)
-        current_user = None
-        return func(current_user, *args, **kwargs)
+        key = RESPONSE_CACHE.key(
+            current_user.id, request.path, list(request.args.items(multi=True))
+        )
+        if key is None:
+            return func(current_user, *args, **kwargs)
+        cached = RESPONSE_CACHE.get(key)
+        if cached:
+            body, headers = cached
+            return APP.response_class(body, 200, headers).make_conditional(request)
+        response = func(current_user, *args, **kwargs)
+        if response.status_code == 200:
+            RESPONSE_CACHE.set(key, response.get_data(as_text=True), {
+                name: value for name, value in response.headers
+                if name in ('Content-Type', 'ETag')
+            })
+        return response
     return decorated
 
 # sets the naming convention to be used
@@ -74,29 +333,31 @@ def _clean_name(name):
     return name.lower()
 
 # Pagination details
-def _pagination(paginate, base_url, q=None): # pragma: no cover
+def _page_url(base_url, page, per_page):
+    """
+    Returns the url of another page of the current request, keeping
+    all of its other query args
+    """
+    args = request.args.copy()
+    args.pop('cursor', None)
+    args['page'] = page
+    args['per_page'] = per_page
+    return base_url + "?" + urlencode(list(args.items(multi=True)))
+
+def _pagination(paginate, base_url): # pragma: no cover
     """
     :param paginate: a instance of the Pagination class with paginated query results
     :param base_url: the endpoint url on which the request was made
-    :param q: the query string
 
     :returns pagination_details: a Python dictionary with various pagination details.
     """
 
-    base_url = base_url + "?"
-    if q:
-        print(q)
-        base_url = base_url+"q="+q
     if paginate.has_next:
-        next_page = base_url+"&page="+str(paginate.next_num)+"&per_page={}".format(
-            str(len(paginate.items))
-        )
+        next_page = _page_url(base_url, paginate.next_num, paginate.per_page)
     else:
         next_page = paginate.next_num
     if paginate.has_prev:
-        previous_page = base_url+"&page="+str(paginate.prev_num)+"&per_page={}".format(
-            str(len(paginate.items))
-        )
+        previous_page = _page_url(base_url, paginate.prev_num, paginate.per_page)
     else:
         previous_page = paginate.prev_num
     pagination_details = dict(
@@ -107,6 +368,180 @@ def _pagination(paginate, base_url, q=None): # pragma: no cover
     )
     return pagination_details
 
+# Listing sort orders, each ending in a unique column
+SORT_ORDERS = {
+    'id': ('id',),
+    'updated_on': ('updated_on', 'id'),
+}
+
+# Cursor datetime format
+CURSOR_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+def _sort_columns(model, sort=None):
+    """
+    Returns the columns a listing of model is ordered by
+    """
+    return [getattr(model, name) for name in SORT_ORDERS[sort or 'id']]
+
+def _sort_key(item, columns):
+    """
+    Returns the values of the sort columns for item
+    """
+    return [getattr(item, column.key) for column in columns]
+
+def _encode_cursor(values):
+    """
+    Returns an opaque cursor pointing at a sort key
+    """
+    values = [
+        value.strftime(CURSOR_DATETIME_FORMAT) if isinstance(value, datetime) else value
+        for value in values
+    ]
+    cursor = base64.urlsafe_b64encode(json.dumps(values).encode('utf-8'))
+    return cursor.decode('utf-8').rstrip('=')
+
+def _decode_cursor(cursor, columns):
+    """
+    Returns the sort key a cursor points at
+
+    :raises ValueError: when the cursor does not belong to the sort order
+    """
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(cursor + padding).decode('utf-8'))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError('Cursor does not match the sort order.')
+        for index, column in enumerate(columns):
+            if isinstance(column.type, db.DateTime):
+                values[index] = datetime.strptime(values[index], CURSOR_DATETIME_FORMAT)
+            elif isinstance(column.type, db.Integer) and not isinstance(values[index], int):
+                raise ValueError('Cursor does not match the sort order.')
+            elif isinstance(column.type, db.Float) and not isinstance(values[index], (int, float)):
+                raise ValueError('Cursor does not match the sort order.')
+    except (TypeError, ValueError) as e:
+        raise ValueError(str(e))
+    return values
+
+def _paginate(query, model, args, base_url, total=None):
+    """
+    Returns a page of query results along with its pagination details.
+
+    Pages are addressed by an opaque cursor when one is given, which
+    seeks straight to the sort key it points at so that every page
+    costs the same and no rows are counted. Page numbers are still
+    accepted, and every page links to the next one by cursor as well.
+
+    :param query: The unordered query to paginate
+    :param model: The model being listed
+    :param dict args: The parsed search and pagination args
+    :param str base_url: The endpoint url on which the request was made
+    :param int total: The number of rows the query returns, counted if not given
+    :raises ValueError: when the cursor is invalid
+    """
+    columns = _sort_columns(model, args.get('sort'))
+    per_page = args.get('per_page', 5)
+    query = query.order_by(*columns)
+    if 'cursor' not in args:
+        page = args.get('page', 1)
+        if total is None:
+            paginate = query.paginate(page=page, per_page=per_page, error_out=False)
+        else:
+            items = query.limit(per_page).offset((page - 1) * per_page).all()
+            paginate = Pagination(query, page, per_page, total, items)
+        pagination_details = _pagination(paginate, base_url)
+        pagination_details['next_cursor'] = _encode_cursor(
+            _sort_key(paginate.items[-1], columns)
+        ) if paginate.has_next else None
+        return paginate.items, pagination_details
+    values = _decode_cursor(args['cursor'], columns)
+    items = query.filter(tuple_(*columns) > tuple_(*values)).limit(per_page + 1).all()
+    return _cursor_page(items, lambda item: _sort_key(item, columns), args, base_url)
+
+def _cursor_page(items, sort_key, args, base_url):
+    """
+    Trims a cursor page fetched with one extra row and returns it with
+    its pagination details
+
+    :param list items: Up to per_page + 1 rows following the cursor
+    :param sort_key: Returns the sort key values of a row
+    :param dict args: The parsed search and pagination args
+    :param str base_url: The endpoint url on which the request was made
+    """
+    per_page = args.get('per_page', 5)
+    next_cursor = None
+    next_page = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        next_cursor = _encode_cursor(sort_key(items[-1]))
+        next_args = {
+            key: ','.join(value) if isinstance(value, list) else value
+            for key, value in args.items() if key not in ('page', 'cursor')
+        }
+        next_args.update(per_page=per_page, cursor=next_cursor)
+        next_page = base_url + "?" + urlencode(next_args)
+    pagination_details = dict(
+        next_page=next_page,
+        next_cursor=next_cursor,
+        item_count=len(items)
+    )
+    return items, pagination_details
+
+# Conditional request helpers
+def listing_version(query, model):
+    """
+    Returns the latest updated_on and the row count of a listing query,
+    which change whenever a row in the listing is added, edited or removed
+    """
+    return query.order_by(None).with_entities(
+        func.max(model.updated_on), func.count(model.id)
+    ).one()
+
+def write_generation(user_id):
+    """
+    Returns the user's response cache generation, which each of their
+    writes bumps after it commits.
+
+    updated_on is stamped when a write's transaction starts, so a write
+    committing after a later one can leave listing_version unchanged;
+    listing tags include the generation as well.
+    """
+    return RESPONSE_CACHE.generation(user_id) if RESPONSE_CACHE is not None else None
+
+def make_etag(*parts):
+    """
+    Returns an entity tag for a representation built from parts
+    """
+    version = json.dumps(parts, default=str, sort_keys=True)
+    return hashlib.sha1(version.encode('utf-8')).hexdigest()
+
+def not_modified(etag, weak=False):
+    """
+    Returns a 304 response when the request's If-None-Match already
+    holds etag, otherwise None
+    """
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    response = make_response('', 304)
+    response.set_etag(etag, weak=weak)
+    return response
+
+def with_etag(response, etag, weak=False):
+    """
+    Tags a response with etag
+    """
+    response.set_etag(etag, weak=weak)
+    return response
+
+# Unique constraint violations
+def violates_unique(error, name):
+    """
+    Whether an IntegrityError was raised by a unique constraint or
+    index whose name contains name
+    """
+    diag = getattr(error.orig, 'diag', None)
+    constraint = getattr(diag, 'constraint_name', None) or str(error.orig)
+    return name in constraint
+
 # Ensure user is authorized
 def is_unauthorized():
     """
@@ -118,24 +553,120 @@ def is_unauthorized():
     response_payload = jsonify(response_payload)
     return make_response(response_payload, 401)
 
+# Busy hashing pool response
+def service_busy():
+    """
+    Asks the client to retry once the password hashing pool has capacity
+    """
+    response_payload = dict(
+        message='The server is busy. Please try again shortly.'
+    )
+    response = make_response(jsonify(response_payload), 503)
+    response.headers['Retry-After'] = str(APP.config.get('HASHING_RETRY_AFTER'))
+    return response
+
 # Make a response payload
-def make_payload(category=None, recipe=None):
-    """Returns an appropriate response payload"""
-    if recipe:
-        return dict(
-                    id=recipe.id,
-                    name=recipe.name,
-                    ingredients=recipe.ingredients,
-                    description=recipe.description,
-                    date_created=recipe.created_on,
-                    date_updated=recipe.updated_on,
-                    category_id=recipe.category_id
-                   )
-    if category:
-        return dict(
-                    id=category.id,
-                    name= category.name,
-                    description= category.description,
-                    date_created= category.created_on,
-                    date_updated= category.updated_on
-                   )
+# The payload fields of each model and the columns they are read from
+PAYLOAD_FIELDS = {
+    'Category': dict(
+        id='id',
+        name='name',
+        description='description',
+        date_created='created_on',
+        date_updated='updated_on'
+    ),
+    'Recipe': dict(
+        id='id',
+        name='name',
+        ingredients='ingredients',
+        description='description',
+        date_created='created_on',
+        date_updated='updated_on',
+        category_id='category_id'
+    ),
+}
+
+def make_payload(category=None, recipe=None, fields=None):
+    """
+    Returns an appropriate response payload, limited to fields when a
+    sparse fieldset is given. category and recipe may also be rows
+    holding their columns, as returned by writes.
+    """
+    item = recipe or category
+    if not item:
+        return None
+    columns = PAYLOAD_FIELDS['Recipe' if recipe else 'Category']
+    return {
+        name: getattr(item, column) for name, column in columns.items()
+        if fields is None or name in fields
+    }
+
+def field_columns(model, fields, sort=None):
+    """
+    Returns the names of the columns a sparse fieldset needs, or None
+    to read them all.
+
+    The primary key, updated_on and the sort columns are always read
+    since the etags, payload fragments and cursors are built from them.
+
+    :param model: The model being read
+    :param list fields: The requested payload fields, if any
+    :param str sort: The listing order, if any
+    :return tuple:
+    """
+    if not fields:
+        return None
+    columns = PAYLOAD_FIELDS[model.__name__]
+    names = {columns[name] for name in fields}
+    names.update(['id', 'updated_on'], SORT_ORDERS[sort or 'id'])
+    return tuple(sorted(names))
+
+def select_rows(query, model, fields=None, sort=None):
+    """
+    Returns query reading plain column tuples instead of entities.
+
+    The rows are never added to the session's identity map and carry
+    the payload columns, or just those a sparse fieldset needs, under
+    their own names, so make_payload, payload_fragment and the cursors
+    read them as they would an entity.
+
+    :param query: The listing query of model
+    :param model: The model being read
+    :param list fields: The requested payload fields, if any
+    :param str sort: The listing order, if any
+    """
+    names = field_columns(model, fields, sort) or sorted(
+        set(PAYLOAD_FIELDS[model.__name__].values())
+    )
+    return query.with_entities(*[getattr(model, name) for name in names])
+
+def payload_fragment(category=None, recipe=None, fields=None):
+    """
+    Returns the encoded JSON payload of a category or recipe.
+
+    The encoding is cached under the row's id, updated_on and fieldset,
+    so it is reused until the row next changes.
+    """
+    item = recipe or category
+    fieldset = tuple(sorted(set(fields))) if fields else None
+    key = ('Recipe' if recipe else 'Category', item.id, item.updated_on, fieldset)
+    fragment = FRAGMENT_CACHE.get(key)
+    if fragment is None:
+        fragment = compact_dumps(make_payload(category=category, recipe=recipe, fields=fields))
+        FRAGMENT_CACHE.set(key, fragment)
+    return fragment
+
+def fragment_list_response(name, fragments, status=200, **details):
+    """
+    Returns a JSON response listing encoded payloads under name, along
+    with any other top level details
+
+    :param str name: The key of the list
+    :param list fragments: The encoded payloads, see payload_fragment
+    :param int status: The response status code
+    """
+    members = ['"{}":[{}]'.format(name, ','.join(fragments))]
+    for key, value in sorted(details.items()):
+        members.append('"{}":{}'.format(key, compact_dumps(value)))
+    body = '{' + ','.join(members) + '}\n'
+    return APP.response_class(body, status, mimetype='application/json')
@@ -0,0 +1,217 @@
+"""
+Bloom filter used to answer "definitely not blacklisted" without
+a database round trip
+"""
+import hashlib
+import logging
+import math
+import threading
+import time
+from datetime import timedelta
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import queries
+from app.models import db, BlacklistToken
+
+# Linting exceptions
+
+# pylint: disable=C0103
+# pylint: disable=E1101
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """
+    A fixed size Bloom filter sized for a capacity and a target
+    false positive rate
+    """
+
+    def __init__(self, capacity, error_rate):
+        """
+        :param int capacity: The number of items the filter is sized for
+        :param float error_rate: The target false positive rate at capacity
+        """
+        capacity = max(int(capacity), 1)
+        self.capacity = capacity
+        self.size = int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(int(round(self.size / capacity * math.log(2))), 1)
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        """
+        Derives the bit positions of an item by double hashing a single digest
+        """
+        digest = hashlib.sha256(item.encode('utf-8')).digest()
+        first = int.from_bytes(digest[:8], 'big')
+        second = int.from_bytes(digest[8:16], 'big') | 1
+        for i in range(self.hash_count):
+            yield (first + i * second) % self.size
+
+    def add(self, item):
+        """
+        Adds an item to the filter
+        """
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(
+            self._bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(item)
+        )
+
+    def estimated_false_positive_rate(self):
+        """
+        Returns the theoretical false positive rate at the current fill
+        """
+        return (1 - math.exp(-self.hash_count * self.count / self.size)) ** self.hash_count
+
+
+class BlacklistFilter:
+    """
+    Keeps a per-worker Bloom filter of the blacklisted tokens.
+
+    The filter is built from the blacklist table when the worker
+    boots, updated whenever a token is blacklisted in this process
+    and topped up from the table every ``refresh_interval`` seconds
+    to pick up logouts served by other workers. Only filter hits
+    fall through to the exact database lookup.
+
+    Ids and blacklisted_on times are assigned before a row commits, so
+    rows can become visible out of order. Each refresh therefore reads
+    back ``overlap`` seconds before the newest row it has seen, and
+    skips the rows it already added.
+    """
+
+    def __init__(self, capacity=100000, error_rate=0.001, refresh_interval=30, overlap=300):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.refresh_interval = refresh_interval
+        self.overlap = timedelta(seconds=overlap)
+        self.rebuild_seconds = None
+        self.lookups = 0
+        self.filter_hits = 0
+        self.false_positives = 0
+        self._filter = None
+        self._last_seen = None
+        # The ids added within the overlap, mapped to their blacklisted_on
+        self._recent = {}
+        self._refreshed_at = 0
+        self._lock = threading.Lock()
+
+    def _track(self, rows):
+        """
+        Remembers the rows inside the overlap of the newest one, and
+        returns those not added before
+        """
+        new_rows = [row for row in rows if row[0] not in self._recent]
+        for row_id, _, blacklisted_on in new_rows:
+            self._recent[row_id] = blacklisted_on
+            if self._last_seen is None or blacklisted_on > self._last_seen:
+                self._last_seen = blacklisted_on
+        if self._last_seen is not None:
+            since = self._last_seen - self.overlap
+            self._recent = {
+                row_id: blacklisted_on for row_id, blacklisted_on in self._recent.items()
+                if blacklisted_on >= since
+            }
+        return new_rows
+
+    def rebuild(self):
+        """
+        Builds a fresh filter from every row in the blacklist table
+        """
+        started = time.perf_counter()
+        try:
+            rows = db.session.query(
+                BlacklistToken.id, BlacklistToken.token_hash, BlacklistToken.blacklisted_on
+            ).order_by(BlacklistToken.id).all()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            self._refreshed_at = time.time()
+            logger.warning("Could not build the blacklist filter: %s", e)
+            return
+        bloom = BloomFilter(max(self.capacity, 2 * len(rows)), self.error_rate)
+        for _, token_hash, _ in rows:
+            bloom.add(token_hash)
+        with self._lock:
+            self._filter = bloom
+            self._last_seen = None
+            self._recent = {}
+            self._track(rows)
+            self._refreshed_at = time.time()
+        self.rebuild_seconds = time.perf_counter() - started
+
+    def refresh(self):
+        """
+        Adds the tokens blacklisted since the last refresh, rebuilding
+        the filter once it has outgrown its capacity
+        """
+        if self._filter is None or self._filter.count >= self._filter.capacity:
+            return self.rebuild()
+        query = db.session.query(
+            BlacklistToken.id, BlacklistToken.token_hash, BlacklistToken.blacklisted_on
+        )
+        if self._last_seen is not None:
+            query = query.filter(BlacklistToken.blacklisted_on >= self._last_seen - self.overlap)
+        try:
+            rows = query.order_by(BlacklistToken.id).all()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            logger.warning("Could not refresh the blacklist filter: %s", e)
+            rows = []
+        with self._lock:
+            for _, token_hash, _ in self._track(rows):
+                self._filter.add(token_hash)
+            self._refreshed_at = time.time()
+
+    def add(self, token_hash):
+        """
+        Records the digest of a newly blacklisted token
+        """
+        with self._lock:
+            if self._filter is not None:
+                self._filter.add(token_hash)
+
+    def check(self, token):
+        """
+        Checks whether a token has been blacklisted
+
+        :param str token: The access token
+        :return bool:
+        """
+        if time.time() - self._refreshed_at >= self.refresh_interval:
+            self.refresh()
+        self.lookups += 1
+        token_hash = BlacklistToken.hash_token(token)
+        if self._filter is not None and token_hash not in self._filter:
+            return False
+        blacklisted = queries.token_blacklisted(token_hash)
+        if self._filter is not None:
+            self.filter_hits += 1
+            if not blacklisted:
+                self.false_positives += 1
+        return blacklisted
+
+    def stats(self):
+        """
+        Returns the filter metrics as a dictionary
+        """
+        bloom = self._filter
+        return dict(
+            items=bloom.count if bloom else 0,
+            capacity=bloom.capacity if bloom else 0,
+            hash_count=bloom.hash_count if bloom else 0,
+            estimated_false_positive_rate=bloom.estimated_false_positive_rate() if bloom else 0.0,
+            observed_false_positive_rate=(
+                float(self.false_positives) / self.lookups if self.lookups else 0.0
+            ),
+            rebuild_seconds=self.rebuild_seconds,
+            lookups=self.lookups,
+            filter_hits=self.filter_hits,
+            false_positives=self.false_positives
+        )
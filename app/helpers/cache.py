@@ -0,0 +1,261 @@
+"""
+In-process cache helpers
+"""
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+# Linting exceptions
+
+# pylint: disable=C0103
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """
+    A bounded, thread safe least-recently-used cache whose entries
+    can also expire at a given deadline.
+
+    Hit and miss counters are kept so that the cache can be sized
+    from real traffic. A ``maxsize`` of 0 disables the cache.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        """
+        :param int maxsize: The maximum number of entries to keep
+        :param int ttl: Optional upper bound (in seconds) on the life of an entry
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Returns the value cached under key or None when it is absent or expired
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= now:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, expires_at=None):
+        """
+        Caches value under key until expires_at (a unix timestamp)
+        """
+        if not self.maxsize:
+            return
+        if self.ttl is not None:
+            deadline = time.time() + self.ttl
+            expires_at = deadline if expires_at is None else min(expires_at, deadline)
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        """
+        Evicts key from the cache
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return entry[0] if entry else None
+
+    def clear(self):
+        """
+        Empties the cache and resets its counters
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        Returns the cache counters as a dictionary
+        """
+        lookups = self.hits + self.misses
+        return dict(
+            size=len(self._entries),
+            maxsize=self.maxsize,
+            hits=self.hits,
+            misses=self.misses,
+            hit_rate=float(self.hits) / lookups if lookups else 0.0
+        )
+
+
+class LocalBackend:
+    """
+    Response cache storage in this process. Every worker keeps its own
+    copy, so it is only coherent when the app runs a single worker.
+    """
+
+    # Writes made by other processes cannot invalidate it
+    shared = False
+
+    def __init__(self, maxsize=4096):
+        self._entries = LRUCache(maxsize=maxsize)
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the value stored under key or None"""
+        return self._entries.get(key)
+
+    def set(self, key, value, ttl):
+        """Stores value under key for ttl seconds"""
+        self._entries.set(key, value, expires_at=time.time() + ttl)
+
+    def counter(self, key, default):
+        """Returns the counter under key, starting it at default"""
+        with self._lock:
+            return self._counters.setdefault(key, default)
+
+    def incr(self, key, default):
+        """Increments the counter under key, starting it at default"""
+        with self._lock:
+            self._counters[key] = self._counters.get(key, default) + 1
+            return self._counters[key]
+
+    def clear(self):
+        """Drops every entry and counter"""
+        self._entries.clear()
+        with self._lock:
+            self._counters.clear()
+
+
+class RedisBackend:
+    """
+    Response cache storage shared by every worker through redis.
+
+    A failing redis server is logged and treated as a cache miss, so
+    requests are served uncached until it is back.
+    """
+
+    shared = True
+
+    def __init__(self, client, errors=(Exception,)):
+        """
+        :param client: A redis.StrictRedis compatible client
+        :param tuple errors: The exceptions the client raises when redis fails
+        """
+        self.client = client
+        self.errors = errors
+
+    @classmethod
+    def from_url(cls, url):
+        """
+        Connects to the redis server at url
+        """
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('The redis response cache needs the redis package installed.')
+        return cls(redis.StrictRedis.from_url(url), errors=(redis.RedisError,))
+
+    def _call(self, method, *args, **kwargs):
+        """
+        Runs a client method, returning None when redis fails
+        """
+        try:
+            return getattr(self.client, method)(*args, **kwargs)
+        except self.errors as e:
+            logger.warning("The redis response cache failed, serving uncached: %s", e)
+            return None
+
+    def get(self, key):
+        """Returns the value stored under key or None"""
+        value = self._call('get', key)
+        return value.decode('utf-8') if isinstance(value, bytes) else value
+
+    def set(self, key, value, ttl):
+        """Stores value under key for ttl seconds"""
+        self._call('set', key, value, ex=ttl)
+
+    def counter(self, key, default):
+        """Returns the counter under key, starting it at default, or None"""
+        self._call('set', key, default, nx=True)
+        value = self._call('get', key)
+        return int(value) if value is not None else None
+
+    def incr(self, key, default):
+        """Increments the counter under key, starting it at default"""
+        self._call('set', key, default, nx=True)
+        return self._call('incr', key)
+
+    def clear(self):
+        """Cached entries expire on their own"""
+
+
+class ResponseCache:
+    """
+    Caches rendered responses per user.
+
+    Entries are keyed by the user, the user's write generation, the
+    path and the normalized query args. Every write bumps the user's
+    generation, which orphans all of their entries in O(1) and leaves
+    them to expire. Generations start from the clock so that a counter
+    lost from the backend never restarts below one already used.
+    """
+
+    def __init__(self, backend, ttl=300):
+        """
+        :param backend: A LocalBackend or RedisBackend
+        :param int ttl: Seconds a cached response is served for
+        """
+        self.backend = backend
+        self.ttl = ttl
+
+    @staticmethod
+    def _generation_key(user_id):
+        return 'yummy:generation:{}'.format(user_id)
+
+    def generation(self, user_id):
+        """Returns the current write generation of a user"""
+        return self.backend.counter(self._generation_key(user_id), int(time.time() * 1000))
+
+    def bump(self, user_id):
+        """Invalidates every response cached for a user"""
+        return self.backend.incr(self._generation_key(user_id), int(time.time() * 1000))
+
+    def key(self, user_id, path, args):
+        """
+        Returns the cache key of a response at the user's current
+        generation, or None when the generation cannot be read
+
+        :param list args: The (name, value) pairs of the query string
+        """
+        generation = self.generation(user_id)
+        if generation is None:
+            return None
+        return 'yummy:response:{}:{}:{}?{}'.format(
+            user_id, generation, path, json.dumps(sorted(args))
+        )
+
+    def get(self, key):
+        """Returns the (body, headers) cached under key or None"""
+        entry = self.backend.get(key)
+        if entry is None:
+            return None
+        entry = json.loads(entry)
+        return entry['body'], entry['headers']
+
+    def set(self, key, body, headers):
+        """Caches a response body and its headers"""
+        self.backend.set(key, json.dumps(dict(body=body, headers=headers)), self.ttl)
@@ -0,0 +1,286 @@
+"""
+Bulk loading of library dumps: NDJSON or CSV records are read as a
+stream, validated in chunks and written with multi-row inserts
+"""
+import codecs
+import csv
+import gzip
+import json
+from collections import Counter
+from itertools import islice
+
+from psycopg2.extras import execute_values
+from sqlalchemy import tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from app.helpers import _clean_name
+from app.helpers.validators import CategorySchema, RecipeSchema
+from app.ingredients import INGREDIENT_MATCHER
+from app.models import db, Category, Ingredient, Recipe, recipe_ingredients
+
+# Linting exceptions
+
+# pylint: disable=E1101
+
+# The formats a dump may be in
+IMPORT_FORMATS = ('ndjson', 'csv')
+
+# Recipes are written straight through psycopg2 on PostgreSQL, since
+# compiling a multi-row INSERT costs more than running it
+RECIPE_INSERT = (
+    "INSERT INTO recipes (user_id, category_id, name, ingredients, description, "
+    "created_on, updated_on) VALUES %s "
+    "ON CONFLICT (category_id, name) DO NOTHING RETURNING id, ingredients"
+)
+RECIPE_VALUES = "(%s, %s, %s, %s, %s, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)"
+RECIPE_INGREDIENTS_INSERT = "INSERT INTO recipe_ingredients (recipe_id, ingredient_id) VALUES %s"
+
+# Errors beyond this many are counted but not listed in the report
+MAX_REPORTED_ERRORS = 100
+
+
+def read_records(stream, import_format, compressed=False):
+    """
+    Yields the line number and record of each item of a dump, with a
+    record of None for lines that are not valid JSON objects
+
+    :param stream: A binary file-like object holding the dump
+    :param str import_format: 'ndjson' or 'csv', see IMPORT_FORMATS
+    :param bool compressed: The stream is gzip encoded
+    """
+    if compressed:
+        stream = gzip.GzipFile(fileobj=stream, mode='rb')
+    text = codecs.getreader('utf-8')(stream)
+    if import_format == 'csv':
+        # The header is line 1
+        for number, row in enumerate(csv.DictReader(text), 2):
+            yield number, row
+        return
+    for number, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        yield number, record if isinstance(record, dict) else None
+
+
+def _execute_values(statement, rows, template=None):
+    """
+    Runs a multi-row statement for all rows in one round trip on the
+    session's connection, returning the rows it returns if any
+    """
+    cursor = db.session.connection().connection.cursor()
+    try:
+        execute_values(cursor, statement, rows, template=template, page_size=len(rows))
+        return cursor.fetchall() if cursor.description else []
+    finally:
+        cursor.close()
+
+
+class LibraryImport:
+    """
+    Loads the categories and recipes of a dump into a user's library.
+
+    Categories are matched to the user's existing ones by name, and a
+    recipe names its category either by the ``category_id`` the dump
+    gave it or by ``category`` name. Recipes whose name is already
+    taken in their category are skipped, so a dump can be imported
+    again after a failure. Each chunk is written and committed on its
+    own with one multi-row INSERT per table.
+    """
+
+    def __init__(self, user_id, chunk_size=1000):
+        """
+        :param int user_id: The id of the user to import into
+        :param int chunk_size: The number of records validated and written at a time
+        """
+        self.user_id = user_id
+        self.chunk_size = chunk_size
+        self.categories = None
+        self.dump_categories = {}
+        self.created = Counter()
+        self.skipped = Counter()
+        self.errors = []
+        self.error_count = 0
+        self.lines_read = 0
+
+    def run(self, records):
+        """
+        Imports records as yielded by read_records
+
+        :return dict: The import report
+        """
+        self.categories = dict(
+            db.session.query(Category.name, Category.id).filter_by(user_id=self.user_id)
+        )
+        records = iter(records)
+        while True:
+            chunk = list(islice(records, self.chunk_size))
+            if not chunk:
+                break
+            self.load_chunk(chunk)
+            db.session.commit()
+            self.lines_read = chunk[-1][0]
+        return self.report()
+
+    def report(self):
+        """
+        Returns the counts of created and skipped items and the errors
+        """
+        return dict(
+            categories=dict(created=self.created['category'], existing=self.skipped['category']),
+            recipes=dict(created=self.created['recipe'], skipped=self.skipped['recipe']),
+            error_count=self.error_count,
+            errors=self.errors
+        )
+
+    def error(self, number, message, errors=None):
+        """
+        Records the failure of the item on line number
+        """
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            error = dict(line=number, message=message)
+            if errors:
+                error['errors'] = errors
+            self.errors.append(error)
+
+    def load_chunk(self, chunk):
+        """
+        Validates and writes a chunk of records, categories first
+        """
+        categories, recipes = [], []
+        for number, record in chunk:
+            if record is None:
+                self.error(number, 'Invalid JSON.')
+            elif record.get('type') == 'category':
+                categories.append((number, record))
+            elif (record.get('type') or 'recipe') == 'recipe':
+                recipes.append((number, record))
+            else:
+                self.error(number, 'Unknown type, expected category or recipe.')
+        if categories:
+            self.load_categories(categories)
+        if recipes:
+            self.load_recipes(recipes)
+
+    def load_categories(self, categories):
+        """
+        Adds the categories the user does not have yet
+        """
+        category_schema = CategorySchema()
+        new_categories = {}
+        named = []
+        for number, record in categories:
+            request_payload, errors = category_schema.load(record)
+            if errors:
+                self.error(number, 'You provided some invalid details.', errors)
+                continue
+            name = request_payload['name']
+            if name in self.categories or name in new_categories:
+                self.skipped['category'] += 1
+            else:
+                new_categories[name] = dict(
+                    user_id=self.user_id, name=name,
+                    description=request_payload['description']
+                )
+            named.append((record.get('id'), name))
+        if new_categories:
+            insert = Category.__table__.insert()
+            if db.session.bind.dialect.name == 'postgresql':
+                # Another import may be adding the same names
+                insert = pg_insert(Category.__table__).on_conflict_do_nothing(
+                    index_elements=['user_id', 'name']
+                )
+            db.session.execute(insert.values(list(new_categories.values())))
+            self.categories.update(
+                db.session.query(Category.name, Category.id).filter(
+                    Category.user_id == self.user_id, Category.name.in_(new_categories)
+                )
+            )
+            self.created['category'] += len(new_categories)
+        for dump_id, name in named:
+            if dump_id is not None:
+                self.dump_categories[str(dump_id)] = self.categories[name]
+
+    def load_recipes(self, recipes):
+        """
+        Adds the recipes whose names are not taken in their category,
+        and links them to their ingredients
+        """
+        recipe_schema = RecipeSchema()
+        rows = {}
+        for number, record in recipes:
+            if record.get('category_id') not in (None, ''):
+                category_id = self.dump_categories.get(str(record['category_id']))
+            else:
+                category_id = self.categories.get(record.get('category'))
+            if category_id is None:
+                self.error(number, 'Unknown category.')
+                continue
+            record = dict(record)
+            if isinstance(record.get('name'), str):
+                record['name'] = _clean_name(record['name'])
+            request_payload, errors = recipe_schema.load(record)
+            if errors:
+                self.error(number, 'You provided some invalid details.', errors)
+                continue
+            key = (category_id, request_payload['name'])
+            if key in rows:
+                self.skipped['recipe'] += 1
+                continue
+            rows[key] = dict(
+                user_id=self.user_id, category_id=category_id, name=request_payload['name'],
+                ingredients=request_payload['ingredients'],
+                description=request_payload['description']
+            )
+        if not rows:
+            return
+        if db.session.bind.dialect.name == 'postgresql':
+            created = _execute_values(RECIPE_INSERT, [
+                (row['user_id'], row['category_id'], row['name'], row['ingredients'],
+                 row['description'])
+                for row in rows.values()
+            ], template=RECIPE_VALUES)
+        else:
+            taken = set(
+                db.session.query(Recipe.category_id, Recipe.name).filter(
+                    tuple_(Recipe.category_id, Recipe.name).in_(list(rows))
+                )
+            )
+            new_rows = [row for key, row in rows.items() if key not in taken]
+            if new_rows:
+                db.session.execute(Recipe.__table__.insert().values(new_rows))
+            created = db.session.query(Recipe.id, Recipe.ingredients).filter(
+                tuple_(Recipe.category_id, Recipe.name).in_(
+                    [key for key in rows if key not in taken]
+                )
+            ).all() if new_rows else []
+        self.created['recipe'] += len(created)
+        self.skipped['recipe'] += len(rows) - len(created)
+        self.link_ingredients(created)
+
+    @staticmethod
+    def link_ingredients(created):
+        """
+        Links new recipes to their ingredients, which the before_flush
+        hook does for recipes written through the ORM
+        """
+        names = {recipe_id: INGREDIENT_MATCHER.match(text) for recipe_id, text in created}
+        entries = Ingredient.resolve(set().union(*names.values()))
+        if not entries:
+            return
+        db.session.flush()
+        links = [
+            (recipe_id, entries[name].id)
+            for recipe_id, matched in names.items() for name in sorted(matched)
+        ]
+        if db.session.bind.dialect.name == 'postgresql':
+            _execute_values(RECIPE_INGREDIENTS_INSERT, links)
+        else:
+            db.session.execute(recipe_ingredients.insert().values([
+                dict(recipe_id=recipe_id, ingredient_id=ingredient_id)
+                for recipe_id, ingredient_id in links
+            ]))
@@ -0,0 +1,238 @@
+"""
+Per-request SQL instrumentation: counts the statements each request
+runs and the time spent in the database, and flags statements that
+keep being repeated
+"""
+import json
+import logging
+import re
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from flask import request, _request_ctx_stack
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Query
+
+# Linting exceptions
+
+# pylint: disable=C0103
+# pylint: disable=W0613
+
+logger = logging.getLogger(__name__)
+
+# Literals, bind parameters and IN lists are masked so that statements
+# differing only in their values share a fingerprint
+FINGERPRINT_PATTERNS = (
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r"%\(\w+\)s|:\w+|\$\d+"), '?'),
+    (re.compile(r"\b\d+\b"), '?'),
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)"), '(?)'),
+    (re.compile(r"\s+"), ' '),
+)
+
+
+class RepeatedQueryError(Exception):
+    """
+    Raised under QUERY_REPEAT_RAISE when a request repeats a statement
+    more often than QUERY_REPEAT_THRESHOLD allows
+    """
+
+
+def fingerprint(statement):
+    """
+    Returns statement with its values masked
+    """
+    for pattern, replacement in FINGERPRINT_PATTERNS:
+        statement = pattern.sub(replacement, statement)
+    return statement.strip()
+
+
+class QueryStats:
+    """
+    The statements run while serving a request.
+
+    With a repeat threshold set, every statement is fingerprinted and
+    every query on a dynamic relationship is attributed to its parent.
+    The same fingerprint running more than ``threshold`` times, or the
+    same dynamic relationship being queried for more than ``threshold``
+    different parents, is the signature of a query issued from inside
+    a loop and is reported once per request.
+    """
+
+    def __init__(self, threshold=None, raise_errors=False):
+        """
+        :param int threshold: The number of repeats tolerated, None to not check
+        :param bool raise_errors: Raise RepeatedQueryError instead of logging a warning
+        """
+        self.count = 0
+        self.seconds = 0.0
+        self.started = time.perf_counter()
+        self.threshold = threshold
+        self.raise_errors = raise_errors
+        self.suppressed = 0
+        self.fingerprints = Counter()
+        self.relationships = defaultdict(set)
+
+    def check(self, statement):
+        """
+        Fingerprints a statement about to be run
+        """
+        if self.threshold is None or self.suppressed:
+            return
+        key = fingerprint(statement)
+        self.fingerprints[key] += 1
+        if self.fingerprints[key] == self.threshold + 1:
+            self.report('Statement ran more than {} times in one request: {}'.format(
+                self.threshold, key
+            ))
+
+    def check_relationship(self, name, parent):
+        """
+        Attributes a query on a dynamic relationship to its parent
+        """
+        if self.threshold is None or self.suppressed:
+            return
+        parents = self.relationships[name]
+        parents.add(parent)
+        if len(parents) == self.threshold + 1:
+            self.report(
+                'Dynamic relationship {} was queried for more than {} parents '
+                'in one request, load it for all of them at once instead.'.format(
+                    name, self.threshold
+                )
+            )
+
+    def report(self, message):
+        """
+        Warns about or raises a repeated query
+        """
+        if self.raise_errors:
+            raise RepeatedQueryError(message)
+        logger.warning("%s %s", request.path, message)
+
+    def record(self, statement, seconds):
+        """
+        Records a statement that took seconds to run
+        """
+        self.count += 1
+        self.seconds += seconds
+
+
+def current_stats():
+    """
+    Returns the query stats of the current request, or None outside
+    of an instrumented request
+    """
+    ctx = _request_ctx_stack.top
+    return getattr(ctx, 'query_stats', None) if ctx is not None else None
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """
+    Notes when a statement was sent to the database
+    """
+    stats = current_stats()
+    if stats is not None:
+        stats.check(statement)
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """
+    Adds a completed statement to the stats of the current request
+    """
+    _finish_statement(conn, statement)
+
+
+@event.listens_for(Engine, 'handle_error')
+def _handle_error(exception_context):
+    """
+    Adds a failed statement to the stats of the current request, as
+    after_cursor_execute is not called for it
+    """
+    if exception_context.connection is not None:
+        _finish_statement(exception_context.connection, exception_context.statement)
+
+
+def _finish_statement(conn, statement):
+    """
+    Pops the start time _before_cursor_execute noted for a statement
+    and records how long the statement took
+    """
+    started = conn.info.get('query_started')
+    if not started:
+        return
+    seconds = time.perf_counter() - started.pop()
+    stats = current_stats()
+    if stats is not None:
+        stats.record(statement, seconds)
+
+
+@event.listens_for(Query, 'before_compile', propagate=True)
+def _before_compile(query):
+    """
+    Attributes queries on dynamic relationships to their parent
+    """
+    parent = getattr(query, 'dynamic_parent', None)
+    stats = current_stats()
+    if parent is not None and stats is not None:
+        stats.check_relationship(*parent)
+
+
+@contextmanager
+def allow_repeated_queries():
+    """
+    Lets the block repeat statements on purpose, as batched writes do
+    """
+    stats = current_stats()
+    if stats is None:
+        yield
+        return
+    stats.suppressed += 1
+    try:
+        yield
+    finally:
+        stats.suppressed -= 1
+
+
+def start_request(app):
+    """
+    Starts collecting query stats for the current request when
+    SQL_INSTRUMENTATION is enabled
+    """
+    if app.config.get('SQL_INSTRUMENTATION'):
+        _request_ctx_stack.top.query_stats = QueryStats(
+            threshold=app.config.get('QUERY_REPEAT_THRESHOLD'),
+            raise_errors=app.config.get('QUERY_REPEAT_RAISE', False)
+        )
+
+
+def finish_request(app, response):
+    """
+    Reports the query stats of the current request in a Server-Timing
+    header and, when SQL_INSTRUMENTATION_LOG is enabled, a log line
+    """
+    stats = current_stats()
+    if stats is None:
+        return response
+    total_ms = (time.perf_counter() - stats.started) * 1000
+    db_ms = stats.seconds * 1000
+    response.headers.add(
+        'Server-Timing', 'db;desc="{} queries";dur={:.2f}'.format(stats.count, db_ms)
+    )
+    response.headers.add('Server-Timing', 'app;dur={:.2f}'.format(total_ms))
+    if app.config.get('SQL_INSTRUMENTATION_LOG'):
+        logger.info(json.dumps(dict(
+            method=request.method,
+            path=request.path,
+            endpoint=request.endpoint,
+            status=response.status_code,
+            queries=stats.count,
+            db_ms=round(db_ms, 2),
+            total_ms=round(total_ms, 2)
+        )))
+    return response
@@ -0,0 +1,141 @@
+"""Ingredient normalization"""
+import re
+import unicodedata
+
+# Linting exceptions
+
+# pylint: disable=C0103
+
+# Canonical ingredient names
+CANONICAL_INGREDIENTS = (
+    'all purpose flour', 'almond', 'anchovy', 'apple', 'apricot', 'asparagus', 'aubergine',
+    'avocado', 'bacon', 'baking powder', 'baking soda', 'banana', 'barley', 'basil',
+    'bay leaf', 'bean', 'beef', 'beetroot', 'bell pepper', 'black pepper', 'blueberry',
+    'bread', 'breadcrumb', 'broccoli', 'brown sugar', 'butter', 'buttermilk', 'cabbage',
+    'cardamom', 'carrot', 'cashew', 'cauliflower', 'cayenne', 'celery', 'cheddar', 'cheese',
+    'cherry', 'chicken', 'chicken stock', 'chickpea', 'chili', 'chive', 'chocolate',
+    'chocolate chip', 'cinnamon', 'clove', 'cocoa', 'coconut', 'coconut milk', 'cod',
+    'coffee', 'coriander', 'corn', 'cornstarch', 'courgette', 'couscous', 'crab', 'cranberry',
+    'cream', 'cream cheese', 'cucumber', 'cumin', 'curry powder', 'date', 'dill', 'duck',
+    'egg', 'fennel', 'feta', 'fish', 'fish sauce', 'flour', 'garlic', 'ginger', 'goat cheese',
+    'grape', 'green bean', 'ham', 'hazelnut', 'honey', 'kale', 'ketchup', 'lamb', 'leek',
+    'lemon', 'lemon juice', 'lentil', 'lettuce', 'lime', 'maple syrup', 'mango',
+    'mayonnaise', 'milk', 'mint', 'mozzarella', 'mushroom', 'mustard', 'nutmeg', 'oat',
+    'olive', 'olive oil', 'onion', 'orange', 'oregano', 'paprika', 'parmesan', 'parsley',
+    'pasta', 'pea', 'peach', 'peanut', 'peanut butter', 'pear', 'pecan', 'pepper',
+    'pineapple', 'pistachio', 'pork', 'potato', 'prawn', 'pumpkin', 'quinoa', 'raisin',
+    'raspberry', 'rice', 'ricotta', 'rosemary', 'saffron', 'sage', 'salmon', 'salt',
+    'sausage', 'sesame', 'shallot', 'soy sauce', 'spinach', 'spring onion', 'squash',
+    'strawberry', 'sugar', 'sweet potato', 'thyme', 'tofu', 'tomato', 'tomato paste',
+    'tuna', 'turkey', 'turmeric', 'vanilla', 'vegetable oil', 'vinegar', 'walnut', 'water',
+    'wine', 'yeast', 'yogurt',
+)
+
+# Alternative names and the canonical names they stand for
+INGREDIENT_ALIASES = {
+    'bicarbonate of soda': 'baking soda', 'capsicum': 'bell pepper', 'chilli': 'chili',
+    'cilantro': 'coriander', 'corn starch': 'cornstarch', 'cornflour': 'cornstarch',
+    'eggplant': 'aubergine', 'garbanzo': 'chickpea', 'icing sugar': 'sugar',
+    'plain flour': 'all purpose flour', 'scallion': 'spring onion', 'shrimp': 'prawn',
+    'yoghurt': 'yogurt', 'zucchini': 'courgette',
+}
+
+
+def normalize_text(text):
+    """
+    Lower cases text, strips accents and reduces punctuation and runs
+    of whitespace to single spaces
+    """
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(re.sub(r"[^a-z0-9]+", ' ', text.lower()).split())
+
+
+def _singular_forms(word):
+    """
+    Returns the forms word could take in the singular, itself first
+    """
+    forms = [word]
+    if word.endswith('ies'):
+        forms.append(word[:-3] + 'y')
+    if word.endswith('ves'):
+        forms.append(word[:-3] + 'f')
+    if word.endswith('es'):
+        forms.append(word[:-2])
+    if word.endswith('s'):
+        forms.append(word[:-1])
+    return forms
+
+
+class IngredientMatcher:
+    """
+    Finds every canonical ingredient named in a piece of text in a
+    single pass over its words.
+
+    Names and aliases are kept in a dictionary keyed by their words.
+    At each position the longest phrase found in the dictionary wins,
+    so that "olive oil" is preferred over "olive", and the cost of a
+    match grows with the length of the text rather than the size of
+    the dictionary.
+    """
+
+    def __init__(self, names=CANONICAL_INGREDIENTS, aliases=None):
+        """
+        :param iterable names: The canonical ingredient names
+        :param dict aliases: Alternative names mapped to canonical names
+        """
+        self._phrases = {}
+        for name in names:
+            name = normalize_text(name)
+            self._phrases[tuple(name.split(' '))] = name
+        for alias, name in (aliases or {}).items():
+            self._phrases[tuple(normalize_text(alias).split(' '))] = normalize_text(name)
+        self._longest = max(len(phrase) for phrase in self._phrases)
+
+    def _lookup(self, words):
+        """
+        Returns the canonical name of a phrase, allowing its last word
+        to be plural
+        """
+        for last in _singular_forms(words[-1]):
+            name = self._phrases.get(words[:-1] + (last,))
+            if name:
+                return name
+        return None
+
+    def match(self, text):
+        """
+        Returns the set of canonical names mentioned in text
+        """
+        words = tuple(normalize_text(text).split(' '))
+        found = set()
+        position = 0
+        while position < len(words):
+            for length in range(min(self._longest, len(words) - position), 0, -1):
+                name = self._lookup(words[position:position + length])
+                if name:
+                    found.add(name)
+                    position += length
+                    break
+            else:
+                position += 1
+        return found
+
+    def split(self, items):
+        """
+        Maps a list of ingredients onto canonical names
+
+        :param list items: Ingredient names as typed by a user
+        :return tuple: The canonical names and the items that matched none
+        """
+        found = set()
+        unmatched = []
+        for item in items:
+            names = self.match(item)
+            if not names:
+                unmatched.append(item)
+            found.update(names)
+        return found, unmatched
+
+
+INGREDIENT_MATCHER = IngredientMatcher(CANONICAL_INGREDIENTS, INGREDIENT_ALIASES)
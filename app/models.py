@@ -1,8 +1,15 @@
 """Data models module"""
+import hashlib
 import uuid
 from datetime import datetime
-from werkzeug.security import generate_password_hash
-from app import db
+from flask_jwt import jwt
+from flask_sqlalchemy import BaseQuery
+from sqlalchemy import DDL, FetchedValue, and_, event, inspect, literal
+from sqlalchemy.dialects.postgresql import TSVECTOR, insert as pg_insert
+from sqlalchemy.orm.dynamic import AppenderMixin
+from app import APP, db
+from app.hashing import hash_password
+from app.ingredients import INGREDIENT_MATCHER
 
 # Linting exceptions
 
@@ -10,6 +17,23 @@ from app import db
 # pylint: disable=C0103
 # pylint: disable=R0903
 
+class RelationshipQuery(AppenderMixin, BaseQuery):
+    """
+    The query behind a dynamic relationship. Queries built from it
+    carry the relationship name and parent in ``dynamic_parent`` so
+    that loading it once per item of a loop can be spotted.
+    """
+
+    query_class = BaseQuery
+
+    def _clone(self, sess=None):
+        query = super(RelationshipQuery, self)._clone(sess)
+        query.dynamic_parent = (
+            '{}.{}'.format(type(self.instance).__name__, self.attr.key), id(self.instance)
+        )
+        return query
+
+
 class User(db.Model):
     """User model"""
 
@@ -19,36 +43,60 @@ class User(db.Model):
     public_id = db.Column(db.String(50), unique=True)
     email = db.Column(db.String(80), unique=True, nullable=False)
     username = db.Column(db.String(80), unique=True, nullable=False)
-    password = db.Column(db.String(120), nullable=False)
+    # Wide enough for pbkdf2:sha512 hashes, which run to about 160 characters
+    password = db.Column(db.String(255), nullable=False)
+    token_generation = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Children are removed by the ON DELETE CASCADE foreign keys rather
+    # than loaded into the session and deleted one by one
     categories = db.relationship(
-        'Category', backref='owner', cascade="all, delete-orphan", lazy='dynamic'
+        'Category', backref='owner', cascade="all, delete-orphan", lazy='dynamic',
+        query_class=RelationshipQuery, passive_deletes=True
     )
     recipes = db.relationship(
-        'Recipe', backref='owner', cascade="all, delete-orphan", lazy='dynamic'
+        'Recipe', backref='owner', cascade="all, delete-orphan", lazy='dynamic',
+        query_class=RelationshipQuery, passive_deletes=True
     )
 
     def __init__(self, email, username, password):
         self.public_id = uuid.uuid4()
         self.email = email
         self.username = username
-        self.password = generate_password_hash(password, method='pbkdf2:sha256')
+        self.password = hash_password(password)
+        self.token_generation = 0
+
+# Email addresses are unique regardless of case
+db.Index('ix_users_lower_email', db.func.lower(User.email), unique=True)
 
 
 class Category(db.Model):
     """Categories Model"""
 
     __tablename__ = "categories"
+    __table_args__ = (
+        db.Index('ix_categories_user_id_id', 'user_id', 'id'),
+        db.Index('ix_categories_user_id_name', 'user_id', 'name', unique=True),
+        db.Index('ix_categories_user_id_updated_on_id', 'user_id', 'updated_on', 'id'),
+    )
+    # Fetch created_on and updated_on with RETURNING when writing so
+    # that payloads can be built without reloading the row. Eager
+    # defaults are only returned for server generated values, hence the
+    # server default and the FetchedValue beside the onupdate expression
+    __mapper_args__ = {'eager_defaults': True}
 
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(
+        db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False
+    )
     name = db.Column(db.String(40), nullable=False)
     description = db.Column(db.String(40), unique=False, nullable=False)
-    created_on = db.Column(db.DateTime, default=db.func.current_timestamp())
+    created_on = db.Column(db.DateTime, server_default=db.func.current_timestamp())
     updated_on = db.Column(
-        db.DateTime, default=db.func.current_timestamp(), onupdate=db.func.current_timestamp()
+        db.DateTime, server_default=db.func.current_timestamp(),
+        onupdate=db.func.current_timestamp(), server_onupdate=FetchedValue()
     )
     recipes = db.relationship(
-        'Recipe', backref='category', cascade="all, delete-orphan", lazy='dynamic'
+        'Recipe', backref='category', cascade="all, delete-orphan", lazy='dynamic',
+        query_class=RelationshipQuery, passive_deletes=True
     )
 
     def __init__(self, name, owner, description):
@@ -60,35 +108,266 @@ class Recipe(db.Model):
     """Recipes Model"""
 
     __tablename__ = "recipes"
+    __table_args__ = (
+        db.Index('ix_recipes_category_id_id', 'category_id', 'id'),
+        db.Index('ix_recipes_category_id_name', 'category_id', 'name', unique=True),
+        db.Index('ix_recipes_category_id_updated_on_id', 'category_id', 'updated_on', 'id'),
+        db.Index('ix_recipes_user_id', 'user_id'),
+        db.Index('ix_recipes_search_vector', 'search_vector', postgresql_using='gin'),
+    )
+    __mapper_args__ = {'eager_defaults': True}
 
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(
+        db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False
+    )
     category_id = db.Column(
-        db.Integer, db.ForeignKey('categories.id'), nullable=False
+        db.Integer, db.ForeignKey('categories.id', ondelete='CASCADE'), nullable=False
     )
     name = db.Column(db.String(40), nullable=False)
     ingredients = db.Column(db.String(200), nullable=False)
     description = db.Column(db.String(500), nullable=False)
-    created_on = db.Column(db.DateTime, default=db.func.current_timestamp())
+    created_on = db.Column(db.DateTime, server_default=db.func.current_timestamp())
     updated_on = db.Column(
-        db.DateTime, default=db.func.current_timestamp(), onupdate=db.func.current_timestamp()
+        db.DateTime, server_default=db.func.current_timestamp(),
+        onupdate=db.func.current_timestamp(), server_onupdate=FetchedValue()
+    )
+    # Maintained by the recipes_search_vector_update trigger on PostgreSQL
+    search_vector = db.deferred(db.Column(TSVECTOR().with_variant(db.Text(), 'sqlite')))
+    # Maintained from the ingredients text whenever it is written
+    indexed_ingredients = db.relationship(
+        'Ingredient', secondary='recipe_ingredients', passive_deletes=True,
+        backref=db.backref('recipes', lazy='dynamic', passive_deletes=True)
+    )
+
+# Keeps the weighted search document of a recipe in step with its text
+RECIPE_SEARCH_TRIGGER = (
+    DDL("""
+        CREATE OR REPLACE FUNCTION recipes_search_vector_update() RETURNS trigger AS $$
+        BEGIN
+            NEW.search_vector :=
+                setweight(to_tsvector('english', coalesce(NEW.name, '')), 'A') ||
+                setweight(to_tsvector('english', coalesce(NEW.ingredients, '')), 'B') ||
+                setweight(to_tsvector('english', coalesce(NEW.description, '')), 'C');
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """),
+    DDL("""
+        CREATE TRIGGER recipes_search_vector_update
+        BEFORE INSERT OR UPDATE OF name, ingredients, description ON recipes
+        FOR EACH ROW EXECUTE PROCEDURE recipes_search_vector_update()
+    """)
+)
+
+for statement in RECIPE_SEARCH_TRIGGER:
+    event.listen(
+        Recipe.__table__, 'after_create', statement.execute_if(dialect='postgresql')
     )
 
+recipe_ingredients = db.Table(
+    'recipe_ingredients',
+    db.Column(
+        'recipe_id', db.Integer, db.ForeignKey('recipes.id', ondelete='CASCADE'), primary_key=True
+    ),
+    db.Column(
+        'ingredient_id', db.Integer, db.ForeignKey('ingredients.id', ondelete='CASCADE'),
+        primary_key=True
+    ),
+    db.Index('ix_recipe_ingredients_ingredient_id_recipe_id', 'ingredient_id', 'recipe_id')
+)
+
+class Ingredient(db.Model):
+    """Ingredient dictionary Model"""
+
+    __tablename__ = "ingredients"
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(80), nullable=False, unique=True)
+
+    def __init__(self, name):
+        self.name = name
+
+    @staticmethod
+    def resolve(names):
+        """
+        Returns the dictionary entries for canonical names, adding the
+        ones not seen before
+
+        :param iterable names: Canonical ingredient names
+        :return dict: The entries keyed by name
+        """
+        names = set(names)
+        if not names:
+            return {}
+        with db.session.no_autoflush:
+            found = {
+                ingredient.name: ingredient
+                for ingredient in Ingredient.query.filter(Ingredient.name.in_(names))
+            }
+            missing = names.difference(found)
+            if missing and db.session.bind.dialect.name == 'postgresql':
+                # Another request may be adding the same names
+                db.session.execute(
+                    pg_insert(Ingredient.__table__).values(
+                        [{'name': name} for name in sorted(missing)]
+                    ).on_conflict_do_nothing(index_elements=['name'])
+                )
+                found.update(
+                    (ingredient.name, ingredient)
+                    for ingredient in Ingredient.query.filter(Ingredient.name.in_(missing))
+                )
+            elif missing:
+                for name in missing:
+                    found[name] = Ingredient(name)
+                    db.session.add(found[name])
+        return found
+
+@event.listens_for(db.session, 'before_flush')
+def index_recipe_ingredients(session, flush_context, instances):
+    """
+    Links new and edited recipes to the dictionary entries of the
+    ingredients their text mentions
+    """
+    recipes = [
+        instance for instance in list(session.new) + list(session.dirty)
+        if isinstance(instance, Recipe)
+        and inspect(instance).attrs.ingredients.history.has_changes()
+    ]
+    if not recipes:
+        return
+    names = {recipe: INGREDIENT_MATCHER.match(recipe.ingredients) for recipe in recipes}
+    entries = Ingredient.resolve(set().union(*names.values()))
+    for recipe in recipes:
+        recipe.indexed_ingredients = [entries[name] for name in sorted(names[recipe])]
+
+def relink_ingredients(recipe_id, ingredients):
+    """
+    Replaces the ingredient links of a recipe written without the ORM,
+    which the before_flush hook does for ORM writes
+    """
+    entries = Ingredient.resolve(INGREDIENT_MATCHER.match(ingredients))
+    db.session.execute(
+        recipe_ingredients.delete().where(recipe_ingredients.c.recipe_id == recipe_id)
+    )
+    if entries:
+        db.session.flush()
+        db.session.execute(recipe_ingredients.insert().values([
+            dict(recipe_id=recipe_id, ingredient_id=entry.id) for entry in entries.values()
+        ]))
+
+def _payload_columns(table):
+    """
+    Returns the columns of table that are read back after a write
+    """
+    return [column for column in table.c if column.key != 'search_vector']
+
+def _synchronize(model, row, deleted=False):
+    """
+    Brings an instance of a row written without the ORM, if the session
+    holds one, in step with the database
+    """
+    instance = db.session.identity_map.get(db.session.identity_key(model, row.id))
+    if instance is None:
+        return
+    if deleted:
+        db.session.expunge(instance)
+    else:
+        db.session.expire(instance)
+
+def update_returning(model, criteria, values, previous=('name',)):
+    """
+    Updates the row of model matching criteria and returns it, or None
+    when no row matches.
+
+    On PostgreSQL this is a single UPDATE ... RETURNING joined to the
+    row as it was, so the previous values of the ``previous`` columns
+    come back as ``old_<column>`` in the same round trip.
+
+    :param model: The model whose table to update
+    :param tuple criteria: The filters picking the row, ownership included
+    :param dict values: The new column values
+    :param tuple previous: The columns whose previous values to return
+    """
+    table = model.__table__
+    columns = _payload_columns(table)
+    if db.session.bind.dialect.name == 'postgresql':
+        old = table.alias('old')
+        updated = db.session.execute(
+            table.update().values(**values).where(
+                and_(table.c.id == old.c.id, *criteria)
+            ).returning(*columns + [old.c[name].label('old_' + name) for name in previous])
+        ).first()
+    else:
+        old = db.session.query(table.c.id, *[table.c[name] for name in previous]).filter(
+            *criteria
+        ).first()
+        if old is None:
+            return None
+        db.session.execute(table.update().values(**values).where(table.c.id == old.id))
+        updated = db.session.query(
+            *columns + [literal(getattr(old, name)).label('old_' + name) for name in previous]
+        ).filter(table.c.id == old.id).first()
+    if updated is not None:
+        _synchronize(model, updated)
+    return updated
+
+def delete_returning(model, criteria, *returning):
+    """
+    Deletes the row of model matching criteria and returns the
+    returning columns it had, or None when no row matches. On
+    PostgreSQL this is a single DELETE ... RETURNING.
+    """
+    table = model.__table__
+    returning = (table.c.id,) + returning
+    if db.session.bind.dialect.name == 'postgresql':
+        deleted = db.session.execute(
+            table.delete().where(and_(*criteria)).returning(*returning)
+        ).first()
+    else:
+        deleted = db.session.query(*returning).filter(*criteria).first()
+        if deleted is not None:
+            db.session.execute(table.delete().where(and_(*criteria)))
+    if deleted is not None:
+        _synchronize(model, deleted, deleted=True)
+    return deleted
+
 class BlacklistToken(db.Model):
     """Blacklisted tokens Model"""
 
     __tablename__ = "blacklist"
 
     id = db.Column(db.Integer, primary_key=True)
-    token = db.Column(db.String(500), nullable=False, unique=True)
-    blacklisted_on = db.Column(db.DateTime, nullable=False)
+    token_hash = db.Column(db.String(64), nullable=False, unique=True)
+    expires_on = db.Column(db.DateTime, nullable=False, index=True)
+    blacklisted_on = db.Column(db.DateTime, nullable=False, index=True)
 
-    def __init__(self, token):
-        self.token = token
+    def __init__(self, token, expires_on=None):
+        self.token_hash = BlacklistToken.hash_token(token)
         self.blacklisted_on = datetime.utcnow()
+        self.expires_on = expires_on or BlacklistToken.token_expiry(token)
 
     def __repr__(self):
-        return '<Token: {} Blacklist_date {}>'.format(self.token, self.blacklisted_on)
+        return '<Token: {} Blacklist_date {}>'.format(self.token_hash, self.blacklisted_on)
+
+    @staticmethod
+    def hash_token(token):
+        """
+        Returns the fixed length digest under which a token is stored
+        """
+        return hashlib.sha256(str(token).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def token_expiry(token):
+        """
+        Returns the expiry date of a token, after which it no longer
+        needs to be blacklisted
+        """
+        try:
+            payload = jwt.decode(token, verify=False)
+            return datetime.utcfromtimestamp(payload['exp'])
+        except (jwt.InvalidTokenError, KeyError, TypeError, ValueError):
+            return datetime.utcnow() + APP.config['TOKEN_LIFETIME']
 
     @staticmethod
     def check_blacklisted(token):
@@ -96,5 +375,32 @@ class BlacklistToken(db.Model):
         Check whether access token has already been blacklisted
         """
 
-        exists = BlacklistToken.query.filter_by(token=str(token)).first()
+        exists = BlacklistToken.query.filter_by(
+            token_hash=BlacklistToken.hash_token(token)
+        ).first()
         return bool(exists)
+
+    @staticmethod
+    def purge_expired(batch_size=1000, max_batches=None):
+        """
+        Deletes expired tokens in batches, committing after each one
+
+        :param int batch_size: The number of rows deleted per statement
+        :param int max_batches: Stop after this many batches if given
+        :return int: The number of rows deleted
+        """
+        deleted = 0
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            expired = db.session.query(BlacklistToken.id).filter(
+                BlacklistToken.expires_on < datetime.utcnow()
+            ).limit(batch_size).subquery()
+            count = BlacklistToken.query.filter(
+                BlacklistToken.id.in_(expired)
+            ).delete(synchronize_session=False)
+            db.session.commit()
+            deleted += count
+            batches += 1
+            if count < batch_size:
+                break
+        return deleted
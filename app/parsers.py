@@ -1,6 +1,9 @@
 """Arguement parsers"""
 
-from webargs import fields
+from webargs import fields, validate
+
+from app.helpers import PAYLOAD_FIELDS
+from app.serializers import BATCH_LIMIT
 
 # Lint exception
 
@@ -9,8 +12,43 @@ from webargs import fields
 # Args validation parser
 SEARCH_PAGE_ARGS = {
     'q': fields.String(),
-    'page': fields.Integer(),
-    'per_page': fields.Integer()
+    'page': fields.Integer(validate=lambda page: page > 0),
+    'per_page': fields.Integer(validate=lambda per_page: 0 < per_page <= 100),
+    'cursor': fields.String(),
+    'sort': fields.String(validate=lambda sort: sort in ('id', 'updated_on'))
+}
+
+def sparse_fieldset_args(model):
+    """
+    Returns the args selecting a subset of the payload fields of model
+    """
+    names = sorted(PAYLOAD_FIELDS[model])
+    choice = validate.OneOf(names, error='Must be one of: {choices}.')
+    return {'fields': fields.DelimitedList(fields.String(validate=choice))}
+
+# Sparse fieldsets of each model
+CATEGORY_FIELDS_ARGS = sparse_fieldset_args('Category')
+RECIPE_FIELDS_ARGS = sparse_fieldset_args('Recipe')
+
+# Batch delete args
+RECIPE_IDS_ARGS = {
+    'ids': fields.DelimitedList(
+        fields.Integer(), required=True, validate=lambda ids: 0 < len(ids) <= BATCH_LIMIT
+    )
+}
+
+# Full-text search args
+FULL_TEXT_SEARCH_ARGS = {
+    'q': fields.String(required=True, validate=lambda q: bool(q.strip())),
+    'per_page': fields.Integer(validate=lambda per_page: 0 < per_page <= 100),
+    'cursor': fields.String()
+}
+
+# Pantry search args
+PANTRY_ARGS = {
+    'items': fields.DelimitedList(fields.String(), required=True),
+    'per_page': fields.Integer(validate=lambda per_page: 0 < per_page <= 100),
+    'cursor': fields.String()
 }
 
 # args documentation helper function
@@ -29,4 +67,83 @@ def make_args_parser(namespace):
     args_parser.add_argument(
         'per_page', default=5, type=int, help="The number of items to display", location='url'
     )
+    args_parser.add_argument(
+        'cursor', type=str, help="The next_cursor of the previous page", location='url'
+    )
+    args_parser.add_argument(
+        'sort', type=str, choices=('id', 'updated_on'), help="The listing order", location='url'
+    )
+    args_parser.add_argument(
+        'fields', type=str, help="Comma separated payload fields to return", location='url'
+    )
+    return args_parser
+
+def make_fields_parser(namespace):
+    """
+    Returns a documentable parser for the sparse fieldset of a single
+    item endpoint
+
+    :param object of :class: Namespace:
+    :returns object of :class: RequestParser:
+    """
+
+    args_parser = namespace.parser()
+    args_parser.add_argument(
+        'fields', type=str, help="Comma separated payload fields to return", location='url'
+    )
+    return args_parser
+
+def make_search_args_parser(namespace):
+    """
+    Returns a documentable parser for the full-text search endpoints
+
+    :param object of :class: Namespace:
+    :returns object of :class: RequestParser:
+    """
+
+    args_parser = namespace.parser()
+    args_parser.add_argument(
+        'q', type=str, required=True, help='Search query string', location='url'
+    )
+    args_parser.add_argument(
+        'per_page', default=5, type=int, help="The number of items to display", location='url'
+    )
+    args_parser.add_argument(
+        'cursor', type=str, help="The next_cursor of the previous page", location='url'
+    )
+    return args_parser
+
+def make_pantry_args_parser(namespace):
+    """
+    Returns a documentable parser for the pantry search endpoint
+
+    :param object of :class: Namespace:
+    :returns object of :class: RequestParser:
+    """
+
+    args_parser = namespace.parser()
+    args_parser.add_argument(
+        'items', type=str, required=True, help='Comma separated pantry items', location='url'
+    )
+    args_parser.add_argument(
+        'per_page', default=5, type=int, help="The number of items to display", location='url'
+    )
+    args_parser.add_argument(
+        'cursor', type=str, help="The next_cursor of the previous page", location='url'
+    )
+    return args_parser
+
+def make_ids_parser(namespace):
+    """
+    Returns a documentable parser for the batch delete endpoints
+
+    :param object of :class: Namespace:
+    :returns object of :class: RequestParser:
+    """
+
+    args_parser = namespace.parser()
+    args_parser.add_argument(
+        'ids', type=str, required=True, help='Comma separated ids of the items to delete',
+        location='url'
+    )
     return args_parser
@@ -0,0 +1,93 @@
+"""
+The lookups run on nearly every request, built as baked queries so that
+each shape is constructed and compiled to SQL once per process instead
+of on every call
+"""
+from sqlalchemy import bindparam
+from sqlalchemy.ext import baked
+from sqlalchemy.orm import load_only
+
+from app.models import db, BlacklistToken, Category, Recipe, User
+
+# Linting exceptions
+
+# pylint: disable=C0103
+# pylint: disable=E1101
+
+# Compiled query shapes, keyed by the functions that build them and
+# the columns they load
+bakery = baked.bakery()
+
+
+def _load_only(baked_query, columns):
+    """
+    Limits a baked query to the given columns, making them part of its
+    cache key
+
+    :param tuple columns: The column names to load, or None for all
+    """
+    if columns:
+        baked_query.add_criteria(lambda query: query.options(load_only(*columns)), columns)
+    return baked_query
+
+
+def user_by_public_id(public_id):
+    """
+    Returns the user a token was issued to, if any
+    """
+    baked_query = bakery(lambda session: session.query(User))
+    baked_query += lambda query: query.filter(User.public_id == bindparam('public_id'))
+    return baked_query(db.session()).params(public_id=public_id).first()
+
+
+def user_token_generation(user_id):
+    """
+    Returns a user's current token generation
+    """
+    baked_query = bakery(lambda session: session.query(User.token_generation))
+    baked_query += lambda query: query.filter(User.id == bindparam('user_id'))
+    return baked_query(db.session()).params(user_id=user_id).scalar()
+
+
+def token_blacklisted(token_hash):
+    """
+    Checks whether the token with the given digest has been blacklisted
+
+    :param str token_hash: The token's digest, see BlacklistToken.hash_token
+    :return bool:
+    """
+    baked_query = bakery(lambda session: session.query(BlacklistToken.id))
+    baked_query += lambda query: query.filter(
+        BlacklistToken.token_hash == bindparam('token_hash')
+    )
+    return baked_query(db.session()).params(token_hash=token_hash).first() is not None
+
+
+def user_category(user_id, category_id, columns=None):
+    """
+    Returns a category if it belongs to the user
+
+    :param tuple columns: The column names to load, or None for all
+    """
+    baked_query = bakery(lambda session: session.query(Category))
+    baked_query += lambda query: query.filter(
+        Category.user_id == bindparam('user_id'), Category.id == bindparam('category_id')
+    )
+    return _load_only(baked_query, columns)(db.session()).params(
+        user_id=user_id, category_id=category_id
+    ).first()
+
+
+def category_recipe(category_id, recipe_id, columns=None):
+    """
+    Returns a recipe if it is in the category
+
+    :param tuple columns: The column names to load, or None for all
+    """
+    baked_query = bakery(lambda session: session.query(Recipe))
+    baked_query += lambda query: query.filter(
+        Recipe.category_id == bindparam('category_id'), Recipe.id == bindparam('recipe_id')
+    )
+    return _load_only(baked_query, columns)(db.session()).params(
+        category_id=category_id, recipe_id=recipe_id
+    ).first()
@@ -1,6 +1,8 @@
 """RESTPLus API init"""
 from flask_restplus import Api
 
+from app.encoding import output_json
+
 # Linting exception
 # pylint: disable=C0103
 
@@ -20,3 +22,6 @@ API = Api(
     prefix='/api/v1',
     doc='/api/v1/docs'
 )
+
+# Encode resource responses with the app's configured encoder
+API.representation('application/json')(output_json)
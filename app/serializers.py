@@ -38,3 +38,31 @@ recipe = API.model('Recipe', {
     'ingredients': fields.String(required=True, description='All the necessary ingredients'),
     'description': fields.String(required=True, description='The instruction on preparation')
 })
+
+# The most items a batch request may carry
+BATCH_LIMIT = 100
+
+# Batch items are validated one by one so that each gets its own status
+recipe_batch_item = API.model('Recipe batch item', {
+    'name': fields.String(description='Name of the recipe'),
+    'ingredients': fields.String(description='All the necessary ingredients'),
+    'description': fields.String(description='The instruction on preparation')
+})
+
+recipe_batch = API.model('Recipe batch', {
+    'recipes': fields.List(
+        fields.Nested(recipe_batch_item), required=True, min_items=1, max_items=BATCH_LIMIT,
+        description='The recipes to create'
+    )
+})
+
+recipe_update_batch_item = API.inherit('Recipe update batch item', recipe_batch_item, {
+    'id': fields.Integer(required=True, description='The id of the recipe to update')
+})
+
+recipe_update_batch = API.model('Recipe update batch', {
+    'recipes': fields.List(
+        fields.Nested(recipe_update_batch_item), required=True, min_items=1,
+        max_items=BATCH_LIMIT, description='The recipes to update'
+    )
+})
@@ -0,0 +1,22 @@
+"""
+Performance benchmarks
+
+The benchmarks that need a database create and drop their own tables,
+so they refuse to run against anything but the testing database:
+
+    APP_CONFIG=testing python -m benchmarks.<name>
+"""
+import sys
+
+from app import APP
+
+
+def require_test_database():
+    """
+    Exits unless the app runs the testing config against its test
+    database
+    """
+    if not APP.config.get('TESTING') or \
+            not APP.config['SQLALCHEMY_DATABASE_URI'].endswith('_test'):
+        sys.exit("This benchmark drops its tables when done, "
+                 "run it with APP_CONFIG=testing against the test database.")
@@ -0,0 +1,96 @@
+"""
+Per call cost of the lookups run on nearly every request, built through
+the Query API each time against the baked queries of app.queries
+
+Both forms send the same SQL, so the difference between them is the
+Python spent building and compiling the query.
+
+    APP_CONFIG=testing python -m benchmarks.hot_lookups --calls 5000
+"""
+import argparse
+import time
+
+from app import APP, db, queries
+from app.models import BlacklistToken, Category, Recipe, User
+from benchmarks import require_test_database
+
+# Linting exceptions
+# pylint: disable=C0103
+# pylint: disable=E1101
+
+
+def _setup():
+    """Adds a user owning a category with a recipe and a blacklisted token"""
+    user = User(email="lookups@yum.my", username="lookups", password="L00kup@ss")
+    db.session.add(user)
+    db.session.flush()
+    category = Category(name="Lookups", owner=user.id, description="Benchmark recipes")
+    db.session.add(category)
+    db.session.flush()
+    recipe = Recipe(
+        name="lookups", category_id=category.id, user_id=user.id,
+        ingredients="Salt", description="Mix"
+    )
+    db.session.add_all([recipe, BlacklistToken(token="lookups.token")])
+    db.session.commit()
+    # public_id is read back as the string the tokens carry
+    db.session.refresh(user)
+    return user, category, recipe
+
+
+def _lookups(user, category, recipe):
+    """Returns each lookup as built before and by app.queries"""
+    token_hash = BlacklistToken.hash_token("lookups.token")
+    return [
+        ("user by public_id",
+         lambda: User.query.filter_by(public_id=user.public_id).first(),
+         lambda: queries.user_by_public_id(user.public_id)),
+        ("blacklist by token",
+         lambda: bool(BlacklistToken.query.filter_by(token_hash=token_hash).first()),
+         lambda: queries.token_blacklisted(token_hash)),
+        ("category of user",
+         lambda: user.categories.filter_by(id=category.id).first(),
+         lambda: queries.user_category(user.id, category.id)),
+        ("recipe of category",
+         lambda: category.recipes.filter_by(id=recipe.id).first(),
+         lambda: queries.category_recipe(category.id, recipe.id)),
+    ]
+
+
+def _time(lookup, calls):
+    """Returns the mean time of a lookup in microseconds"""
+    lookup()
+    started = time.perf_counter()
+    for _ in range(calls):
+        lookup()
+    return (time.perf_counter() - started) / calls * 1e6
+
+
+def main():
+    """Runs the benchmark"""
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--calls', type=int, default=2000)
+    args = arg_parser.parse_args()
+    require_test_database()
+
+    with APP.app_context():
+        db.create_all()
+        try:
+            print("{:<20} {:>12} {:>12} {:>9}".format("lookup", "query api", "baked", "saved"))
+            totals = [0.0, 0.0]
+            for label, built, baked in _lookups(*_setup()):
+                timings = [_time(built, args.calls), _time(baked, args.calls)]
+                totals = [total + timing for total, timing in zip(totals, timings)]
+                print("{:<20} {:>9.1f} us {:>9.1f} us {:>8.0f}%".format(
+                    label, timings[0], timings[1], 100 * (1 - timings[1] / timings[0])
+                ))
+            print("{:<20} {:>9.1f} us {:>9.1f} us {:>8.0f}%".format(
+                "all four", totals[0], totals[1], 100 * (1 - totals[1] / totals[0])
+            ))
+        finally:
+            db.session.remove()
+            db.drop_all()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Encoding time of recipe listings with each available JSON encoder,
+against Flask's own encoder
+
+A listing is encoded both ways the endpoints do it: whole, as jsonify
+does for search results, and as one fragment per recipe through
+compact_dumps, as the listings do before their fragments are cached.
+No database is needed.
+
+    APP_CONFIG=testing python -m benchmarks.json_encoders --per-page 100
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from flask import json as flask_json
+
+from app import APP
+from app.encoding import FAST_ENCODERS, compact_dumps, json_encoder, load_dumps
+
+# Linting exceptions
+# pylint: disable=C0103
+
+INGREDIENTS = "2 cups flour, 1 cup sugar, 3 eggs, 1 cup milk, a pinch of salt, 2 tbsp butter"
+DESCRIPTION = (
+    "Whisk the eggs and sugar until pale, fold in the flour and salt, then the milk "
+    "and melted butter. Rest the batter for half an hour and cook in a hot pan."
+)
+
+
+def _recipes(per_page):
+    """Returns a page of recipe payloads as make_payload builds them"""
+    created = datetime(2018, 2, 3, 4, 5, 6)
+    return [
+        dict(
+            id=index, name="recipe_{}".format(index), ingredients=INGREDIENTS,
+            description=DESCRIPTION, category_id=1,
+            date_created=created + timedelta(minutes=index),
+            date_updated=created + timedelta(minutes=index, seconds=30)
+        )
+        for index in range(per_page)
+    ]
+
+
+def _encode_whole(recipes):
+    """Encodes the page as one document"""
+    return flask_json.dumps(dict(
+        recipes=recipes, page_details=dict(next_page=None, next_cursor=None,
+                                           item_count=len(recipes))
+    ), separators=(',', ':'))
+
+
+def _encode_fragments(recipes):
+    """Encodes each recipe on its own"""
+    return [compact_dumps(each) for each in recipes]
+
+
+def _time(encode, recipes, rounds):
+    """Returns the mean time of an encoding in microseconds"""
+    encode(recipes)
+    started = time.perf_counter()
+    for _ in range(rounds):
+        encode(recipes)
+    return (time.perf_counter() - started) / rounds * 1e6
+
+
+def main():
+    """Runs the benchmark"""
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--per-page', type=int, default=100)
+    arg_parser.add_argument('--rounds', type=int, default=500)
+    args = arg_parser.parse_args()
+
+    recipes = _recipes(args.per_page)
+    encoders = [('flask', flask_json.JSONEncoder), ('stdlib', json_encoder('stdlib'))] + [
+        (name, json_encoder(name)) for name in FAST_ENCODERS if load_dumps(name)
+    ]
+    default_encoder = APP.json_encoder
+    with APP.app_context():
+        try:
+            print("{:<8} {:>12} {:>12}".format("encoder", "whole", "fragments"))
+            for name, encoder in encoders:
+                APP.json_encoder = encoder
+                print("{:<8} {:>9.0f} us {:>9.0f} us".format(
+                    name, _time(_encode_whole, recipes, args.rounds),
+                    _time(_encode_fragments, recipes, args.rounds)
+                ))
+        finally:
+            APP.json_encoder = default_encoder
+
+
+if __name__ == '__main__':
+    main()
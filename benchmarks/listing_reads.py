@@ -0,0 +1,115 @@
+"""
+CPU time and memory of reading a listing page as ORM entities against
+reading it as plain column tuples through select_rows
+
+Each round reads one page of a user's categories and of a category's
+recipes and builds their payloads, as the listing endpoints do before
+their payload fragments are cached.
+
+    APP_CONFIG=testing python -m benchmarks.listing_reads --per-page 100
+"""
+import argparse
+import time
+import tracemalloc
+
+from app import APP, db
+from app.helpers import make_payload, select_rows
+from app.models import Category, Recipe, User
+from benchmarks import require_test_database
+
+# Linting exceptions
+# pylint: disable=C0103
+# pylint: disable=E1101
+
+
+def _setup(per_page):
+    """Adds a user with a page of categories, the first holding a page of recipes"""
+    user = User(email="listing@yum.my", username="listing", password="L1sting@ss")
+    db.session.add(user)
+    db.session.flush()
+    db.session.add_all([
+        Category(name="Category {}".format(index), owner=user.id,
+                 description="Benchmark recipes")
+        for index in range(per_page)
+    ])
+    db.session.flush()
+    category = Category.query.filter_by(user_id=user.id).order_by(Category.id).first()
+    db.session.add_all([
+        Recipe(name="recipe_{}".format(index), category_id=category.id, user_id=user.id,
+               ingredients="Flour, eggs and butter", description="Mix and bake")
+        for index in range(per_page)
+    ])
+    db.session.commit()
+    return user.id, category.id
+
+
+def _read_entities(user_id, category_id, per_page):
+    """Reads both pages as entities"""
+    categories = Category.query.filter_by(user_id=user_id).order_by(Category.id)
+    recipes = Recipe.query.filter_by(category_id=category_id).order_by(Recipe.id)
+    return (
+        [make_payload(category=each) for each in categories.limit(per_page).all()],
+        [make_payload(recipe=each) for each in recipes.limit(per_page).all()]
+    )
+
+
+def _read_rows(user_id, category_id, per_page):
+    """Reads both pages as column tuples"""
+    categories = select_rows(Category.query.filter_by(user_id=user_id), Category)
+    recipes = select_rows(Recipe.query.filter_by(category_id=category_id), Recipe)
+    return (
+        [make_payload(category=each)
+         for each in categories.order_by(Category.id).limit(per_page).all()],
+        [make_payload(recipe=each)
+         for each in recipes.order_by(Recipe.id).limit(per_page).all()]
+    )
+
+
+def _measure(read, args, rounds):
+    """
+    Returns the CPU milliseconds and peak traced KiB of a round, each
+    round in a fresh session as in a request
+    """
+    read(*args)
+    db.session.remove()
+    started = time.process_time()
+    for _ in range(rounds):
+        read(*args)
+        db.session.remove()
+    cpu = (time.process_time() - started) / rounds * 1000
+    tracemalloc.start()
+    read(*args)
+    peak = tracemalloc.get_traced_memory()[1] / 1024
+    tracemalloc.stop()
+    db.session.remove()
+    return cpu, peak
+
+
+def main():
+    """Runs the benchmark"""
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--per-page', type=int, default=100)
+    arg_parser.add_argument('--rounds', type=int, default=200)
+    args = arg_parser.parse_args()
+    require_test_database()
+
+    with APP.app_context():
+        db.create_all()
+        try:
+            read_args = _setup(args.per_page) + (args.per_page,)
+            print("{:<10} {:>12} {:>12}".format("read", "cpu", "peak memory"))
+            results = []
+            for label, read in (("entities", _read_entities), ("rows", _read_rows)):
+                results.append(_measure(read, read_args, args.rounds))
+                print("{:<10} {:>9.2f} ms {:>8.0f} KiB".format(label, *results[-1]))
+            print("{:<10} {:>11.0f}% {:>11.0f}%".format(
+                "saved", 100 * (1 - results[1][0] / results[0][0]),
+                100 * (1 - results[1][1] / results[0][1])
+            ))
+        finally:
+            db.session.remove()
+            db.drop_all()
+
+
+if __name__ == '__main__':
+    main()
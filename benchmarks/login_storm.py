@@ -0,0 +1,143 @@
+"""
+Recipe GET latency before and during a login storm
+
+The storm is run twice: once with every login thread hashing at the
+same time, as when hashing ran inline on the request thread, and once
+through a hashing pool. The storm fills every request thread THREADS
+configures, and the pool, timeout and hash cost default to what the
+app ships with.
+
+    APP_CONFIG=testing python -m benchmarks.login_storm
+"""
+import argparse
+import json
+import threading
+import time
+
+from app import APP, db, hashing
+from benchmarks import require_test_database
+from instance.config import BaseConfig
+
+# Linting exceptions
+# pylint: disable=C0103
+
+USER = dict(email="storm@yum.my", username="storm", password="St0rmp@ss")
+
+
+def _percentile(samples, fraction):
+    """Returns the given percentile of the samples in milliseconds"""
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)] * 1000
+
+
+def _report(label, samples):
+    """Prints latency figures for a set of samples"""
+    print("{:<14} p50 {:7.2f} ms   p95 {:7.2f} ms   max {:7.2f} ms".format(
+        label, _percentile(samples, 0.5), _percentile(samples, 0.95), max(samples) * 1000
+    ))
+
+
+def _setup(client):
+    """Registers a user with a single recipe and returns an auth header"""
+    client.post('/api/v1/auth/register', data=json.dumps(USER), content_type='application/json')
+    login_resp = client.post(
+        '/api/v1/auth/login', data=json.dumps(USER), content_type='application/json'
+    )
+    auth_header = dict(Authorization=json.loads(login_resp.data.decode())['access_token'])
+    client.post('/api/v1/category', headers=auth_header, content_type='application/json',
+                data=json.dumps(dict(name="Storm", description="Benchmark recipes")))
+    client.post('/api/v1/category/1/recipes', headers=auth_header,
+                content_type='application/json',
+                data=json.dumps(dict(name="Storm", ingredients="Salt", description="Mix")))
+    return auth_header
+
+
+def _time_gets(client, auth_header, requests):
+    """Times a number of recipe GET requests"""
+    samples = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        client.get('/api/v1/category/1/recipes/1', headers=auth_header)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def _login_storm(stop, outcomes):
+    """Logs in repeatedly until told to stop, backing off as asked on a 503"""
+    client = APP.test_client()
+    with APP.app_context():
+        while not stop.is_set():
+            response = client.post(
+                '/api/v1/auth/login', data=json.dumps(USER), content_type='application/json'
+            )
+            outcomes.append(response.status_code)
+            if response.status_code == 503:
+                stop.wait(float(response.headers['Retry-After']))
+
+
+def _storm(client, auth_header, args, pool):
+    """Times recipe GETs while the storm threads log in through the given pool"""
+    default_pool, hashing.HASHING_POOL = hashing.HASHING_POOL, pool
+    stop, outcomes = threading.Event(), []
+    storm = [
+        threading.Thread(target=_login_storm, args=(stop, outcomes))
+        for _ in range(args.storm_threads)
+    ]
+    try:
+        for thread in storm:
+            thread.start()
+        time.sleep(0.5)
+        samples = _time_gets(client, auth_header, args.requests)
+    finally:
+        stop.set()
+        for thread in storm:
+            thread.join()
+        hashing.HASHING_POOL = default_pool
+    return samples, outcomes
+
+
+def main():
+    """Runs the benchmark"""
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument('--storm-threads', type=int, default=APP.config['THREADS'])
+    arg_parser.add_argument('--requests', type=int, default=200)
+    arg_parser.add_argument('--pool-size', type=int, default=APP.config['HASHING_POOL_SIZE'])
+    arg_parser.add_argument('--queue-depth', type=int, default=APP.config['HASHING_QUEUE_DEPTH'])
+    # The testing config hashes cheaply, time the storm at the shipped cost
+    arg_parser.add_argument(
+        '--iterations', type=int, default=BaseConfig.PASSWORD_HASH_ITERATIONS
+    )
+    args = arg_parser.parse_args()
+    require_test_database()
+    APP.config['PASSWORD_HASH_ITERATIONS'] = args.iterations
+    print("{} storm threads, pool of {} with {} queued, {} iterations".format(
+        args.storm_threads, args.pool_size, args.queue_depth, args.iterations
+    ))
+
+    client = APP.test_client()
+    with APP.app_context():
+        db.create_all()
+        try:
+            auth_header = _setup(client)
+            _time_gets(client, auth_header, 20)
+            _report("idle", _time_gets(client, auth_header, args.requests))
+            phases = [
+                ("unbounded", hashing.HashingPool(workers=args.storm_threads, queue_depth=0)),
+                ("pooled", hashing.HashingPool(
+                    workers=args.pool_size, queue_depth=args.queue_depth,
+                    timeout=APP.config['HASHING_TIMEOUT']
+                )),
+            ]
+            for label, pool in phases:
+                samples, outcomes = _storm(client, auth_header, args, pool)
+                _report(label, samples)
+                print("{:<14} logins: {} ok, {} turned away with 503".format(
+                    "", outcomes.count(200), outcomes.count(503)
+                ))
+        finally:
+            db.session.remove()
+            db.drop_all()
+
+
+if __name__ == '__main__':
+    main()
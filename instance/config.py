@@ -1,6 +1,7 @@
 """App intance configs"""
 
 import os
+from datetime import timedelta
 # Linting exceptions
 
 # pylint: disable=C0103
@@ -25,12 +26,95 @@ class BaseConfig:
     RESTPLUS_VALIDATE = True
     RESTPLUS_MASK_SWAGGER = False
     ERROR_404_HELP = False
+    # Access tokens
+    TOKEN_LIFETIME = timedelta(weeks=3)
+    # How logged out tokens are revoked: 'blacklist' stores every token,
+    # 'generation' bumps a per-user counter which logs the user out everywhere
+    TOKEN_REVOCATION = os.environ.get('TOKEN_REVOCATION', 'blacklist')
+    # Verified access token cache. Entries live until the token expires
+    # or TOKEN_CACHE_TTL seconds pass, which bounds how long a logout
+    # served by another worker can go unnoticed.
+    TOKEN_CACHE_SIZE = 1024
+    TOKEN_CACHE_TTL = 60
+    # Each worker logs its cache counters every CACHE_STATS_INTERVAL
+    # seconds, 0 turns the log line off
+    CACHE_STATS_INTERVAL = int(os.environ.get('CACHE_STATS_INTERVAL', 600))
+    # Bloom filter in front of the token blacklist
+    BLACKLIST_FILTER_CAPACITY = 100000
+    BLACKLIST_FILTER_ERROR_RATE = 0.001
+    BLACKLIST_FILTER_REFRESH = 30
+    # Seconds each refresh reads back, so tokens blacklisted by a
+    # transaction that commits late are not missed
+    BLACKLIST_FILTER_OVERLAP = 300
+    # Expired blacklist rows are purged by `manage.py purge_blacklist`,
+    # or every BLACKLIST_SWEEP_INTERVAL seconds from logout when set
+    BLACKLIST_SWEEP_INTERVAL = None
+    BLACKLIST_SWEEP_BATCH_SIZE = 1000
+    # Request threads per worker, passed to gunicorn's --threads by
+    # the Procfile
+    THREADS = int(os.environ.get('THREADS', 8))
+    # Password hashing pool. Requests beyond HASHING_POOL_SIZE running
+    # and HASHING_QUEUE_DEPTH waiting hashes get a 503 with Retry-After.
+    # Together they hold at most half of the request threads, so the
+    # pool fills and turns logins away while the other half still
+    # serves everything else.
+    HASHING_POOL_SIZE = max(1, THREADS // 4)
+    HASHING_QUEUE_DEPTH = max(0, THREADS // 2 - HASHING_POOL_SIZE)
+    HASHING_TIMEOUT = 5
+    HASHING_RETRY_AFTER = 1
+    # Password hash cost, see `manage.py calibrate_hash`. Hashes made
+    # with other settings are upgraded on the user's next login.
+    PASSWORD_HASH_ALGORITHM = os.environ.get('PASSWORD_HASH_ALGORITHM', 'sha256')
+    PASSWORD_HASH_ITERATIONS = int(os.environ.get('PASSWORD_HASH_ITERATIONS', 50000))
+    # Level of the app's log messages
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+    # Per-request query count and database time, reported in a
+    # Server-Timing header and, if SQL_INSTRUMENTATION_LOG is set, a
+    # JSON log line per request
+    SQL_INSTRUMENTATION = os.environ.get('SQL_INSTRUMENTATION', '') == 'on'
+    SQL_INSTRUMENTATION_LOG = os.environ.get('SQL_INSTRUMENTATION_LOG', '') == 'on'
+    # With instrumentation on, warn (or raise under QUERY_REPEAT_RAISE)
+    # when a request runs the same statement, or queries the same
+    # dynamic relationship for different parents, more than
+    # QUERY_REPEAT_THRESHOLD times
+    QUERY_REPEAT_THRESHOLD = None
+    QUERY_REPEAT_RAISE = False
+    # Worker processes the server runs, which gunicorn reads from
+    # WEB_CONCURRENCY unless given --workers
+    WORKERS = int(os.environ.get('WEB_CONCURRENCY', 1))
+    # Listing and search response cache: 'local' keeps it in the
+    # worker, 'redis' shares it through RESPONSE_CACHE_REDIS_URL and
+    # 'off' disables it. A local cache only sees the writes its own
+    # worker serves, so with several workers the others serve a
+    # writer's old listings for up to RESPONSE_CACHE_TTL seconds; a
+    # warning is logged when WORKERS is above one. Writes made outside
+    # the server, like `manage.py import_library`, can only invalidate
+    # the 'redis' backend
+    RESPONSE_CACHE_BACKEND = os.environ.get('RESPONSE_CACHE_BACKEND', 'local')
+    RESPONSE_CACHE_REDIS_URL = os.environ.get(
+        'RESPONSE_CACHE_REDIS_URL', os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+    )
+    RESPONSE_CACHE_SIZE = 4096
+    RESPONSE_CACHE_TTL = 300
+    # Encoded JSON of single categories and recipes, reused until the
+    # row's updated_on changes
+    FRAGMENT_CACHE_SIZE = 10000
+    # Rows fetched per round trip of the library export's server-side cursor
+    EXPORT_YIELD_PER = 1000
+    # Items of an imported library validated and written per statement
+    IMPORT_CHUNK_SIZE = 1000
+    # Response JSON encoder: 'stdlib', 'orjson', 'ujson' or 'fast' for
+    # whichever of those two is installed. Falls back to the stdlib
+    # encoder when the library is missing
+    JSON_ENCODER = os.environ.get('JSON_ENCODER', 'stdlib')
 
 
 class DevelopmentConfig(BaseConfig):
     """Development configuration."""
     DEBUG = True
     SQLALCHEMY_DATABASE_URI = database_url + database_name
+    SQL_INSTRUMENTATION = True
+    QUERY_REPEAT_THRESHOLD = 3
 
 
 class TestingConfig(BaseConfig):
@@ -38,7 +122,11 @@ class TestingConfig(BaseConfig):
     DEBUG = True
     TESTING = True
     SQLALCHEMY_DATABASE_URI = database_url + database_name + '_test'
+    SQL_INSTRUMENTATION = True
+    QUERY_REPEAT_THRESHOLD = 3
+    QUERY_REPEAT_RAISE = True
     PRESERVE_CONTEXT_ON_EXCEPTION = False
+    PASSWORD_HASH_ITERATIONS = 1000
 
 
 class ProductionConfig(BaseConfig):
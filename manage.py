@@ -3,7 +3,9 @@
 from flask_script import Manager
 from flask_migrate import Migrate, MigrateCommand
 
-from app import APP, db, models
+from app import APP, db, models, hashing
+from app.helpers import RESPONSE_CACHE
+from app.helpers.importer import LibraryImport, read_records
 
 
 migrate = Migrate(APP, db)
@@ -25,5 +27,56 @@ def drop_db():
     db.drop_all()
 
 
+@manager.option('-b', '--batch-size', dest='batch_size', default=1000, type=int)
+def purge_blacklist(batch_size):
+    """Deletes expired tokens from the blacklist."""
+    deleted = models.BlacklistToken.purge_expired(batch_size=batch_size)
+    print("Purged {} expired tokens from the blacklist.".format(deleted))
+
+
+@manager.option('-t', '--target-ms', dest='target_ms', default=250, type=float)
+@manager.option('-a', '--algorithm', dest='algorithm', default='sha256')
+def calibrate_hash(target_ms, algorithm):
+    """Picks a password hash cost that meets a target verify time."""
+    iterations = hashing.calibrate_iterations(target_ms / 1000.0, algorithm=algorithm)
+    print("Set PASSWORD_HASH_ALGORITHM={} and PASSWORD_HASH_ITERATIONS={} "
+          "for ~{:g} ms per verify on this machine.".format(algorithm, iterations, target_ms))
+
+
+@manager.option('-c', '--chunk-size', dest='chunk_size', default=1000, type=int)
+@manager.option('path', help='An NDJSON export or CSV file, optionally gzipped (.gz)')
+@manager.option('email', help='The email of the user to import into')
+def import_library(email, path, chunk_size):
+    """Loads an NDJSON or CSV library dump into a user's account."""
+    user = models.User.query.filter(
+        db.func.lower(models.User.email) == email.lower()
+    ).first()
+    if not user:
+        print("No user is registered with {}.".format(email))
+        return
+    import_format = 'csv' if '.csv' in path else 'ndjson'
+    with open(path, 'rb') as stream:
+        report = LibraryImport(user.id, chunk_size).run(
+            read_records(stream, import_format, compressed=path.endswith('.gz'))
+        )
+    # Only a shared cache can be invalidated from here, a local one
+    # belongs to each server worker and serves the old listings until
+    # they expire
+    if RESPONSE_CACHE is not None and RESPONSE_CACHE.backend.shared:
+        RESPONSE_CACHE.bump(user.id)
+    elif RESPONSE_CACHE is not None:
+        print("The server may serve listings from before the import for up to {} seconds, "
+              "set RESPONSE_CACHE_BACKEND=redis for imports to invalidate them.".format(
+                  RESPONSE_CACHE.ttl))
+    print("Imported {} categories ({} existing) and {} recipes ({} skipped).".format(
+        report['categories']['created'], report['categories']['existing'],
+        report['recipes']['created'], report['recipes']['skipped']
+    ))
+    for error in report['errors']:
+        print("Line {}: {} {}".format(error['line'], error['message'], error.get('errors', '')))
+    if report['error_count'] > len(report['errors']):
+        print("... and {} more errors.".format(report['error_count'] - len(report['errors'])))
+
+
 if __name__ == '__main__':
     manager.run()
@@ -0,0 +1,69 @@
+"""hash keyed blacklist
+
+Revision ID: 3c1f9a2d4b7e
+Revises: 77dfa5073afc
+Create Date: 2026-10-17 19:02:41.516203
+
+"""
+import hashlib
+from datetime import datetime, timedelta
+
+from alembic import op
+import sqlalchemy as sa
+import jwt
+
+
+# revision identifiers, used by Alembic.
+revision = '3c1f9a2d4b7e'
+down_revision = '77dfa5073afc'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('blacklist', sa.Column('token_hash', sa.String(length=64), nullable=True))
+    op.add_column('blacklist', sa.Column('expires_on', sa.DateTime(), nullable=True))
+
+    # Replace the stored tokens with their digests and expiry dates
+    connection = op.get_bind()
+    blacklist = sa.table(
+        'blacklist',
+        sa.column('id', sa.Integer),
+        sa.column('token', sa.String),
+        sa.column('token_hash', sa.String),
+        sa.column('expires_on', sa.DateTime),
+        sa.column('blacklisted_on', sa.DateTime)
+    )
+    rows = connection.execute(
+        sa.select([blacklist.c.id, blacklist.c.token, blacklist.c.blacklisted_on])
+    ).fetchall()
+    for row_id, token, blacklisted_on in rows:
+        try:
+            expires_on = datetime.utcfromtimestamp(jwt.decode(token, verify=False)['exp'])
+        except (jwt.InvalidTokenError, KeyError, TypeError, ValueError):
+            expires_on = blacklisted_on + timedelta(weeks=3)
+        connection.execute(
+            blacklist.update().where(blacklist.c.id == row_id).values(
+                token_hash=hashlib.sha256(token.encode('utf-8')).hexdigest(),
+                expires_on=expires_on
+            )
+        )
+
+    op.alter_column('blacklist', 'token_hash', nullable=False)
+    op.alter_column('blacklist', 'expires_on', nullable=False)
+    op.create_unique_constraint('blacklist_token_hash_key', 'blacklist', ['token_hash'])
+    op.create_index(op.f('ix_blacklist_expires_on'), 'blacklist', ['expires_on'], unique=False)
+    op.drop_constraint('blacklist_token_key', 'blacklist', type_='unique')
+    op.drop_column('blacklist', 'token')
+
+
+def downgrade():
+    # The original tokens cannot be recovered from their digests, so
+    # the blacklist is emptied on the way down.
+    op.execute('DELETE FROM blacklist')
+    op.add_column('blacklist', sa.Column('token', sa.String(length=500), nullable=False))
+    op.create_unique_constraint('blacklist_token_key', 'blacklist', ['token'])
+    op.drop_index(op.f('ix_blacklist_expires_on'), table_name='blacklist')
+    op.drop_constraint('blacklist_token_hash_key', 'blacklist', type_='unique')
+    op.drop_column('blacklist', 'expires_on')
+    op.drop_column('blacklist', 'token_hash')
@@ -0,0 +1,39 @@
+"""cascading deletes
+
+Revision ID: 9b3d5e7f1a26
+Revises: 2f8d6b1c9e03
+Create Date: 2026-10-17 23:12:40.518334
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '9b3d5e7f1a26'
+down_revision = '2f8d6b1c9e03'
+branch_labels = None
+depends_on = None
+
+# (constraint, table, column, referred table)
+FOREIGN_KEYS = (
+    ('categories_user_id_fkey', 'categories', 'user_id', 'users'),
+    ('recipes_user_id_fkey', 'recipes', 'user_id', 'users'),
+    ('recipes_category_id_fkey', 'recipes', 'category_id', 'categories'),
+    ('recipe_ingredients_recipe_id_fkey', 'recipe_ingredients', 'recipe_id', 'recipes'),
+    ('recipe_ingredients_ingredient_id_fkey', 'recipe_ingredients', 'ingredient_id',
+     'ingredients'),
+)
+
+
+def _replace_foreign_keys(ondelete):
+    for name, table, column, referred in FOREIGN_KEYS:
+        op.drop_constraint(name, table, type_='foreignkey')
+        op.create_foreign_key(name, table, referred, [column], ['id'], ondelete=ondelete)
+
+
+def upgrade():
+    _replace_foreign_keys('CASCADE')
+
+
+def downgrade():
+    _replace_foreign_keys(None)
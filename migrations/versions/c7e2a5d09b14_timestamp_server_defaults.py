@@ -0,0 +1,33 @@
+"""timestamp server defaults
+
+Revision ID: c7e2a5d09b14
+Revises: 9b3d5e7f1a26
+Create Date: 2026-10-18 10:41:07.204915
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7e2a5d09b14'
+down_revision = '9b3d5e7f1a26'
+branch_labels = None
+depends_on = None
+
+TIMESTAMP_COLUMNS = (
+    ('categories', 'created_on'),
+    ('categories', 'updated_on'),
+    ('recipes', 'created_on'),
+    ('recipes', 'updated_on'),
+)
+
+
+def upgrade():
+    for table, column in TIMESTAMP_COLUMNS:
+        op.alter_column(table, column, server_default=sa.func.current_timestamp())
+
+
+def downgrade():
+    for table, column in TIMESTAMP_COLUMNS:
+        op.alter_column(table, column, server_default=None)
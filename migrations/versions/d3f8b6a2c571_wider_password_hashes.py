@@ -0,0 +1,31 @@
+"""wider password hashes
+
+Revision ID: d3f8b6a2c571
+Revises: c7e2a5d09b14
+Create Date: 2026-10-18 14:02:51.730184
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3f8b6a2c571'
+down_revision = 'c7e2a5d09b14'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.alter_column(
+        'users', 'password', type_=sa.String(length=255),
+        existing_type=sa.String(length=120), existing_nullable=False
+    )
+
+
+def downgrade():
+    # hashes longer than 120 characters have to be reset first
+    op.alter_column(
+        'users', 'password', type_=sa.String(length=120),
+        existing_type=sa.String(length=255), existing_nullable=False
+    )
@@ -0,0 +1,23 @@
+"""blacklisted_on index
+
+Revision ID: e4a9c7b3d812
+Revises: d3f8b6a2c571
+Create Date: 2026-10-18 15:21:07.418263
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4a9c7b3d812'
+down_revision = 'd3f8b6a2c571'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(op.f('ix_blacklist_blacklisted_on'), 'blacklist', ['blacklisted_on'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_blacklist_blacklisted_on'), table_name='blacklist')
@@ -0,0 +1,27 @@
+"""category updated_on keyset index
+
+Revision ID: f1c5a8e2d497
+Revises: e4a9c7b3d812
+Create Date: 2026-10-18 17:40:12.903551
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1c5a8e2d497'
+down_revision = 'e4a9c7b3d812'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # IF NOT EXISTS: for a while 5d7b3e9a0c21 created this index itself
+    op.execute(
+        'CREATE INDEX IF NOT EXISTS ix_categories_user_id_updated_on_id '
+        'ON categories (user_id, updated_on, id)'
+    )
+
+
+def downgrade():
+    op.drop_index('ix_categories_user_id_updated_on_id', table_name='categories')
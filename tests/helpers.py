@@ -1,7 +1,10 @@
 """
 This are helper methods/functions shared across test cases
 """
+from contextlib import contextmanager
 from flask import json
+from sqlalchemy import event
+from app.models import db
 
 # linting exception
 # pylint: disable=C0103
@@ -98,3 +101,42 @@ def login_user(self):
     return self.client.post('/api/v1/auth/login',
                             data=json.dumps(login_details), content_type='application/json'
                            )
+
+# Count the SQL statements run by a block
+@contextmanager
+def count_queries():
+    """Collects the SQL statements executed within the block"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args): # pylint: disable=W0613
+        """Records each statement"""
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+class FakeRedis:
+    """An in-memory stand-in for the parts of redis.StrictRedis the app uses"""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        """Returns the bytes stored under key"""
+        value = self.data.get(key)
+        return value.encode('utf-8') if value is not None else None
+
+    def set(self, key, value, ex=None, nx=False): # pylint: disable=W0613
+        """Stores value under key, unless nx is set and key exists"""
+        if nx and key in self.data:
+            return None
+        self.data[key] = str(value)
+        return True
+
+    def incr(self, key):
+        """Increments the integer under key"""
+        self.data[key] = str(int(self.data.get(key, 0)) + 1)
+        return int(self.data[key])
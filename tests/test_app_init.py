@@ -1,7 +1,13 @@
 """Test suite for APP initialization"""
 import json
+import sys
+from datetime import date, datetime
+from unittest import mock
+from flask import json as flask_json
 from flask_testing import TestCase
+from werkzeug.http import http_date as werkzeug_http_date
 from app import APP
+from app.encoding import FAST_ENCODERS, http_date, json_encoder, load_dumps
 from instance.config import app_config
 
 class AppInitTestCase(TestCase):
@@ -38,3 +44,35 @@ class AppInitTestCase(TestCase):
                 "The requested URL was not found on the server. " + \
                 "If you entered the URL manually please check your spelling and try again."
             )
+
+    def test_fast_json_encoders(self):
+        """
+        Tests that the fast encoders write what the stdlib one does, with
+        datetimes as HTTP dates, and that missing ones fall back to it
+        """
+        payload = dict(
+            id=1, name="pancakes", description="Fry them. é",
+            date_created=datetime(2018, 2, 3, 4, 5, 6, 789),
+            ratings=[4.5, None, True]
+        )
+        default_encoder = APP.json_encoder
+        try:
+            expected = flask_json.dumps(payload, separators=(',', ':'))
+            self.assertIn('"Sat, 03 Feb 2018 04:05:06 GMT"', expected)
+            for name in FAST_ENCODERS:
+                if load_dumps(name) is None:
+                    continue
+                APP.json_encoder = json_encoder(name)
+                encoded = flask_json.dumps(payload, separators=(',', ':'))
+                self.assertEqual(json.loads(encoded), json.loads(expected), name)
+                # keys are still sorted as JSON_SORT_KEYS asks
+                self.assertEqual(encoded.index('"date_created"'), 1, name)
+        finally:
+            APP.json_encoder = default_encoder
+        for value in (datetime(2018, 12, 31, 23, 59, 59, 999999), datetime(2020, 2, 29),
+                      date(2018, 1, 1)):
+            self.assertEqual(http_date(value), werkzeug_http_date(value.timetuple()))
+        with mock.patch.dict(sys.modules, {name: None for name in FAST_ENCODERS}):
+            self.assertIsNone(load_dumps('fast'))
+        with self.assertRaises(ValueError):
+            load_dumps('simplejson')
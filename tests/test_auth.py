@@ -1,9 +1,15 @@
 """Unit testing suite for the app module"""
+import threading
+from datetime import datetime, timedelta
+from unittest import mock
 from flask_testing import TestCase
 from flask import json
+from sqlalchemy.exc import SQLAlchemyError
+from werkzeug.security import generate_password_hash
 from instance.config import app_config
-from app import APP
+from app import APP, hashing
 from app.models import db, User, BlacklistToken
+from app.helpers import TOKEN_CACHE, BLACKLIST_FILTER, RESPONSE_CACHE, USER_GENERATIONS
 
 from .helpers import register_user, login_user, user_details_wrong_email, user_details,\
                      user_details_bad_username, user_details_bad_username_2
@@ -22,6 +28,9 @@ class BaseTestCase(TestCase):
         """Set up tests"""
         db.create_all()
         db.session.commit()
+        TOKEN_CACHE.clear()
+        USER_GENERATIONS.clear()
+        RESPONSE_CACHE.backend.clear()
 
     def tearDown(self):
         """Tear down"""
@@ -60,6 +69,25 @@ class AuthNSTestCase(BaseTestCase):
             self.assertTrue(response.content_type == 'application/json')
             self.assertEqual(response.status_code, 400)
 
+    def test_registration_with_taken_email_or_username(self):
+        """ Test registration clashes are told apart without checking first """
+        with self.client:
+            register_user(self)
+            response = register_user(self, dict(
+                email='Isaac@Yum.my', username='isaac2', password='T3stp@ss'
+            ))
+            data = json.loads(response.data.decode())
+            self.assertEqual(data['message'], 'User already exists. Please Log in instead.')
+            self.assertEqual(response.status_code, 400)
+            response = register_user(self, dict(
+                email='other@yum.my', username='isaac', password='T3stp@ss'
+            ))
+            data = json.loads(response.data.decode())
+            self.assertEqual(
+                data['message'], 'Username already taken, please choose another.'
+            )
+            self.assertEqual(response.status_code, 401)
+
     def test_registration_with_invalid_email(self):
         """ Test for user registration with invalid email """
         # when the email is of invalid format
@@ -231,6 +259,55 @@ class AuthNSTestCase(BaseTestCase):
             self.assertTrue(response.content_type == 'application/json')
             self.assertEqual(response.status_code, 200)
 
+    def test_login_upgrades_outdated_password_hash(self):
+        """ Test that a hash made with an outdated cost is upgraded on login """
+        register_user(self)
+        user = User.query.filter_by(email=user_details['email']).first()
+        user.password = generate_password_hash(
+            user_details['password'], method='pbkdf2:sha256:2000'
+        )
+        db.session.commit()
+        self.assertTrue(hashing.needs_rehash(user.password))
+        with self.client:
+            response = login_user(self)
+            self.assert200(response)
+        user = User.query.filter_by(email=user_details['email']).first()
+        self.assertFalse(hashing.needs_rehash(user.password))
+        self.assertTrue(user.password.startswith(
+            'pbkdf2:sha256:{}$'.format(APP.config['PASSWORD_HASH_ITERATIONS'])
+        ))
+        # the upgraded hash still verifies
+        self.assert200(login_user(self))
+
+    def test_sha512_password_hashes_fit(self):
+        """ Test that sha512 hashes can be stored on registration and on rehash """
+        register_user(self)
+        APP.config['PASSWORD_HASH_ALGORITHM'] = 'sha512'
+        try:
+            with self.client:
+                self.assert200(login_user(self))
+            user = User.query.filter_by(email=user_details['email']).first()
+            self.assertTrue(user.password.startswith('pbkdf2:sha512:'))
+            self.assertGreater(len(user.password), 120)
+            details = dict(email="ann@yum.my", username="ann", password="T3stp@ss")
+            self.assertEqual(register_user(self, details).status_code, 201)
+        finally:
+            APP.config['PASSWORD_HASH_ALGORITHM'] = 'sha256'
+
+    def test_failed_rehash_does_not_block_login(self):
+        """ Test that a hash upgrade which cannot be saved leaves the login alone """
+        register_user(self)
+        user = User.query.filter_by(email=user_details['email']).first()
+        user.password = generate_password_hash(
+            user_details['password'], method='pbkdf2:sha256:2000'
+        )
+        db.session.commit()
+        with mock.patch('app.endpoints.auth.hash_password', return_value='x' * 300):
+            with self.client:
+                self.assert200(login_user(self))
+        user = User.query.filter_by(email=user_details['email']).first()
+        self.assertTrue(user.password.startswith('pbkdf2:sha256:2000$'))
+
     def test_non_registered_user_login(self):
         """ Test for login of non-registered user """
         with self.client:
@@ -272,6 +349,35 @@ class AuthNSTestCase(BaseTestCase):
             self.assertTrue(response.content_type == 'application/json')
             self.assertEqual(response.status_code, 401)
 
+    def test_login_with_saturated_hashing_pool(self):
+        """ Test that logins are turned away while the hashing pool is full """
+        register_user(self)
+        pool = hashing.HashingPool(workers=1, queue_depth=0, timeout=1)
+        started, release = threading.Event(), threading.Event()
+
+        def occupy_pool():
+            """Holds the only hashing thread until released"""
+            started.set()
+            release.wait()
+
+        blocker = threading.Thread(target=pool.run, args=(occupy_pool,))
+        blocker.start()
+        started.wait()
+        default_pool, hashing.HASHING_POOL = hashing.HASHING_POOL, pool
+        try:
+            with self.client:
+                response = login_user(self)
+                data = json.loads(response.data.decode())
+                self.assertEqual(response.status_code, 503)
+                self.assertEqual(response.headers['Retry-After'], '1')
+                self.assertEqual(data['message'], 'The server is busy. Please try again shortly.')
+        finally:
+            hashing.HASHING_POOL = default_pool
+            release.set()
+            blocker.join()
+        # logins go through again once the pool has capacity
+        self.assert200(login_user(self))
+
     def test_valid_logout(self):
         """ Test for logout before token expires """
         with self.client:
@@ -303,6 +409,137 @@ class AuthNSTestCase(BaseTestCase):
             self.assertTrue(data['message'] == 'Logged out successfully.')
             self.assertEqual(response.status_code, 200)
 
+    def test_cached_token_evicted_on_logout(self):
+        """ Test that verified tokens are cached until the user logs out """
+        with self.client:
+            register_user(self)
+            login_resp = login_user(self)
+            auth_header = dict(
+                Authorization=json.loads(login_resp.data.decode())['access_token']
+            )
+            # the first request verifies the token, the second is served from cache
+            response = self.client.get('/api/v1/category', headers=auth_header)
+            self.assert200(response)
+            response = self.client.get('/api/v1/category', headers=auth_header)
+            self.assert200(response)
+            self.assertEqual(TOKEN_CACHE.stats()['hits'], 1)
+            self.assertEqual(TOKEN_CACHE.stats()['size'], 1)
+            # logout evicts the token at once
+            response = self.client.post('/api/v1/auth/logout', headers=auth_header)
+            self.assert200(response)
+            self.assertEqual(TOKEN_CACHE.stats()['size'], 0)
+            response = self.client.get('/api/v1/category', headers=auth_header)
+            self.assert401(response)
+
+    def test_cache_stats_log_line(self):
+        """ Test that workers log their cache counters once an interval has passed """
+        with self.client:
+            register_user(self)
+            auth_header = dict(
+                Authorization=json.loads(login_user(self).data.decode())['access_token']
+            )
+            self.client.get('/api/v1/category', headers=auth_header)
+            with self.assertLogs('app.helpers', 'INFO') as logs:
+                with mock.patch('app.helpers._last_cache_stats', 0):
+                    self.client.get('/api/v1/category', headers=auth_header)
+            stats = json.loads(logs.records[-1].getMessage())
+            self.assertEqual(stats['token_cache']['hits'], 1)
+            self.assertEqual(stats['token_cache']['hit_rate'], 0.5)
+            self.assertIn('observed_false_positive_rate', stats['blacklist_filter'])
+
+    def test_failed_sweep_does_not_fail_logout(self):
+        """ Test that a logout stands when the blacklist sweep after it fails """
+        with self.client:
+            register_user(self)
+            auth_header = dict(
+                Authorization=json.loads(login_user(self).data.decode())['access_token']
+            )
+            response = self.client.get('/api/v1/category', headers=auth_header)
+            self.assert200(response)
+            with mock.patch('app.endpoints.auth.sweep_blacklist',
+                            side_effect=SQLAlchemyError('deadlock detected')):
+                with self.assertLogs('app.endpoints.auth', 'WARNING'):
+                    response = self.client.post('/api/v1/auth/logout', headers=auth_header)
+            data = json.loads(response.data.decode())
+            self.assertEqual(data['status'], 'success')
+            self.assertEqual(TOKEN_CACHE.stats()['size'], 0)
+            response = self.client.get('/api/v1/category', headers=auth_header)
+            self.assert401(response)
+
+    def test_blacklist_filter(self):
+        """ Test that only blacklist filter hits fall through to the database """
+        with self.client:
+            register_user(self)
+            login_resp = login_user(self)
+            access_token = json.loads(login_resp.data.decode())['access_token']
+            response = self.client.post(
+                '/api/v1/auth/logout', headers=dict(Authorization=access_token)
+            )
+            self.assert200(response)
+            # the filter is rebuilt from the blacklist table
+            BLACKLIST_FILTER.rebuild()
+            stats = BLACKLIST_FILTER.stats()
+            self.assertEqual(stats['items'], 1)
+            self.assertIsNotNone(stats['rebuild_seconds'])
+            # a filter hit is confirmed by the exact lookup
+            self.assertTrue(BLACKLIST_FILTER.check(access_token))
+            self.assertEqual(BLACKLIST_FILTER.stats()['filter_hits'], stats['filter_hits'] + 1)
+            # a filter miss needs no lookup at all
+            self.assertFalse(BLACKLIST_FILTER.check("some.unknown.token"))
+            self.assertEqual(BLACKLIST_FILTER.stats()['filter_hits'], stats['filter_hits'] + 1)
+
+    def test_blacklist_filter_rows_committed_out_of_order(self):
+        """ Test that the filter picks up rows committed after a higher id """
+        now = datetime.utcnow()
+        def blacklist_elsewhere(row_id, token, blacklisted_on):
+            # inserted the way another worker's logout shows up here
+            db.session.execute(BlacklistToken.__table__.insert().values(
+                id=row_id, token_hash=BlacklistToken.hash_token(token),
+                expires_on=now + timedelta(hours=1), blacklisted_on=blacklisted_on
+            ))
+            db.session.commit()
+        BLACKLIST_FILTER.rebuild()
+        blacklist_elsewhere(10, "later.token", now)
+        BLACKLIST_FILTER.refresh()
+        # a lower id, blacklisted earlier, whose transaction commits last
+        blacklist_elsewhere(5, "earlier.token", now - timedelta(seconds=2))
+        BLACKLIST_FILTER.refresh()
+        with self.app.app_context():
+            self.assertTrue(BLACKLIST_FILTER.check("earlier.token"))
+            self.assertTrue(BLACKLIST_FILTER.check("later.token"))
+        # rows read again within the overlap are not counted twice
+        items = BLACKLIST_FILTER.stats()['items']
+        BLACKLIST_FILTER.refresh()
+        self.assertEqual(BLACKLIST_FILTER.stats()['items'], items)
+
+    def test_logout_by_token_generation(self):
+        """ Test that logout moves the user to a new token generation when enabled """
+        APP.config['TOKEN_REVOCATION'] = 'generation'
+        try:
+            with self.client:
+                register_user(self)
+                auth_header = dict(
+                    Authorization=json.loads(login_user(self).data.decode())['access_token']
+                )
+                response = self.client.get('/api/v1/category', headers=auth_header)
+                self.assert200(response)
+                response = self.client.post('/api/v1/auth/logout', headers=auth_header)
+                self.assert200(response)
+                # the user was logged out without touching the blacklist
+                self.assertEqual(BlacklistToken.query.count(), 0)
+                user = User.query.filter_by(email=user_details['email']).first()
+                self.assertEqual(user.token_generation, 1)
+                response = self.client.get('/api/v1/category', headers=auth_header)
+                self.assert401(response)
+                # tokens issued for the new generation are accepted
+                auth_header = dict(
+                    Authorization=json.loads(login_user(self).data.decode())['access_token']
+                )
+                response = self.client.get('/api/v1/category', headers=auth_header)
+                self.assert200(response)
+        finally:
+            APP.config['TOKEN_REVOCATION'] = 'blacklist'
+
     def test_valid_blacklisted_token_logout(self):
         """ Test for logout after a valid token gets blacklisted """
         with self.client:
@@ -339,6 +576,25 @@ class AuthNSTestCase(BaseTestCase):
             self.assertTrue(data['message'] == 'Token blacklisted. Please log in again.')
             self.assertEqual(response.status_code, 401)
 
+    def test_expired_blacklisted_tokens_purge(self):
+        """ Test that expired tokens are purged from the blacklist in batches """
+        for i in range(3):
+            db.session.add(BlacklistToken(
+                token="expired.token.{}".format(i),
+                expires_on=datetime.utcnow() - timedelta(days=1)
+            ))
+        db.session.add(BlacklistToken(
+            token="live.token", expires_on=datetime.utcnow() + timedelta(days=1)
+        ))
+        db.session.commit()
+        # tokens are stored as fixed length digests
+        self.assertEqual(len(BlacklistToken.query.first().token_hash), 64)
+        # a limited sweep only purges a single batch
+        self.assertEqual(BlacklistToken.purge_expired(batch_size=2, max_batches=1), 2)
+        self.assertEqual(BlacklistToken.purge_expired(batch_size=2), 1)
+        self.assertEqual(BlacklistToken.query.count(), 1)
+        self.assertTrue(BlacklistToken.check_blacklisted("live.token"))
+
     def test_user_password_reset(self):
         """
         This test ensures that refistered users can reset their
@@ -2,6 +2,8 @@
 This Test suite houses the category endpoint tests
 """
 import json
+from app.helpers import RESPONSE_CACHE
+from app.models import db, Category, User
 from .test_auth import BaseTestCase
 
 # Linting exceptions
@@ -116,6 +118,24 @@ class CategoryTestCase(BaseTestCase):
             self.assertEqual(response.status_code, 400)
             self.assertEqual(response_data['message'], "The category already exists!")
 
+    def test_category_creation_other_constraint_violation(self):
+        """Ensures only name clashes are reported as existing categories"""
+
+        with self.client:
+            register_user(self)
+            access_token = json.loads(login_user(self).data.decode())['access_token']
+            # the owner is gone while its token is still cached
+            response = self.client.get('/api/v1/category', headers=dict(
+                Authorization=access_token
+            ))
+            self.assert200(response)
+            db.session.execute(User.__table__.delete())
+            db.session.commit()
+            response = self.client.post('/api/v1/category', headers=dict(
+                Authorization=access_token
+            ), data=test_category, content_type='application/json')
+            self.assertEqual(response.status_code, 500)
+
     def test_unauthorized_category_creation(self):
         """Ensures that only logged in users can create cartegories"""
 
@@ -239,7 +259,28 @@ class CategoryTestCase(BaseTestCase):
             response_data = json.loads(response.data.decode())
             self.assertEqual(response_data['categories'][0]['name'], "Cookies")
             self.assertTrue('page_details' in response_data)
-            self.assertEqual(response_data['page_details']['pages'], 1)
+            self.assertEqual(response_data['page_details']['pages'], 2)
+            # Follow the cursor to the next page
+            next_cursor = response_data['page_details']['next_cursor']
+            response = test_client.get(
+                '/api/v1/category?per_page=1&cursor=' + next_cursor,
+                headers=auth_header,
+                content_type='application/json'
+            )
+            self.assert200(response, "Categories not retrieved")
+            response_data = json.loads(response.data.decode())
+            self.assertEqual(len(response_data['categories']), 1)
+            self.assertEqual(response_data['categories'][0]['name'], "Pies")
+            self.assertIsNone(response_data['page_details']['next_cursor'])
+            self.assertNotIn('pages', response_data['page_details'])
+            # A tampered cursor is rejected
+            response = test_client.get(
+                '/api/v1/category?cursor=bm90LWEtY3Vyc29y',
+                headers=auth_header,
+                content_type='application/json'
+            )
+            self.assert400(response)
+            self.assertEqual(json.loads(response.data.decode())['message'], "Invalid cursor.")
 
     def test_single_category_retrieval(self):
         """Ensures that a single category can be retrieved"""
@@ -297,6 +338,100 @@ class CategoryTestCase(BaseTestCase):
             response_data = json.loads(response.data.decode())
             self.assertEqual(response_data['message'], "Sorry, category does not exist!")
 
+    def test_category_sparse_fieldsets(self):
+        """Ensures categories can be listed and retrieved with only some fields"""
+
+        with self.client as test_client:
+            register_user(self)
+            login_resp = login_user(self)
+            auth_header = dict(
+                Authorization=json.loads(login_resp.data.decode())['access_token']
+            )
+            test_client.post(
+                '/api/v1/category', headers=auth_header, data=test_category,
+                content_type='application/json'
+            )
+            for url in ('/api/v1/category?fields=name', '/api/v1/category/1?fields=name'):
+                response = test_client.get(url, headers=auth_header)
+                self.assertEqual(response.status_code, 200)
+                response_data = json.loads(response.data.decode())
+                self.assertEqual(list(response_data['categories'][0]), ['name'])
+            # Each fieldset is tagged apart
+            full = test_client.get('/api/v1/category/1', headers=auth_header)
+            self.assertNotEqual(full.headers['ETag'], response.headers['ETag'])
+            response = test_client.get(
+                '/api/v1/category?fields=ingredients', headers=auth_header
+            )
+            self.assertEqual(response.status_code, 422)
+
+    def test_category_conditional_get(self):
+        """Ensures unchanged categories and listings are answered with 304"""
+
+        with self.client as test_client:
+            register_user(self)
+            login_resp = login_user(self)
+            auth_header = dict(
+                Authorization=json.loads(login_resp.data.decode())['access_token']
+            )
+            test_client.post(
+                '/api/v1/category', headers=auth_header, data=test_category,
+                content_type='application/json'
+            )
+            # Single category: strong tag from (id, updated_on)
+            response = test_client.get('/api/v1/category/1', headers=auth_header)
+            self.assertEqual(response.status_code, 200)
+            etag = response.headers['ETag']
+            self.assertFalse(etag.startswith('W/'))
+            response = test_client.get(
+                '/api/v1/category/1', headers=dict(auth_header, **{'If-None-Match': etag})
+            )
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.data, b'')
+            # Listing: weak tag from max(updated_on) and the row count
+            response = test_client.get('/api/v1/category', headers=auth_header)
+            self.assertEqual(response.status_code, 200)
+            list_etag = response.headers['ETag']
+            self.assertTrue(list_etag.startswith('W/'))
+            response = test_client.get(
+                '/api/v1/category', headers=dict(auth_header, **{'If-None-Match': list_etag})
+            )
+            self.assertEqual(response.status_code, 304)
+            # Other pages of the listing are tagged apart
+            response = test_client.get(
+                '/api/v1/category?per_page=1',
+                headers=dict(auth_header, **{'If-None-Match': list_etag})
+            )
+            self.assertEqual(response.status_code, 200)
+            # A write stamped before the newest row but committed after
+            # it leaves max(updated_on) and the count as they were, the
+            # writer's generation still changes the listing's tag
+            categories = Category.__table__
+            db.session.execute(categories.update().values(
+                description="Committed late", updated_on=categories.c.updated_on
+            ))
+            db.session.commit()
+            RESPONSE_CACHE.bump(1)
+            response = test_client.get(
+                '/api/v1/category', headers=dict(auth_header, **{'If-None-Match': list_etag})
+            )
+            self.assertEqual(response.status_code, 200)
+            list_etag = response.headers['ETag']
+            # Edits change both tags
+            response = test_client.put(
+                '/api/v1/category/1', headers=auth_header, data=test_category_update,
+                content_type='application/json'
+            )
+            self.assertEqual(response.status_code, 200)
+            response = test_client.get(
+                '/api/v1/category/1', headers=dict(auth_header, **{'If-None-Match': etag})
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response.headers['ETag'], etag)
+            response = test_client.get(
+                '/api/v1/category', headers=dict(auth_header, **{'If-None-Match': list_etag})
+            )
+            self.assertEqual(response.status_code, 200)
+
     def test_single_category_update(self):
         """Ensures that a single category can be updated"""
 
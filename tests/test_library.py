@@ -0,0 +1,167 @@
+"""
+This is the unit test suite for the library endpoints
+"""
+import gzip
+import json
+from app.models import Recipe
+from .test_auth import BaseTestCase
+from .helpers import register_user, login_user, test_category, test_category_update
+
+# Linting exceptions
+# pylint: disable=C0103
+# pylint: disable=W0201
+
+class LibraryTestCase(BaseTestCase):
+    """
+    This class contains the tests for the library export and import endpoints
+    """
+
+    def set_up(self):
+        """
+        Custom test setup: two categories holding a few recipes
+        """
+        with self.client as test_client:
+            register_resp = register_user(self)
+            self.assertEqual(register_resp.status_code, 201)
+            login_resp = login_user(self)
+            self.assert200(login_resp, "User not logged in")
+            login_resp_data = json.loads(login_resp.data.decode())
+            self.auth_header = dict(
+                Authorization=login_resp_data['access_token']
+            )
+            for category in (test_category, test_category_update):
+                response = test_client.post(
+                    '/api/v1/category', headers=self.auth_header, data=category,
+                    content_type='application/json'
+                )
+                self.assertEqual(response.status_code, 201)
+            for category_id, name in ((2, "Apple pie"), (1, "Pancakes"), (1, "Scones")):
+                response = test_client.post(
+                    '/api/v1/category/{}/recipes'.format(category_id),
+                    headers=self.auth_header,
+                    data=json.dumps(dict(
+                        name=name, ingredients="Flour and butter", description="Bake"
+                    )), content_type='application/json'
+                )
+                self.assertEqual(response.status_code, 201)
+
+    def test_export_resource_security(self):
+        """
+        Ensures that the resource is protected/private
+        """
+        with self.client as test_client:
+            response = test_client.get('/api/v1/library/export')
+            self.assert401(response, "Wrong reponse code: " + str(response.status_code))
+
+    def test_export(self):
+        """
+        Ensures the whole library is streamed as NDJSON, categories first
+        """
+        self.set_up()
+        # Streamed responses are read outside of `with self.client` since
+        # a preserved context would outlive the stream
+        test_client = self.client
+        response = test_client.get('/api/v1/library/export', headers=self.auth_header)
+        self.assert200(response)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertNotIn('Content-Encoding', response.headers)
+        lines = [json.loads(line) for line in response.data.decode().splitlines()]
+        self.assertEqual(
+            [(line['type'], line['name']) for line in lines],
+            [
+                ('category', 'Cookies'), ('category', 'Pies'),
+                ('recipe', 'pancakes'), ('recipe', 'scones'), ('recipe', 'apple_pie')
+            ]
+        )
+        self.assertEqual(lines[2]['category_id'], 1)
+        # Compressed on the fly when the client accepts gzip
+        response = test_client.get(
+            '/api/v1/library/export',
+            headers=dict(self.auth_header, **{'Accept-Encoding': 'gzip'})
+        )
+        self.assert200(response)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(
+            [json.loads(line) for line in gzip.decompress(response.data).splitlines()],
+            lines
+        )
+
+    def other_user_header(self):
+        """
+        Registers and logs in a second user, returning their auth header
+        """
+        details = dict(email="ann@yum.my", username="ann", password="T3stp@ss")
+        response = register_user(self, details)
+        self.assertEqual(response.status_code, 201)
+        response = self.client.post(
+            '/api/v1/auth/login', data=json.dumps(dict(
+                email=details['email'], password=details['password']
+            )), content_type='application/json'
+        )
+        return dict(Authorization=json.loads(response.data.decode())['access_token'])
+
+    def test_import_export(self):
+        """
+        Ensures an export can be imported, gzipped, into another account
+        and that importing it again adds nothing
+        """
+        self.set_up()
+        test_client = self.client
+        dump = test_client.get('/api/v1/library/export', headers=self.auth_header).data
+        auth_header = self.other_user_header()
+        response = test_client.post(
+            '/api/v1/library/import', data=gzip.compress(dump),
+            headers=dict(auth_header, **{'Content-Encoding': 'gzip'}),
+            content_type='application/x-ndjson'
+        )
+        self.assert200(response)
+        response_data = json.loads(response.data.decode())
+        self.assertEqual(response_data['categories'], dict(created=2, existing=0))
+        self.assertEqual(response_data['recipes'], dict(created=3, skipped=0))
+        response = test_client.get('/api/v1/category/4/recipes', headers=auth_header)
+        response_data = json.loads(response.data.decode())
+        self.assertEqual([each['name'] for each in response_data['recipes']], ['apple_pie'])
+        # Imported recipes are linked to their ingredients like created ones
+        recipe = Recipe.query.get(response_data['recipes'][0]['id'])
+        self.assertEqual(
+            sorted(each.name for each in recipe.indexed_ingredients), ['butter', 'flour']
+        )
+        response = test_client.post(
+            '/api/v1/library/import', data=dump, headers=auth_header,
+            content_type='application/x-ndjson'
+        )
+        response_data = json.loads(response.data.decode())
+        self.assertEqual(response_data['categories'], dict(created=0, existing=2))
+        self.assertEqual(response_data['recipes'], dict(created=0, skipped=3))
+
+    def test_import_csv(self):
+        """
+        Ensures CSV rows are imported, with an error for each invalid row
+        """
+        self.set_up()
+        test_client = self.client
+        dump = "\n".join((
+            "type,name,description,ingredients,category",
+            "category,Soups,All my soups.,,",
+            "recipe,Pumpkin soup,Blend,Pumpkin and cream,Soups",
+            "recipe,Oat cookies,Bake,Oats and butter,Cookies",
+            "recipe,Pancakes,Fry,,Cookies",
+            "recipe,Stew,Simmer,Beef,Stews",
+        ))
+        response = test_client.post(
+            '/api/v1/library/import', data=dump, headers=self.auth_header,
+            content_type='text/csv'
+        )
+        self.assert200(response)
+        response_data = json.loads(response.data.decode())
+        self.assertEqual(response_data['categories'], dict(created=1, existing=0))
+        self.assertEqual(response_data['recipes'], dict(created=2, skipped=0))
+        self.assertEqual(
+            [(error['line'], error['message']) for error in response_data['errors']],
+            [(5, 'You provided some invalid details.'), (6, 'Unknown category.')]
+        )
+        response = test_client.post(
+            '/api/v1/library/import', data=dump, headers=self.auth_header,
+            content_type='text/plain'
+        )
+        self.assertEqual(response.status_code, 415)
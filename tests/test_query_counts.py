@@ -0,0 +1,269 @@
+"""
+This test suite guards the number of queries run by the protected endpoints
+"""
+import io
+import json
+from unittest import mock
+from sqlalchemy import event
+from app import LOG_HANDLER
+from app.helpers.instrumentation import (
+    RepeatedQueryError, allow_repeated_queries, fingerprint, start_request
+)
+from app.models import db, Category, Recipe, User, recipe_ingredients
+from .test_auth import BaseTestCase
+from .helpers import register_user, login_user, test_category, test_recipe, count_queries
+
+# Linting exceptions
+# pylint: disable=C0103
+# pylint: disable=W0201
+
+# Queries each protected GET ran when every request re-verified the
+# token and loaded its owner twice
+BASELINE_QUERY_COUNTS = {
+    '/api/v1/category': 5,
+    '/api/v1/category/1': 4,
+    '/api/v1/category/1/recipes': 6,
+    '/api/v1/category/1/recipes/1': 5,
+}
+
+class QueryCountTestCase(BaseTestCase):
+    """This class contains the query count tests for the protected endpoints"""
+
+    def set_up(self):
+        """
+        Custom test setup
+        """
+        with self.client as test_client:
+            register_user(self)
+            login_resp = login_user(self)
+            self.auth_header = dict(
+                Authorization=json.loads(login_resp.data.decode())['access_token']
+            )
+            response = test_client.post(
+                '/api/v1/category', headers=self.auth_header, data=test_category,
+                content_type='application/json'
+            )
+            self.assertEqual(response.status_code, 201)
+            response = test_client.post(
+                '/api/v1/category/1/recipes', headers=self.auth_header, data=test_recipe,
+                content_type='application/json'
+            )
+            self.assertEqual(response.status_code, 201)
+
+    def test_protected_get_query_counts(self):
+        """Ensures the identity is resolved once and reused within a request"""
+
+        self.set_up()
+        with self.client as test_client:
+            for url, baseline in BASELINE_QUERY_COUNTS.items():
+                with count_queries() as statements:
+                    response = test_client.get(url, headers=self.auth_header)
+                self.assert200(response)
+                self.assertLessEqual(
+                    len(statements), baseline - 2,
+                    "{} ran {} queries: {}".format(url, len(statements), statements)
+                )
+                # no user is ever loaded twice in a request
+                user_loads = [each for each in statements if 'FROM users' in each]
+                self.assertLessEqual(len(user_loads), 1)
+
+    def test_create_runs_no_duplicate_check(self):
+        """Ensures creates rely on the unique indexes instead of looking first"""
+
+        self.set_up()
+        with self.client as test_client:
+            with count_queries() as statements:
+                response = test_client.post(
+                    '/api/v1/category', headers=self.auth_header,
+                    data=json.dumps(dict(name="Pies", description="All my pies.")),
+                    content_type='application/json'
+                )
+            self.assertEqual(response.status_code, 201)
+            inserted = [each for each in statements if each.startswith('INSERT INTO categories')]
+            self.assertEqual(len(inserted), 1)
+            self.assertNotIn('FROM categories', statements[0], statements)
+            # a duplicate is turned away by the insert itself
+            with count_queries() as statements:
+                response = test_client.post(
+                    '/api/v1/category', headers=self.auth_header,
+                    data=json.dumps(dict(name="Pies", description="All my pies.")),
+                    content_type='application/json'
+                )
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(len(statements), 1, statements)
+            # the failed insert leaves no start time behind on its connection
+            self.assertEqual(db.session.connection().info.get('query_started'), [])
+
+    def test_batch_create_reads_do_not_grow_with_the_batch(self):
+        """Ensures a batch runs the same reads whatever its size"""
+
+        self.set_up()
+        reads = []
+        with self.client as test_client:
+            # The first batch also adds its ingredients to the dictionary
+            for prefix, size in (("Warm up", 1), ("Small", 3), ("Large", 30)):
+                batch = [
+                    dict(name="{} {}".format(prefix, index), ingredients="Flour, eggs",
+                         description="Bake")
+                    for index in range(size)
+                ]
+                with count_queries() as statements:
+                    response = test_client.post(
+                        '/api/v1/category/1/recipes/batch', headers=self.auth_header,
+                        data=json.dumps(dict(recipes=batch)), content_type='application/json'
+                    )
+                self.assertEqual(response.status_code, 201)
+                reads.append(
+                    [each for each in statements if not each.startswith('INSERT INTO recipes')]
+                )
+        self.assertEqual(len(reads[1]), len(reads[2]))
+
+    def test_writes_take_one_statement(self):
+        """Ensures updates and deletes return what they changed instead of reading first"""
+
+        self.set_up()
+        recipe_update = dict(json.loads(test_recipe), name="Renamed")
+        category_update = dict(json.loads(test_category), name="Renamed")
+        with self.client as test_client:
+            for url, update in (('/api/v1/category/1/recipes/1', recipe_update),
+                                ('/api/v1/category/1', category_update)):
+                with count_queries() as statements:
+                    response = test_client.put(
+                        url, headers=self.auth_header, data=json.dumps(update),
+                        content_type='application/json'
+                    )
+                self.assert200(response)
+                self.assertEqual(len(statements), 1, statements)
+                self.assertTrue(statements[0].startswith('UPDATE'), statements)
+                self.assertIn('RETURNING', statements[0])
+            for url in ('/api/v1/category/1/recipes/1', '/api/v1/category/1'):
+                with count_queries() as statements:
+                    response = test_client.delete(url, headers=self.auth_header)
+                self.assert200(response)
+                self.assertEqual(len(statements), 1, statements)
+                self.assertTrue(statements[0].startswith('DELETE'), statements)
+            # nothing is read back after a create commits either
+            with count_queries() as statements:
+                response = test_client.post(
+                    '/api/v1/category', headers=self.auth_header, data=test_category,
+                    content_type='application/json'
+                )
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(len(statements), 1, statements)
+
+    def test_listings_read_rows_not_entities(self):
+        """Ensures listings map plain rows to payloads without filling the session"""
+
+        self.set_up()
+        loaded = []
+        def on_load(target, context):
+            loaded.append(target)
+        with self.client as test_client:
+            for url, model in (('/api/v1/category', Category),
+                               ('/api/v1/category/1/recipes', Recipe)):
+                event.listen(model, 'load', on_load)
+                try:
+                    response = test_client.get(url + '?per_page=100', headers=self.auth_header)
+                finally:
+                    event.remove(model, 'load', on_load)
+                self.assert200(response)
+                self.assertEqual(loaded, [])
+
+    def test_category_delete_cascades_in_the_database(self):
+        """Ensures deleting a category leaves removing its recipes to the database"""
+
+        self.set_up()
+        with self.client as test_client:
+            batch = [
+                dict(name="Recipe {}".format(index), ingredients="Flour, eggs", description="Bake")
+                for index in range(20)
+            ]
+            response = test_client.post(
+                '/api/v1/category/1/recipes/batch', headers=self.auth_header,
+                data=json.dumps(dict(recipes=batch)), content_type='application/json'
+            )
+            self.assertEqual(response.status_code, 201)
+            with count_queries() as statements:
+                response = test_client.delete('/api/v1/category/1', headers=self.auth_header)
+            self.assert200(response)
+        self.assertEqual(
+            [each for each in statements if 'recipe' in each.split('WHERE')[0].lower()], []
+        )
+        self.assertEqual(Recipe.query.count(), 0)
+        self.assertEqual(db.session.query(recipe_ingredients).count(), 0)
+
+    def test_server_timing_header(self):
+        """Ensures each response reports its query count and database time"""
+
+        self.set_up()
+        with self.client as test_client:
+            with count_queries() as statements:
+                response = test_client.get(
+                    '/api/v1/category/1/recipes', headers=self.auth_header
+                )
+            self.assert200(response)
+            timings = response.headers.getlist('Server-Timing')
+            self.assertTrue(
+                timings[0].startswith('db;desc="{} queries";dur='.format(len(statements))),
+                timings
+            )
+            self.assertTrue(timings[1].startswith('app;dur='), timings)
+            self.app.config['SQL_INSTRUMENTATION'] = False
+            try:
+                response = test_client.get('/api/v1/category', headers=self.auth_header)
+            finally:
+                self.app.config['SQL_INSTRUMENTATION'] = True
+            self.assertNotIn('Server-Timing', response.headers)
+
+    def test_instrumentation_log_line(self):
+        """Ensures each request writes a log line when SQL_INSTRUMENTATION_LOG is on"""
+
+        self.set_up()
+        stream = io.StringIO()
+        self.app.config['SQL_INSTRUMENTATION_LOG'] = True
+        # outside debug mode, as in production
+        self.app.debug = False
+        try:
+            with mock.patch.object(LOG_HANDLER, 'stream', stream):
+                with self.client as test_client:
+                    response = test_client.get('/api/v1/category', headers=self.auth_header)
+        finally:
+            self.app.debug = True
+            self.app.config['SQL_INSTRUMENTATION_LOG'] = False
+        self.assert200(response)
+        line = json.loads(stream.getvalue().split('instrumentation: ', 1)[1])
+        self.assertEqual(line['path'], '/api/v1/category')
+        self.assertEqual(line['status'], 200)
+
+    def test_fingerprint(self):
+        """Ensures statements differing only in their values share a fingerprint"""
+
+        self.assertEqual(
+            fingerprint("SELECT * FROM recipes\n WHERE id IN (1, 2, 3) AND name = 'it''s'"),
+            fingerprint("SELECT * FROM recipes WHERE id IN (%(id_1)s) AND name = %(name_1)s")
+        )
+
+    def test_repeated_queries_are_caught(self):
+        """Ensures a statement or dynamic relationship queried in a loop is flagged"""
+
+        self.set_up()
+        user = User.query.first()
+        for name in ("Pies", "Cakes", "Soups"):
+            db.session.add(Category(name, user.id, "Some recipes."))
+        db.session.commit()
+        with self.app.test_request_context():
+            start_request(self.app)
+            categories = user.categories.all()
+            with self.assertRaisesRegex(RepeatedQueryError, 'Category.recipes'):
+                for each_category in categories:
+                    each_category.recipes.all()
+        with self.app.test_request_context():
+            start_request(self.app)
+            with self.assertRaisesRegex(RepeatedQueryError, 'more than 3 times'):
+                for _ in range(4):
+                    User.query.get(user.id + 1)
+        with self.app.test_request_context():
+            start_request(self.app)
+            with allow_repeated_queries():
+                for _ in range(4):
+                    User.query.get(user.id + 1)
@@ -5,7 +5,7 @@ import json
 from app.helpers import _clean_name
 from .test_auth import BaseTestCase
 from .helpers import register_user, login_user, test_category, test_recipe, test_recipe_update,\
-                     invalid_recipe
+                     invalid_recipe, count_queries
 
 # Linting exceptions
 # pylint: disable=C0103
@@ -201,6 +201,157 @@ class RecipesTestCase(BaseTestCase):
             response_data = json.loads(response.data.decode())
             self.assertEqual(response_data['message'], 'Invalid category!')
 
+    def test_recipes_view_with_cursor(self):
+        """
+        Ensures recipe listings can be paged through with cursors
+        """
+
+        self.set_up()
+        with self.client as test_client:
+            for name in ("First recipe", "Second recipe", "Third recipe"):
+                response = test_client.post(
+                    '/api/v1/category/1/recipes', headers=self.auth_header,
+                    data=json.dumps(dict(
+                        name=name, ingredients="Salt", description="Mix well"
+                    )), content_type='application/json'
+                )
+                self.assertEqual(response.status_code, 201)
+            # Walk the listing in (updated_on, id) order two at a time
+            names = []
+            url = '/api/v1/category/1/recipes?per_page=2&sort=updated_on&cursor='
+            response = test_client.get(
+                '/api/v1/category/1/recipes?per_page=2&sort=updated_on',
+                headers=self.auth_header
+            )
+            while True:
+                self.assert200(response, "Invalid status code: " + str(response.status_code))
+                response_data = json.loads(response.data.decode())
+                names.extend(each['name'] for each in response_data['recipes'])
+                next_cursor = response_data['page_details']['next_cursor']
+                if not next_cursor:
+                    break
+                response = test_client.get(url + next_cursor, headers=self.auth_header)
+            self.assertEqual(names, ['first_recipe', 'second_recipe', 'third_recipe'])
+
+    def test_recipe_conditional_get(self):
+        """
+        Ensures unchanged recipes and recipe listings are answered with 304
+        """
+
+        self.set_up()
+        with self.client as test_client:
+            test_client.post(
+                '/api/v1/category/1/recipes', headers=self.auth_header, data=test_recipe,
+                content_type='application/json'
+            )
+            urls = (
+                ('/api/v1/category/1/recipes/1', 'Pancakes', 304),
+                ('/api/v1/category/1/recipes', 'Waffles', 200),
+            )
+            for url, new_recipe, status_after_create in urls:
+                response = test_client.get(url, headers=self.auth_header)
+                self.assert200(response)
+                etag = response.headers['ETag']
+                conditional = dict(self.auth_header, **{'If-None-Match': etag})
+                response = test_client.get(url, headers=conditional)
+                self.assertEqual(response.status_code, 304)
+                # A new recipe changes the listing's tag but not the recipe's
+                test_client.post(
+                    '/api/v1/category/1/recipes', headers=self.auth_header,
+                    data=json.dumps(dict(
+                        name=new_recipe, ingredients="Salt", description="Mix well"
+                    )), content_type='application/json'
+                )
+                response = test_client.get(url, headers=conditional)
+                self.assertEqual(response.status_code, status_after_create)
+
+    def test_recipe_page_links_keep_query_args(self):
+        """
+        Ensures page links carry every query arg of the listing
+        """
+
+        self.set_up()
+        with self.client as test_client:
+            for name in ("First recipe", "Second recipe", "Third recipe"):
+                test_client.post(
+                    '/api/v1/category/1/recipes', headers=self.auth_header,
+                    data=json.dumps(dict(
+                        name=name, ingredients="Salt", description="Mix well"
+                    )), content_type='application/json'
+                )
+            # the first recipe becomes the most recently updated
+            response = test_client.put(
+                '/api/v1/category/1/recipes/1', headers=self.auth_header,
+                data=json.dumps(dict(
+                    name="First recipe", ingredients="Salt", description="Stir"
+                )), content_type='application/json'
+            )
+            self.assert200(response)
+            response = test_client.get(
+                '/api/v1/category/1/recipes?sort=updated_on&fields=name&per_page=2',
+                headers=self.auth_header
+            )
+            response_data = json.loads(response.data.decode())
+            self.assertEqual(
+                [each['name'] for each in response_data['recipes']],
+                ['second_recipe', 'third_recipe']
+            )
+            next_page = response_data['page_details']['next_page']
+            self.assertIn('sort=updated_on', next_page)
+            self.assertNotIn('?&', next_page)
+            response = test_client.get(next_page, headers=self.auth_header)
+            response_data = json.loads(response.data.decode())
+            self.assertEqual(
+                [each['name'] for each in response_data['recipes']], ['first_recipe']
+            )
+            self.assertIn('sort=updated_on', response_data['page_details']['previous_page'])
+
+    def test_recipes_sparse_fieldsets(self):
+        """
+        Ensures only the requested fields are read and returned
+        """
+
+        self.set_up()
+        with self.client as test_client:
+            for name in ("First recipe", "Second recipe"):
+                test_client.post(
+                    '/api/v1/category/1/recipes', headers=self.auth_header,
+                    data=json.dumps(dict(
+                        name=name, ingredients="Salt", description="Mix well"
+                    )), content_type='application/json'
+                )
+            with count_queries() as statements:
+                response = test_client.get(
+                    '/api/v1/category/1/recipes?fields=id,name&per_page=1',
+                    headers=self.auth_header
+                )
+            self.assert200(response)
+            response_data = json.loads(response.data.decode())
+            self.assertEqual(response_data['recipes'], [dict(id=1, name='first_recipe')])
+            listing = [each for each in statements if 'LIMIT' in each and 'recipes.name' in each]
+            self.assertEqual(len(listing), 1)
+            self.assertNotIn('recipes.description', listing[0])
+            self.assertNotIn('recipes.ingredients', listing[0])
+            # The fieldset is carried to the next page
+            response = test_client.get(
+                response_data['page_details']['next_page'], headers=self.auth_header
+            )
+            response_data = json.loads(response.data.decode())
+            self.assertEqual(response_data['recipes'], [dict(id=2, name='second_recipe')])
+            # Single recipe
+            response = test_client.get(
+                '/api/v1/category/1/recipes/2?fields=name,date_updated',
+                headers=self.auth_header
+            )
+            self.assert200(response)
+            response_data = json.loads(response.data.decode())
+            self.assertEqual(sorted(response_data['recipes'][0]), ['date_updated', 'name'])
+            # Unknown fields are rejected
+            response = test_client.get(
+                '/api/v1/category/1/recipes?fields=name,secret', headers=self.auth_header
+            )
+            self.assertEqual(response.status_code, 422)
+
     def test_single_recipe_retrival_resource_security(self):
         """
         Ensure that this resource is protected from unauthorized use
@@ -449,3 +600,96 @@ class RecipesTestCase(BaseTestCase):
             self.assert404(response, "Invalid status code: " + str(response.status_code))
             response_data = json.loads(response.data.decode())
             self.assertEqual(response_data['message'], "Category does not exist!")
+
+    def test_recipe_batch_create(self):
+        """
+        Ensures a batch of recipes is created with a status for each one
+        """
+
+        self.set_up()
+        with self.client as test_client:
+            test_client.post(
+                '/api/v1/category/1/recipes', headers=self.auth_header, data=test_recipe,
+                content_type='application/json'
+            )
+            batch = [
+                dict(name="Pancakes", ingredients="Flour, milk", description="Fry"),
+                dict(name="Chocolate chip", ingredients="Flour", description="Bake"),
+                dict(name="Waffles", ingredients="", description="Press"),
+                dict(name="pancakes", ingredients="Flour", description="Again"),
+                dict(name="Scones", ingredients="Flour, butter", description="Bake"),
+            ]
+            response = test_client.post(
+                '/api/v1/category/1/recipes/batch', headers=self.auth_header,
+                data=json.dumps(dict(recipes=batch)), content_type='application/json'
+            )
+            self.assertEqual(response.status_code, 207)
+            results = json.loads(response.data.decode())['results']
+            self.assertEqual([result['status'] for result in results], [201, 400, 422, 400, 201])
+            self.assertEqual(results[0]['recipe']['name'], 'pancakes')
+            self.assertEqual(results[1]['message'], 'Recipe already exists!')
+            self.assertIn('ingredients', results[2]['errors'])
+            response = test_client.get(
+                '/api/v1/category/1/recipes?fields=name', headers=self.auth_header
+            )
+            response_data = json.loads(response.data.decode())
+            self.assertEqual(
+                [each['name'] for each in response_data['recipes']],
+                ['chocolate_chip', 'pancakes', 'scones']
+            )
+            # Invalid categories and oversized batches are rejected outright
+            response = test_client.post(
+                '/api/v1/category/2/recipes/batch', headers=self.auth_header,
+                data=json.dumps(dict(recipes=batch[:1])), content_type='application/json'
+            )
+            self.assert400(response)
+            response = test_client.post(
+                '/api/v1/category/1/recipes/batch', headers=self.auth_header,
+                data=json.dumps(dict(recipes=batch[:1] * 101)), content_type='application/json'
+            )
+            self.assert400(response)
+
+    def test_recipe_batch_update_and_delete(self):
+        """
+        Ensures a batch of recipes is updated and deleted with a status
+        for each one
+        """
+
+        self.set_up()
+        with self.client as test_client:
+            batch = [
+                dict(name=name, ingredients="Flour", description="Bake")
+                for name in ("Pancakes", "Waffles", "Scones")
+            ]
+            response = test_client.post(
+                '/api/v1/category/1/recipes/batch', headers=self.auth_header,
+                data=json.dumps(dict(recipes=batch)), content_type='application/json'
+            )
+            self.assertEqual(response.status_code, 201)
+            batch = [
+                dict(id=1, name="Pancakes", ingredients="Eggs", description="Fry"),
+                dict(id=2, name="Scones", ingredients="Eggs", description="Press"),
+                dict(id=3, name="Rock cakes", ingredients="Eggs", description="Bake"),
+                dict(id=9, name="Muffins", ingredients="Eggs", description="Bake"),
+            ]
+            response = test_client.put(
+                '/api/v1/category/1/recipes/batch', headers=self.auth_header,
+                data=json.dumps(dict(recipes=batch)), content_type='application/json'
+            )
+            self.assertEqual(response.status_code, 207)
+            results = json.loads(response.data.decode())['results']
+            self.assertEqual([result['status'] for result in results], [200, 400, 200, 404])
+            self.assertEqual(results[0]['recipe']['ingredients'], 'Eggs')
+            self.assertEqual(results[2]['recipe']['name'], 'rock_cakes')
+            response = test_client.delete(
+                '/api/v1/category/1/recipes/batch?ids=1,3,9', headers=self.auth_header
+            )
+            self.assertEqual(response.status_code, 207)
+            results = json.loads(response.data.decode())['results']
+            self.assertEqual(
+                [(result['id'], result['status']) for result in results],
+                [(1, 200), (3, 200), (9, 404)]
+            )
+            response = test_client.get('/api/v1/category/1/recipes', headers=self.auth_header)
+            response_data = json.loads(response.data.decode())
+            self.assertEqual([each['name'] for each in response_data['recipes']], ['waffles'])
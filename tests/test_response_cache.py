@@ -0,0 +1,198 @@
+"""
+This test suite covers the per-user response cache
+"""
+import importlib
+import io
+import json
+import os
+import tempfile
+from contextlib import redirect_stdout
+from unittest import mock
+import manage
+from instance import config
+from app.helpers import FRAGMENT_CACHE, RESPONSE_CACHE, _make_response_cache
+from app.helpers.cache import LocalBackend, RedisBackend, ResponseCache
+from .test_auth import BaseTestCase
+from .helpers import register_user, login_user, test_category, test_category_update, \
+                     count_queries, FakeRedis, user_details
+
+# Linting exceptions
+# pylint: disable=C0103
+# pylint: disable=W0201
+
+class ResponseCacheTestCase(BaseTestCase):
+    """This class contains the tests for the response cache"""
+
+    def set_up(self):
+        """
+        Custom test setup
+        """
+        with self.client as test_client:
+            register_user(self)
+            login_resp = login_user(self)
+            self.auth_header = dict(
+                Authorization=json.loads(login_resp.data.decode())['access_token']
+            )
+            response = test_client.post(
+                '/api/v1/category', headers=self.auth_header, data=test_category,
+                content_type='application/json'
+            )
+            self.assertEqual(response.status_code, 201)
+
+    def check_cached_listing(self):
+        """Asserts listings are served from the cache until the user writes"""
+
+        with self.client as test_client:
+            response = test_client.get('/api/v1/category', headers=self.auth_header)
+            self.assert200(response)
+            with count_queries() as statements:
+                cached = test_client.get('/api/v1/category', headers=self.auth_header)
+            self.assert200(cached)
+            self.assertEqual(cached.data, response.data)
+            self.assertEqual(cached.headers['ETag'], response.headers['ETag'])
+            self.assertFalse([each for each in statements if 'categories' in each])
+            # the cached entry honours conditional requests
+            response = test_client.get('/api/v1/category', headers=dict(
+                self.auth_header, **{'If-None-Match': cached.headers['ETag']}
+            ))
+            self.assertEqual(response.status_code, 304)
+            # other query args are cached apart
+            response = test_client.get('/api/v1/category?per_page=1', headers=self.auth_header)
+            self.assert200(response)
+            self.assertNotEqual(response.headers['ETag'], cached.headers['ETag'])
+            # a write is seen by the writer straight away
+            test_client.post(
+                '/api/v1/category', headers=self.auth_header,
+                data=json.dumps(dict(name="Pies", description="All my pies.")),
+                content_type='application/json'
+            )
+            response = test_client.get('/api/v1/category', headers=self.auth_header)
+            response_data = json.loads(response.data.decode())
+            self.assertEqual(len(response_data['categories']), 2)
+
+    def test_local_response_cache(self):
+        """Ensures the in-process backend serves and invalidates responses"""
+
+        self.set_up()
+        self.check_cached_listing()
+
+    def test_shared_response_cache(self):
+        """Ensures the redis backend serves and invalidates responses"""
+
+        self.set_up()
+        backend = RESPONSE_CACHE.backend
+        RESPONSE_CACHE.backend = RedisBackend(FakeRedis())
+        try:
+            self.check_cached_listing()
+        finally:
+            RESPONSE_CACHE.backend = backend
+
+    def test_fragment_cache(self):
+        """Ensures listings reuse encoded rows until the rows change"""
+
+        self.set_up()
+        FRAGMENT_CACHE.clear()
+        RESPONSE_CACHE.backend.clear()
+        with self.client as test_client:
+            response = test_client.get('/api/v1/category', headers=self.auth_header)
+            self.assert200(response)
+            self.assertEqual(FRAGMENT_CACHE.stats()['misses'], 1)
+            response = test_client.get('/api/v1/category?per_page=3', headers=self.auth_header)
+            self.assertEqual(FRAGMENT_CACHE.stats()['hits'], 1)
+            # an edit is never served from the old fragment
+            test_client.put(
+                '/api/v1/category/1', headers=self.auth_header, data=test_category_update,
+                content_type='application/json'
+            )
+            response = test_client.get('/api/v1/category', headers=self.auth_header)
+            response_data = json.loads(response.data.decode())
+            self.assertEqual(response_data['categories'][0]['name'], 'Pies')
+            self.assertEqual(response_data['page_details']['item_count'], 1)
+
+    def import_elsewhere(self, response_cache):
+        """
+        Imports a category with manage.py import_library, as run in its
+        own process with response_cache, and returns what it printed
+        """
+        with tempfile.NamedTemporaryFile('w', suffix='.ndjson', delete=False) as dump:
+            dump.write(json.dumps(dict(type='category', name='Soups', description='Hot')))
+        output = io.StringIO()
+        cli_cache = manage.RESPONSE_CACHE
+        manage.RESPONSE_CACHE = response_cache
+        try:
+            with redirect_stdout(output):
+                manage.import_library(user_details['email'], dump.name, 1000)
+        finally:
+            manage.RESPONSE_CACHE = cli_cache
+            os.remove(dump.name)
+        return output.getvalue()
+
+    def test_writes_outside_requests(self):
+        """Ensures imports from the command line invalidate a shared cache only"""
+
+        self.set_up()
+        backend = RESPONSE_CACHE.backend
+        shared = FakeRedis()
+        RESPONSE_CACHE.backend = RedisBackend(shared)
+        try:
+            with self.client as test_client:
+                response = test_client.get('/api/v1/category', headers=self.auth_header)
+                self.assertEqual(len(json.loads(response.data.decode())['categories']), 1)
+            output = self.import_elsewhere(ResponseCache(RedisBackend(shared)))
+            self.assertIn('Imported 1 categories', output)
+            with self.client as test_client:
+                response = test_client.get('/api/v1/category', headers=self.auth_header)
+                self.assertEqual(len(json.loads(response.data.decode())['categories']), 2)
+        finally:
+            RESPONSE_CACHE.backend = backend
+        # a cache local to the server cannot be reached, which is reported
+        generation = RESPONSE_CACHE.generation(1)
+        output = self.import_elsewhere(ResponseCache(LocalBackend()))
+        self.assertIn('RESPONSE_CACHE_BACKEND=redis', output)
+        self.assertEqual(RESPONSE_CACHE.generation(1), generation)
+
+    def test_local_backend_warns_with_several_workers(self):
+        """Ensures the local backend stays the default and warns when it cannot be coherent"""
+
+        try:
+            with mock.patch.dict(os.environ, WEB_CONCURRENCY='4'):
+                os.environ.pop('RESPONSE_CACHE_BACKEND', None)
+                importlib.reload(config)
+            self.assertEqual(config.BaseConfig.RESPONSE_CACHE_BACKEND, 'local')
+            self.assertEqual(config.BaseConfig.WORKERS, 4)
+        finally:
+            importlib.reload(config)
+        with mock.patch.dict(self.app.config, WORKERS=4, RESPONSE_CACHE_BACKEND='local'):
+            with self.assertLogs('app.helpers', 'WARNING') as logs:
+                response_cache = _make_response_cache()
+        self.assertIsInstance(response_cache.backend, LocalBackend)
+        self.assertIn('RESPONSE_CACHE_BACKEND=redis', logs.output[0])
+
+    def test_failing_redis_serves_uncached(self):
+        """Ensures requests are served uncached while redis is unreachable"""
+
+        class UnreachableRedis(FakeRedis):
+            """A redis client whose server is down"""
+            def get(self, key):
+                raise ConnectionError('Connection refused')
+            set = incr = get
+
+        self.set_up()
+        backend = RESPONSE_CACHE.backend
+        RESPONSE_CACHE.backend = RedisBackend(UnreachableRedis())
+        try:
+            with self.client as test_client:
+                for _ in range(2):
+                    with self.assertLogs('app.helpers.cache', 'WARNING'):
+                        response = test_client.get('/api/v1/category', headers=self.auth_header)
+                    self.assert200(response)
+                response = test_client.post(
+                    '/api/v1/category', headers=self.auth_header,
+                    data=json.dumps(dict(name="Pies", description="All my pies.")),
+                    content_type='application/json'
+                )
+                self.assertEqual(response.status_code, 201)
+                response = test_client.get('/api/v1/category', headers=self.auth_header)
+                self.assertEqual(len(json.loads(response.data.decode())['categories']), 2)
+        finally:
+            RESPONSE_CACHE.backend = backend
@@ -0,0 +1,180 @@
+"""
+This is the unit test suite for the search endpoints
+"""
+import json
+from app.models import Recipe
+from .test_auth import BaseTestCase
+from .helpers import register_user, login_user, test_category, test_category_update
+
+# Linting exceptions
+# pylint: disable=C0103
+# pylint: disable=W0201
+
+class SearchTestCase(BaseTestCase):
+    """
+    This class contains the tests for the full-text search endpoint
+    """
+
+    def set_up(self):
+        """
+        Custom test setup: two categories holding a few recipes
+        """
+        with self.client as test_client:
+            register_resp = register_user(self)
+            self.assertEqual(register_resp.status_code, 201)
+            login_resp = login_user(self)
+            self.assert200(login_resp, "User not logged in")
+            login_resp_data = json.loads(login_resp.data.decode())
+            self.auth_header = dict(
+                Authorization=login_resp_data['access_token']
+            )
+            for category in (test_category, test_category_update):
+                response = test_client.post(
+                    '/api/v1/category', headers=self.auth_header, data=category,
+                    content_type='application/json'
+                )
+                self.assertEqual(response.status_code, 201)
+            recipes = (
+                (1, "Chocolate chip", "Flour, butter and chocolate chips", "Bake until golden"),
+                (1, "Oatmeal cookies", "Oats, butter and raisins", "Serve with chocolate milk"),
+                (2, "Apple pie", "Apples, flour and butter", "Bake for an hour"),
+            )
+            for category_id, name, ingredients, description in recipes:
+                response = test_client.post(
+                    '/api/v1/category/{}/recipes'.format(category_id),
+                    headers=self.auth_header,
+                    data=json.dumps(dict(
+                        name=name, ingredients=ingredients, description=description
+                    )), content_type='application/json'
+                )
+                self.assertEqual(response.status_code, 201)
+
+    def test_search_resource_security(self):
+        """
+        Ensures that the resource is protected/private
+        """
+        with self.client as test_client:
+            response = test_client.get('/api/v1/search/recipes?q=butter')
+            self.assert401(response, "Wrong reponse code: " + str(response.status_code))
+            response_data = json.loads(response.data.decode())
+            self.assertEqual(response_data['message'], "Please provide an access token!")
+
+    def test_search_ranks_across_categories(self):
+        """
+        Ensures matches come from every category, best match first,
+        with highlighted snippets
+        """
+        self.set_up()
+        with self.client as test_client:
+            response = test_client.get(
+                '/api/v1/search/recipes?q=butter', headers=self.auth_header
+            )
+            self.assert200(response, "Invalid status code: " + str(response.status_code))
+            response_data = json.loads(response.data.decode())
+            self.assertEqual(
+                sorted(each['category_id'] for each in response_data['recipes']), [1, 1, 2]
+            )
+            # A name match outranks an ingredient match which outranks a description one
+            response = test_client.get(
+                '/api/v1/search/recipes?q=chocolate', headers=self.auth_header
+            )
+            response_data = json.loads(response.data.decode())
+            names = [each['name'] for each in response_data['recipes']]
+            self.assertEqual(names, ['chocolate_chip', 'oatmeal_cookies'])
+            self.assertIn('<b>chocolate</b>', response_data['recipes'][1]['snippet'])
+            # No matches
+            response = test_client.get(
+                '/api/v1/search/recipes?q=pumpkin', headers=self.auth_header
+            )
+            self.assert404(response)
+            response_data = json.loads(response.data.decode())
+            self.assertEqual(response_data['message'], 'No recipes match your search.')
+
+    def test_search_with_cursor(self):
+        """
+        Ensures search results can be paged through with cursors
+        """
+        self.set_up()
+        with self.client as test_client:
+            names = []
+            url = '/api/v1/search/recipes?q=butter&per_page=2'
+            response = test_client.get(url, headers=self.auth_header)
+            while True:
+                self.assert200(response, "Invalid status code: " + str(response.status_code))
+                response_data = json.loads(response.data.decode())
+                names.extend(each['name'] for each in response_data['recipes'])
+                next_cursor = response_data['page_details']['next_cursor']
+                if not next_cursor:
+                    break
+                response = test_client.get(
+                    url + '&cursor=' + next_cursor, headers=self.auth_header
+                )
+            self.assertEqual(
+                sorted(names), ['apple_pie', 'chocolate_chip', 'oatmeal_cookies']
+            )
+            response = test_client.get(url + '&cursor=WyJhIiwgMV0', headers=self.auth_header)
+            self.assert400(response)
+            response_data = json.loads(response.data.decode())
+            self.assertEqual(response_data['message'], 'Invalid cursor.')
+
+    def test_recipe_ingredients_are_indexed(self):
+        """
+        Ensures recipes are linked to the canonical names of their
+        ingredients when they are written
+        """
+        self.set_up()
+        with self.client as test_client:
+            recipe = Recipe.query.filter_by(name='oatmeal_cookies').first()
+            self.assertEqual(
+                sorted(each.name for each in recipe.indexed_ingredients),
+                ['butter', 'oat', 'raisin']
+            )
+            response = test_client.put(
+                '/api/v1/category/1/recipes/{}'.format(recipe.id), headers=self.auth_header,
+                data=json.dumps(dict(
+                    name='Oatmeal cookies', ingredients="Rolled oats, 2 Eggs and honey",
+                    description="Serve warm"
+                )), content_type='application/json'
+            )
+            self.assert200(response)
+            recipe = Recipe.query.filter_by(name='oatmeal_cookies').first()
+            self.assertEqual(
+                sorted(each.name for each in recipe.indexed_ingredients),
+                ['egg', 'honey', 'oat']
+            )
+
+    def test_pantry_search(self):
+        """
+        Ensures recipes are ranked by the pantry items they use, then by
+        the fewest missing ingredients
+        """
+        self.set_up()
+        with self.client as test_client:
+            response = test_client.get(
+                '/api/v1/search/pantry?items=Butter,flour,unicorn dust&per_page=2',
+                headers=self.auth_header
+            )
+            self.assert200(response, "Invalid status code: " + str(response.status_code))
+            response_data = json.loads(response.data.decode())
+            self.assertEqual(response_data['unmatched'], ['unicorn dust'])
+            ranked = [
+                (each['name'], each['matched'], each['missing'])
+                for each in response_data['recipes']
+            ]
+            self.assertEqual(ranked, [('apple_pie', 2, 1), ('chocolate_chip', 2, 1)])
+            response = test_client.get(
+                response_data['page_details']['next_page'], headers=self.auth_header
+            )
+            self.assert200(response)
+            response_data = json.loads(response.data.decode())
+            ranked = [
+                (each['name'], each['matched'], each['missing'])
+                for each in response_data['recipes']
+            ]
+            self.assertEqual(ranked, [('oatmeal_cookies', 1, 2)])
+            self.assertIsNone(response_data['page_details']['next_page'])
+            # Nothing in the pantry is used by any recipe
+            response = test_client.get(
+                '/api/v1/search/pantry?items=tofu', headers=self.auth_header
+            )
+            self.assert404(response)